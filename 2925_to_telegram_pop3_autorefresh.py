@@ -14,19 +14,97 @@ OTP_MIN=6                     # 最小位数（默认6）
 OTP_MAX=8                     # 最大位数
 WINDOW_NEAR=120               # 关键词近邻窗口大小（字符数）
 ALLOW_CODE_IN_URL=0           # 是否允许落在 URL/邮箱中的数字
+MAX_BODY_CHARS=200000         # 最多解码的正文字符数（先看主题和正文开头，找不到才继续往后解码）；0=不限
 NEAR_KEYS_EXTRA=              # 追加正向关键词，逗号分隔
 NEG_KEYS_EXTRA=               # 追加负向关键词，逗号分隔
+CODE_RULES_FILE=code_rules.json  # 按发件人的专用规则（见 code_rules.py），先于通用识别；改文件后自动重新加载
+
+# —— 多账号（单进程并发监听多个邮箱）——
+ACCOUNTS_FILE=accounts.json   # 账号列表（JSON）；设置后忽略 EMAIL_USER/EMAIL_PASS
+                              # [{"user":"a@2925.com","pass":"..."},
+                              #  {"user":"b@2925.com","pass":"...","chat":"-100123"}]
+                              # 可选字段：host/port_ssl/port_plain/token/chat/proxy（缺省取环境变量）
+
+# —— 去重持久化（与 imap_idle_forwarder 共用，见 dedup_store.py）——
+DEDUP_DB_PATH=.seen_uids.sqlite3
+DEDUP_MAX_ENTRIES=200000
+
+# —— 长连接（同一连接内轮询，只在出错/服务器断开时重连）——
+STALE_SESSION_SECONDS=10      # 会话内邮件列表 N 秒没有变化就重新登录一次：部分服务器只提供登录时的快照，
+                              # 会话内永远看不到新信；会话内见到过新信（服务器是实时视图）后不再检查。0=关闭
+STALE_SESSION_MAX=300         # 还不确定服务器类型时，重新登录后也没有新信就按 2 倍退避，最长这么多秒检查一次
+
+# —— 多副本（同一台机器上几个进程分摊 ACCOUNTS_FILE 里的账号，副本挂了其余的几秒内接管，见 replica_lease.py）——
+REPLICA_LEASES=1              # 所有副本指向同一个 DEDUP_DB_PATH；租约、去重记录、启动标记都在它旁边
+REPLICA_LEASE_SECONDS=5
+
+# —— 自适应轮询（见 poll_scheduler.py）——
+POLL_MIN_SECONDS=1            # 收到新信 / 外部触发之后的轮询间隔
+POLL_MAX_SECONDS=30           # 空闲时按 POLL_BACKOFF 倍数退避到的最长间隔
+EXPECT_SECONDS=120            # 本地接口 POST /expect?user=...&seconds=120 触发后按最短间隔轮询的时长
+                              # 只设 POLL_SECONDS（旧配置）时按固定间隔轮询
+
+# —— 最近验证码查询（内存缓存 + 本地 HTTP 长轮询，取代 latest_code.txt，见 code_cache.py）——
+CODES_KEEP=200                # 内存里保留的条数；本地接口 GET /codes、GET /codes/wait?sender=...&after=<Unix 时间>
+
+# —— 命令流水线（RFC 2449 PIPELINING；启动补扫、一次轮询到多封新信时省掉逐封等待的往返）——
+POP3_PIPELINING=1             # 0=始终逐条收发
+PIPELINE_DEPTH=10             # 一批最多连发几条 TOP/RETR
+
+# —— 按收件地址路由（子地址/别名 → 不同团队的 chat，见 routing.py）——
+ROUTES_FILE=routes.json       # [{"name":"team-a","to":["teama@2925.com","teama-*@2925.com"],"chats":["-100111","-100222"]}]
+                              # 没有命中的邮件照常发到 TELEGRAM_CHAT_ID / 账号的 chat；改文件后自动重新加载
+
+# —— 建连（995/SSL 与 110+STLS 竞速，记住上次成功的方式并复用 TLS 会话，见 fast_connect.py）——
+CONNECT_RACE_DELAY=0.3        # 首选方式多久没连上就并行尝试另一种（秒）
+
+# —— Telegram 推送（连接池 + 发送队列 + 令牌桶限速，见 tg_delivery.py）——
+TG_API_BASE=https://api.telegram.org
+TG_WORKERS=4  TG_CHAT_RATE=1  TG_CHAT_BURST=3  TG_GLOBAL_RATE=30
+TG_MERGE_BACKLOG=5            # 积压 ≥ N 条时元信息与验证码合并成一条
+
+# —— 本地 HTTP 接口（GET /metrics、POST /expect、GET /status、GET /codes 都在这一个端口上，见 local_http.py）——
+LOCAL_PORT=9108               # 不设则不监听；旧的 METRICS_PORT / EXPECT_PORT / CODES_PORT 仍然有效
+
+# —— 运行指标（分阶段耗时、端到端延迟、重连/429 计数，见 metrics.py；LOCAL_PORT 和下面都不设则关闭）——
+METRICS_LOG_EVERY=300         # 每 N 秒在日志输出一行摘要
+
+# —— 流水线（收信线程只取字节 → 解析线程识别 → 发送队列，见 pipeline.py）——
+PARSE_WORKERS=2               # 解析/识别工作线程数（同一账号固定在同一线程，保证顺序）
+PIPELINE_QUEUE_MAX=100        # 解析队列上限；满了收信线程暂停（背压）
+DRAIN_TIMEOUT=10              # 收到 SIGTERM/Ctrl-C 后最多等多少秒把队列处理并发完
 """
 
-import os, re, time, ssl, poplib, email, requests, hashlib
+import os, re, json, time, poplib, email, queue, requests, hashlib, threading
+from bisect import bisect_left, bisect_right
 from email.header import decode_header, make_header
 from email.utils import parsedate_to_datetime
 from datetime import datetime, timezone, timedelta
+from dedup_store import open_store
+from tg_delivery import get_delivery
+from mail_text import iter_body_text
+import metrics
+import pipeline
+import fast_connect
+import code_rules
+import poll_scheduler
+import code_cache
+import local_http
+import first_seen
+import replica_lease
+import routing
 
 # ====== 运行参数 ======
 FETCH_STARTUP_LAST_N = int(os.getenv("FETCH_STARTUP_LAST_N", "2"))   # 启动最多补扫 N 条（仅一次）
-POLL_SECONDS         = float(os.getenv("POLL_SECONDS", "2"))         # 轮询间隔（秒）
-RECONNECT_EVERY      = float(os.getenv("RECONNECT_EVERY", "10"))     # 每 N 秒强制重连
+RECONNECT_EVERY      = float(os.getenv("RECONNECT_EVERY", "0"))      # 0=长连接，仅出错/服务器超时才重连；>0 则每 N 秒强制刷新会话
+NOOP_EVERY           = float(os.getenv("NOOP_EVERY", "30"))          # 连接空闲超过 N 秒发 NOOP 保活
+STALE_SESSION_SECONDS = float(os.getenv("STALE_SESSION_SECONDS", "10")) # 会话内 N 秒无变化就重新登录（识别快照式服务器）；0=关闭
+STALE_SESSION_MAX    = float(os.getenv("STALE_SESSION_MAX", "300"))  # 重新登录也没有新信时的退避上限
+TOP_LINES            = int(os.getenv("TOP_LINES", "60"))             # 先用 TOP 取头部+前 N 行正文识别；0=直接 RETR
+MAX_MSG_BYTES        = int(os.getenv("MAX_MSG_BYTES", "2097152"))    # 单封邮件最多读入内存的字节数（超出丢弃）；0=不限
+MAX_BODY_CHARS       = int(os.getenv("MAX_BODY_CHARS", "200000"))    # 识别验证码时最多解码的正文字符数；0=不限
+POP3_PIPELINING      = os.getenv("POP3_PIPELINING", "1") == "1"      # 服务器在 CAPA 里声明 PIPELINING 时批量发 TOP/RETR
+PIPELINE_DEPTH       = max(1, int(os.getenv("PIPELINE_DEPTH", "10"))) # 一批最多连发几条命令（响应按顺序读回）
 # 文本大间隔（EM 空格，复制时保留）
 EMSP = "\u2003"
 GAP  = EMSP * 6
@@ -66,6 +144,20 @@ NEG_KEYS = [k.lower() for k in (NEG_KEYS_BASE + NEG_KEYS_EXTRA)]
 CODE_RE = re.compile(r"(?<!\d)(?:\d[\s-]?){%d,%d}(?!\d)" % (OTP_MIN, OTP_MAX))
 _URL_RE   = re.compile(r'https?://[^\s<>"]+')
 _EMAIL_RE = re.compile(r'[\w\.-]+@[\w\.-]+\.\w+')
+_HTTP_RE  = re.compile(r'https?://')
+_URL_SEP_RE = re.compile(r'[\s<>"]')      # _URL_RE 中断 URL 的字符
+
+def _keyword_scanner(keys):
+    """把关键词编译成一个前瞻正则：一次扫描即可得到每个位置起始的"最短"关键词（按长度排序，先匹配短的）"""
+    keys = sorted({k for k in keys if k}, key=len)
+    if not keys:
+        return None
+    first = "".join(sorted({re.escape(k[0]) for k in keys}))   # 先用首字符集快速跳过不可能的位置
+    return re.compile("(?=[%s])(?=(%s))" % (first, "|".join(re.escape(k) for k in keys)))
+
+_NEAR_SCAN = _keyword_scanner(NEAR_KEYS)
+_NEG_SCAN  = _keyword_scanner(NEG_KEYS)
+_KEYS_HAVE_SIGMA = any(c in k for k in NEAR_KEYS + NEG_KEYS for c in "σς")
 
 # ====== 工具函数 ======
 def dec(s):
@@ -76,27 +168,8 @@ def dec(s):
         return s or ""
 
 def body_text(msg):
-    if msg.is_multipart():
-        for p in msg.walk():
-            if p.get_content_type()=="text/plain" and "attachment" not in str(p.get("Content-Disposition") or ""):
-                try:
-                    return p.get_payload(decode=True).decode(p.get_content_charset() or "utf-8","ignore")
-                except Exception:
-                    pass
-        for p in msg.walk():
-            if p.get_content_type()=="text/html":
-                from html import unescape; import re as _r
-                try:
-                    h = p.get_payload(decode=True).decode(p.get_content_charset() or "utf-8","ignore")
-                    return _r.sub(r"\s+"," ", _r.sub(r"<[^>]+>"," ", unescape(h)))
-                except Exception:
-                    pass
-    else:
-        try:
-            return msg.get_payload(decode=True).decode(msg.get_content_charset() or "utf-8","ignore")
-        except Exception:
-            return ""
-    return ""
+    """整段正文（text/plain 优先，其次 HTML 转纯文本）；识别验证码走 extract_code_lazy，只解码需要的部分"""
+    return "".join(iter_body_text(msg))
 
 # —— 时间解析：优先顶层 Received（越靠上越新），否则 Date
 def _parse_received_dt(msg):
@@ -143,18 +216,16 @@ def mail_time_str_ymd(msg):
     dt2 = _to_target_tz(dt) or dt
     return dt2.strftime(TIME_FMT)
 
-# —— Telegram 发送
-def send_tg(token, chat_id, text, proxy=None, max_attempts=3):
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    proxies = {"http":proxy,"https":proxy} if proxy else None
-    sleep = 1
+# —— Telegram 同步发送（只用于启动通知；邮件推送走 send_meta_then_code 的发送队列）
+def send_tg(token, chat_id, text, proxy=None, max_attempts=3):
+    delivery = get_delivery(token, proxy)
+    sleep = 1
     for attempt in range(1, max_attempts + 1):
         try:
-            resp = requests.post(
-                url,
+            resp = delivery.session.post(
+                delivery.url,
                 data={"chat_id": chat_id, "text": text},
                 timeout=10,
-                proxies=proxies,
             )
             if resp.ok:
                 return True
@@ -184,21 +255,104 @@ def send_tg(token, chat_id, text, proxy=None, max_attempts=3):
 
 # —— POP3 连接
 def connect_pop3(host, user, pwd, port_ssl=995, port_plain=110):
-    try:
-        ctx = ssl.create_default_context()
-        srv = poplib.POP3_SSL(host, port_ssl, context=ctx, timeout=10)
-        srv.user(user); srv.pass_(pwd)
-        print("[POP3] 995/SSL")
-        return srv
-    except Exception as e:
-        print("[POP3] 995 失败，用 110+STLS/PLAIN：", e)
+    """995/SSL 与 110+STLS 竞速（见 fast_connect.py）：记住上次成功的方式、复用 TLS 会话，登录只做一次"""
+    ctx = fast_connect.tls_context(host)
+
+    def via_ssl():
+        return poplib.POP3_SSL(host, port_ssl, context=ctx, timeout=10), True
+
+    def via_plain():
         srv = poplib.POP3(host, port_plain, timeout=10)
         try:
-            srv.stls(); print("[POP3] 110 已升级 STLS")
+            srv.stls(ctx)
+            return srv, True
         except Exception:
-            print("[POP3] 110 明文（仅在可信网络用）")
+            return srv, False
+
+    name, srv, secure = fast_connect.race(host, [(f"{port_ssl}/SSL", via_ssl), (f"{port_plain}/STLS", via_plain)],
+                                          close=lambda s: s.close())
+    try:
         srv.user(user); srv.pass_(pwd)
-        return srv
+    except Exception:
+        fast_connect.forget(host)
+        srv.close()
+        raise
+    if secure:
+        fast_connect.remember_session(host, srv.sock)
+    srv.pipelining = POP3_PIPELINING and _has_pipelining(srv)
+    return srv
+
+def _has_pipelining(srv):
+    """登录后的 CAPA 里有 PIPELINING 才启用；服务器不认 CAPA 时按不支持处理"""
+    try:
+        return "PIPELINING" in srv.capa()
+    except poplib.error_proto as e:
+        if not e.args or not isinstance(e.args[0], bytes):
+            raise
+        return False
+
+class Pop3Session:
+    """POP3 长连接：空闲时 NOOP 保活，只在出错或服务器断开/超时后重连；记录会话时长与重连次数"""
+
+    def __init__(self, host, user, pwd, port_ssl=995, port_plain=110):
+        self.host, self.user, self.pwd = host, user, pwd
+        self.port_ssl, self.port_plain = port_ssl, port_plain
+        self.srv = None
+        self.opened_at = 0.0
+        self.last_cmd = 0.0
+        self.sessions = 0        # 累计建立的会话数
+        self.reconnects = 0      # 第一次之后的每次建连都算一次重连
+        self.closed = 0
+        self.total_seconds = 0.0
+        self.longest = 0.0
+        # 快照检测：live=会话内见到过新信（实时视图）；stale_view=因无变化重新登录前看到的 (数量, 末尾 UID)
+        self.live = False
+        self.snapshot = False
+        self.stale_after = STALE_SESSION_SECONDS
+        self.stale_view = None
+
+    def open(self):
+        if self.srv is not None:
+            return self.srv
+        with metrics.timer("connect", proto="pop3"):
+            self.srv = connect_pop3(self.host, self.user, self.pwd, self.port_ssl, self.port_plain)
+        self.opened_at = self.last_cmd = time.time()
+        if self.sessions:
+            self.reconnects += 1
+            metrics.inc("reconnects_total", proto="pop3")
+        self.sessions += 1
+        return self.srv
+
+    def touch(self):
+        self.last_cmd = time.time()
+
+    def age(self):
+        return time.time() - self.opened_at if self.srv is not None else 0.0
+
+    def keepalive(self):
+        """距上一条命令超过 NOOP_EVERY 秒才发 NOOP；轮询本身也算活动"""
+        if self.srv is not None and time.time() - self.last_cmd >= NOOP_EVERY:
+            self.srv.noop()
+            self.touch()
+
+    def close(self, reason="", graceful=True):
+        if self.srv is None:
+            return
+        srv, self.srv = self.srv, None
+        try:
+            srv.quit() if graceful else srv.close()
+        except Exception:
+            pass
+        dur = time.time() - self.opened_at
+        self.closed += 1
+        self.total_seconds += dur
+        self.longest = max(self.longest, dur)
+        print(f"[POP3] {self.user} 会话结束（{reason or '正常退出'}），持续 {dur:.0f}s；{self.summary()}")
+
+    def summary(self):
+        avg = self.total_seconds / self.closed if self.closed else self.age()
+        return (f"累计会话 {self.sessions} 次，重连 {self.reconnects} 次，"
+                f"平均时长 {avg:.0f}s，最长 {max(self.longest, self.age()):.0f}s")
 
 def uidl_map(srv):
     try:
@@ -210,40 +364,216 @@ def uidl_map(srv):
     except Exception:
         return {}
 
+class UidlTracker:
+    """增量检测新邮件：先 STAT 比较数量，只对新增编号发 `UIDL n`；
+    数量变少或末尾 UID 对不上（删除/重新编号）时才全量 UIDL 重同步。服务器不支持 UIDL 时按数量增长判断"""
+
+    def __init__(self):
+        self.uids = {}          # 编号 → UID（当前会话视图）
+        self.count = 0
+        self.supported = True
+        self.full_syncs = 0
+
+    def resync(self, srv, total=None):
+        if total is None:
+            total, _ = srv.stat()
+        self.uids = uidl_map(srv)
+        self.count = total
+        self.supported = bool(self.uids) or total == 0
+        self.full_syncs += 1
+        return self.uids
+
+    @staticmethod
+    def _parse_uid(resp):
+        if isinstance(resp, Exception):
+            return None
+        parts = resp.decode("utf-8","ignore").split()
+        return parts[2] if len(parts) >= 3 else None
+
+    def _uid_at(self, srv, num):
+        try:
+            return self._parse_uid(srv.uidl(num))
+        except poplib.error_proto:
+            return None
+
+    def _uids_at(self, srv, nums):
+        """依次产出各编号的 UID：支持 PIPELINING 时每 PIPELINE_DEPTH 条 `UIDL n` 一批连发，否则逐条按需发送"""
+        if not getattr(srv, "pipelining", False) or len(nums) < 2:
+            yield from (self._uid_at(srv, n) for n in nums)
+            return
+        for i in range(0, len(nums), PIPELINE_DEPTH):
+            batch = nums[i:i + PIPELINE_DEPTH]
+            yield from map(self._parse_uid, pipeline_batch(srv, [f"UIDL {n}" for n in batch], lambda s: s._getresp()))
+
+    def poll(self, srv):
+        """返回新出现的 [(编号, UID)]，按编号升序；全量重同步时返回整个列表，由调用方按 seen_uids 过滤。
+        不支持 UIDL 时 UID 为 None（编号会复用，不能拿来去重）"""
+        total, _ = srv.stat()
+        prev = self.count
+        if not self.supported:
+            self.count = total
+            return [(n, None) for n in range(prev+1, total+1)]
+        uids = self._uids_at(srv, list(range(max(prev, 1), total+1))) if total >= prev else None
+        if uids is not None and (prev == 0 or next(uids) == self.uids.get(prev)):
+            new = []
+            for n in range(prev+1, total+1):
+                uid = next(uids)
+                if uid is None: break
+                self.uids[n] = uid; new.append((n, uid))
+            else:
+                self.count = total
+                return new
+        # 数量变少 / 末尾 UID 变了 / UIDL n 失败：有删除或重新编号，全量重同步
+        self.resync(srv, total)
+        if not self.supported:
+            return [(n, None) for n in range(prev+1, total+1)]
+        return sorted(self.uids.items())
+
+def _read_multiline(srv, cap=0):
+    """读取多行响应直到单独的 "."；累计超过 cap 字节后只读不存（连接状态保持正确）"""
+    lines, size = [], 0
+    line, _ = srv._getline()
+    while line != b".":
+        if line.startswith(b".."):
+            line = line[1:]
+        size += len(line) + 2
+        if not cap or size <= cap:
+            lines.append(line)
+        line, _ = srv._getline()
+    return lines, size
+
+def _body_line_count(lines):
+    try:
+        return len(lines) - lines.index(b"") - 1
+    except ValueError:
+        return 0
+
+def fetch_lines(srv, num, top_lines=0):
+    """RETR（或 TOP 头部+前 top_lines 行），按 MAX_MSG_BYTES 截断；返回 (行列表, 是否拿到整封邮件)。
+    poplib 的 retr/top 会把整封读进内存，这里直接用其底层读行接口以便限额"""
+    srv._putcmd(f"TOP {num} {top_lines}" if top_lines else f"RETR {num}")
+    return _read_fetch(srv, top_lines)
+
+def _read_fetch(srv, top_lines):
+    """读一条已发出的 TOP/RETR 的响应；-ERR 以 poplib.error_proto 抛出，连接状态仍然正确"""
+    srv._getresp()
+    lines, size = _read_multiline(srv, MAX_MSG_BYTES)
+    metrics.inc("fetched_bytes_total", size, proto="pop3")
+    complete = not MAX_MSG_BYTES or size <= MAX_MSG_BYTES
+    if top_lines and complete:
+        complete = _body_line_count(lines) < top_lines   # 正文不足 N 行 → TOP 已是全文
+    return lines, complete
+
+def pipeline_batch(srv, cmds, read):
+    """PIPELINING：一次写出整批命令，再按顺序用 read(srv) 读回各自的响应。
+    返回与 cmds 对应的列表，某条命令回 -ERR 时该项是 error_proto（其余照常读完，连接状态保持正确）；
+    连接层错误直接抛出（会话随之重连）"""
+    srv.sock.sendall("".join(c + "\r\n" for c in cmds).encode(srv.encoding))   # 合成一次写，避免 Nagle 拖慢后面的命令
+    out = []
+    for _ in cmds:
+        try:
+            out.append(read(srv))
+        except poplib.error_proto as e:
+            if not e.args or not isinstance(e.args[0], bytes):
+                raise
+            out.append(e)
+    return out
+
+def fetch_lines_pipelined(srv, nums, top_lines=0):
+    """一批 TOP/RETR：每项是 (行列表, 是否完整) 或 -ERR"""
+    return pipeline_batch(srv, [f"TOP {n} {top_lines}" if top_lines else f"RETR {n}" for n in nums],
+                          lambda s: _read_fetch(s, top_lines))
+
 def fetch_msg(srv, num):
-    resp, lines, _ = srv.retr(num)
-    raw = b"\r\n".join(lines)
-    return email.message_from_bytes(raw)
+    lines, _ = fetch_lines(srv, num)
+    return email.message_from_bytes(b"\r\n".join(lines))
 
 # —— 验证码提取（严格防误报）
 def _overlaps(a0, a1, b0, b1): return not (a1 <= b0 or b1 <= a0)
 def _slice(text, s, e, extra): lo=max(0, s-extra); hi=min(len(text), e+extra); return text[lo:hi], lo, hi
 
-def _in_url_or_email(hay, s, e):
+def _in_email(hay, s, e):
     win, base, _ = _slice(hay, s, e, extra=200)
-    for m in _URL_RE.finditer(win):
-        if _overlaps(s, e, base+m.start(), base+m.end()): return True
     for m in _EMAIL_RE.finditer(win):
         if _overlaps(s, e, base+m.start(), base+m.end()): return True
     return False
 
-def extract_code(body_text_str: str, subject: str = "", from_str: str = "") -> str | None:
-    subj = subject or ""
-    body = body_text_str or ""
-    hay  = subj + "\n" + body
+class _HayScan:
+    """每封邮件只扫描一遍：URL 起点、邮箱区间、正负关键词的命中位置；候选数字用二分查找按区间判定。
+    判定结果与逐候选开窗口扫描（前后 200 字符里找 URL/邮箱 + 窗口关键词）完全一致（test_extract_code.py 对照）"""
+
+    def __init__(self, hay):
+        self.hay = hay
+        self._links = None
+        self.near = self.neg = None
+        low = hay.lower()
+        # lower() 改变长度（如 "İ"）或希腊字母 Σ 的词尾形式依赖上下文时，位置无法一一对应，退回逐窗口判断
+        self.exact = len(low) == len(hay) and not (_KEYS_HAVE_SIGMA and "Σ" in hay)
+        if self.exact:
+            self.near = self._hits(_NEAR_SCAN, low)
+            self.neg  = self._hits(_NEG_SCAN, low)
+
+    @staticmethod
+    def _hits(pattern, low):
+        starts, ends = [], []
+        if pattern is not None:
+            for m in pattern.finditer(low):
+                starts.append(m.start()); ends.append(m.start() + len(m.group(1)))
+        return starts, ends
+
+    def in_url_or_email(self, s, e):
+        hay = self.hay
+        if self._links is None:
+            emails = ([], [])
+            for m in _EMAIL_RE.finditer(hay):
+                emails[0].append(m.start()); emails[1].append(m.end())
+            self._links = ([m.start() for m in _HTTP_RE.finditer(hay)], emails)
+        http, (em_starts, em_ends) = self._links
+        lo = max(0, s - 200); hi = min(len(hay), e + 200)
+        # URL：候选只由数字/空白/连字符组成，窗口内的 URL 与它重叠 ⇔ 窗口内离它最近的 http(s):// 起点
+        # 与候选起点之间没有分隔符
+        j = bisect_right(http, s) - 1
+        if j >= 0 and http[j] >= lo and not _URL_SEP_RE.search(hay, http[j], s):
+            return True
+        # 邮箱：全文匹配区间与窗口不相交时，窗口内也不可能有匹配；相交时按原窗口规则复核
+        k = bisect_right(em_ends, lo)
+        if k >= len(em_starts) or em_starts[k] >= hi:
+            return False
+        return _in_email(hay, s, e)
 
+    def has_key(self, hits, keys, lo, hi):
+        if not self.exact:
+            wlow = self.hay[lo:hi].lower()
+            return any(k in wlow for k in keys)
+        starts, ends = hits
+        i = bisect_left(starts, lo)
+        while i < len(starts) and starts[i] < hi:
+            if ends[i] <= hi:
+                return True
+            i += 1
+        return False
+
+# 判定一个候选最多要看它右侧多少字符（邮箱/URL 窗口 200，关键词窗口 WINDOW_NEAR）
+_RIGHT_CONTEXT = max(200, WINDOW_NEAR)
+
+def _scan_code(hay, partial=False):
+    """partial=True 表示 hay 只是开头一段：遇到右侧上下文不够判定的候选就停下（返回 None），
+    由调用方补充正文后重扫，结果与整封扫描一致"""
+    scan = None
     for m in CODE_RE.finditer(hay):
         s, e = m.span()
+        if partial and e + _RIGHT_CONTEXT > len(hay):
+            return None
+        if scan is None:
+            scan = _HayScan(hay)
 
         # 默认不允许在链接/邮箱里的数字
-        if not ALLOW_CODE_IN_URL and _in_url_or_email(hay, s, e):
+        if not ALLOW_CODE_IN_URL and scan.in_url_or_email(s, e):
             continue
 
-        win, _, _ = _slice(hay, s, e, extra=WINDOW_NEAR)
-        wlow = win.lower()
-
-        has_pos = any(k in wlow for k in NEAR_KEYS)
-        has_neg = any(k in wlow for k in NEG_KEYS)
+        lo = max(0, s - WINDOW_NEAR); hi = min(len(hay), e + WINDOW_NEAR)
+        has_pos = scan.has_key(scan.near, NEAR_KEYS, lo, hi)
+        has_neg = has_pos and scan.has_key(scan.neg, NEG_KEYS, lo, hi)
 
         # 必须命中正向关键词；账单类数字被负面词命中时直接忽略
         if not has_pos:
@@ -255,110 +585,416 @@ def extract_code(body_text_str: str, subject: str = "", from_str: str = "") -> s
 
     return None
 
+def extract_code(body_text_str: str, subject: str = "", from_str: str = "") -> str | None:
+    return _scan_code((subject or "") + "\n" + (body_text_str or ""))
+
+def extract_code_lazy(msg, subject: str = "", from_str: str = "", first=2048, complete=True) -> str | None:
+    """主题 + 正文开头 first 个字符先试，不够再按 4 倍继续解码；找到验证码后剩余正文（包括 HTML）不再解码。
+    complete=False 表示 msg 只是 TOP 取到的前几行：正文读完也按开头一段扫，右侧上下文被截断的候选不采用，
+    交给 RETR 全文再判定，结果与整封扫描一致"""
+    head = (subject or "") + "\n"
+    chunks = iter_body_text(msg, MAX_BODY_CHARS)
+    parts, size, want, done = [], 0, first, False
+    while True:
+        while not done and size < want:
+            s = next(chunks, None)
+            if s is None:
+                done = True
+            else:
+                parts.append(s); size += len(s)
+        code = _scan_code(head + "".join(parts), partial=not (done and complete))
+        if code or done:
+            return code
+        want *= 4
+
 
-def process_single_message(msg, user, token, chat, proxy):
+def find_code(msg, subj, frm, complete=True):
+    """已知发件人先用专用规则（code_rules.py），没命中再走通用识别；离线回放（replay_mail.py）走同一条路径。
+    complete=False：msg 是 TOP 截断的前几行（见 extract_code_lazy）"""
+    rule = code_rules.lookup(frm)
+    code = rule.extract(subj, lambda: "".join(iter_body_text(msg, MAX_BODY_CHARS))) if rule else None
+    return code or extract_code_lazy(msg, subj, frm, complete=complete)
+
+def process_single_message(msg, user, token, chat, proxy, complete=True):
     subj = dec(msg.get("Subject"))
     frm = dec(msg.get("From") or "")
     to = dec(msg.get("To") or user)
-    text = body_text(msg)
-    code = extract_code(text, subj, frm)
+    with metrics.timer("extract", proto="pop3"):
+        code = find_code(msg, subj, frm, complete)
     if not code:
         return False
 
     ts = mail_time_str_ymd(msg)
-    send_meta_then_code(token, chat, frm, to, ts, code, proxy)
-    try:
-        with open("latest_code.txt", "w", encoding="utf-8") as f:
-            f.write(code)
-    except Exception:
-        pass
+    dt = _parse_received_dt(msg)
+    arrived = dt.timestamp() if dt else None
+    if not first_seen.claim(user, first_seen.message_key(msg), "pop3"):
+        return True                      # 混合模式：IMAP 已先推送这封
+    metrics.inc("codes_total", proto="pop3")
+    # 先进内存缓存（本地查询接口立即可取，见 code_cache.py），再入发送队列
+    entry = code_cache.record(user, frm, code, arrived)
+    send_meta_then_code(token, chat, frm, to, ts, code, proxy, arrived, entry, msg)
     return True
 
+class MailSink:
+    """一个账号的收信线程与解析线程之间的交接（跨重连保留）：
+    - inflight：已交给解析线程、还没处理完的 UID，轮询时跳过，避免重复抓取
+    - retr：TOP 没识别到验证码且邮件不完整时，由持有连接的收信线程补 RETR 全文
+    - 处理完才写去重库：退出时没处理完的邮件，下次启动会重新处理"""
+
+    def __init__(self, sess, token, chat, proxy, seen_uids, active=None):
+        self.sess, self.user = sess, sess.user
+        self.active = active or (lambda: True)     # 多副本：本副本是否仍持有该账号的租约
+        self.catch_up = active is not None         # 多副本：接管时补收上一个副本没处理完的邮件
+        self.baselined = False                     # 已把服务器上原有的邮件记入去重库（每个账号只做一次）
+        self.token, self.chat, self.proxy = token, chat, proxy
+        self.seen = seen_uids
+        self.inflight = set()
+        self.retr = queue.SimpleQueue()      # (编号, UID, 会话序号)
+        self.lock = threading.Lock()
+        self.sched = poll_scheduler.get_scheduler(self.user)
+
+    def busy(self, uid):
+        with self.lock:
+            return uid in self.inflight
+
+    def _release(self, uid):
+        if uid is not None:
+            with self.lock:
+                self.inflight.discard(uid)
+
+    def submit(self, num, uid, lines, complete):
+        """交给解析线程；队列满时阻塞（背压），收信线程随之暂停"""
+        if uid is not None:
+            with self.lock:
+                self.inflight.add(uid)
+        try:
+            pipeline.get_pool().submit(self.user, self._work, num, uid, self.sess.sessions, lines, complete)
+        except Exception:
+            self._release(uid)
+            raise
+
+    def _work(self, num, uid, gen, lines, complete):
+        if not self.active():
+            self._release(uid)               # 账号已交给别的副本：不推送也不记去重，由接手的副本处理
+            return
+        with metrics.timer("parse", proto="pop3"):
+            msg = email.message_from_bytes(b"\r\n".join(lines))
+        try:
+            found = process_single_message(msg, self.user, self.token, self.chat, self.proxy, complete)
+        except Exception as e:
+            print(f"[{self.user}] 邮件处理失败：", e)
+            found = True                     # 不再补抓，避免同一封反复失败
+        if found or complete:
+            if uid is not None:
+                self.seen.add(uid, msg.get("Message-ID"))
+            self._release(uid)
+        else:
+            self.retr.put((num, uid, gen))
+            self.sched.poke()                # 不等下一轮轮询，收信线程马上补 RETR
+
+    def fetch_pending_retr(self, srv, tracker):
+        """收信线程调用：补抓解析线程要求的全文（多封时按 PIPELINING 成批发 RETR）"""
+        pending = []
+        while True:
+            try:
+                num, uid, gen = self.retr.get_nowait()
+            except queue.Empty:
+                break
+            if gen != self.sess.sessions:
+                # 重连后编号可能变了：有 UID 时按 UID 重新定位，没有就放弃（邮件已按 TOP 部分处理过）
+                num = next((n for n, u in tracker.uids.items() if u == uid), None) if uid is not None else None
+                if num is None:
+                    self._release(uid)
+                    continue
+            pending.append((num, uid))
+        if len(pending) > 1 and getattr(srv, "pipelining", False):
+            failed, err = _fetch_pipelined_and_submit(srv, pending, self, 0)
+            for _, uid in failed:
+                self._release(uid)
+            if err is not None:
+                raise err
+            return
+        done = 0
+        try:
+            for num, uid in pending:
+                with metrics.timer("fetch", proto="pop3", cmd="retr"):
+                    lines, _ = fetch_lines(srv, num)
+                self.submit(num, uid, lines, True)
+                done += 1
+        finally:
+            # RETR 失败（-ERR / 断线）：本封和其后没交出去的都放回，之后的轮询或重连补收能再处理
+            for _, uid in pending[done:]:
+                self._release(uid)
+
+def fetch_and_submit(srv, num, uid, sink):
+    """收信阶段只取字节：先 TOP 取头部+前 TOP_LINES 行，服务器不支持 TOP 时直接 RETR；
+    解析与识别交给解析线程，没识别到且邮件不完整时再由 sink.fetch_pending_retr 补 RETR 全文"""
+    metrics.inc("messages_total", proto="pop3")
+    if TOP_LINES > 0 and not getattr(srv, "top_unsupported", False):
+        try:
+            with metrics.timer("fetch", proto="pop3", cmd="top"):
+                lines, complete = fetch_lines(srv, num, TOP_LINES)
+            sink.submit(num, uid, lines, complete)
+            return
+        except poplib.error_proto as e:
+            if not e.args or not isinstance(e.args[0], bytes):
+                raise                          # 连接层错误（EOF/行过长），交给会话重连
+            srv.top_unsupported = True         # 服务器对 TOP 回 -ERR：本会话改用 RETR
+    with metrics.timer("fetch", proto="pop3", cmd="retr"):
+        lines, _ = fetch_lines(srv, num)
+    sink.submit(num, uid, lines, True)
+
+def _fetch_pipelined_and_submit(srv, items, sink, top_lines):
+    """按 PIPELINE_DEPTH 分批连发 TOP/RETR 并提交；返回 (-ERR 的 [(编号, UID)], 其中第一个错误)"""
+    failed, err = [], None
+    cmd = "top" if top_lines else "retr"
+    for i in range(0, len(items), PIPELINE_DEPTH):
+        batch = items[i:i + PIPELINE_DEPTH]
+        with metrics.timer("fetch", proto="pop3", cmd=cmd, pipelined="1"):
+            results = fetch_lines_pipelined(srv, [n for n, _ in batch], top_lines)
+        for (num, uid), r in zip(batch, results):
+            if isinstance(r, Exception):
+                failed.append((num, uid)); err = err or r
+            else:
+                lines, complete = r
+                sink.submit(num, uid, lines, complete if top_lines else True)
+    return failed, err
+
+def fetch_batch_and_submit(srv, items, sink):
+    """一次收多封：服务器支持 PIPELINING 时成批连发，否则逐封 fetch_and_submit（行为与之前相同）。
+    流水线里 TOP 回 -ERR 的邮件改用 RETR 再取一次；RETR 也失败时其余邮件照常提交，最后抛出第一个错误"""
+    if len(items) < 2 or not getattr(srv, "pipelining", False):
+        for num, uid in items:
+            fetch_and_submit(srv, num, uid, sink)
+        return
+    metrics.inc("messages_total", len(items), proto="pop3")
+    if TOP_LINES > 0 and not getattr(srv, "top_unsupported", False):
+        items, _ = _fetch_pipelined_and_submit(srv, items, sink, TOP_LINES)
+        if not items:
+            return
+        srv.top_unsupported = True             # 与逐封时一样：TOP 回 -ERR 后本会话改用 RETR
+    _, err = _fetch_pipelined_and_submit(srv, items, sink, 0)
+    if err is not None:
+        raise err
+
 # —— 启动去重 Flag（无 UIDL 时）
 def startup_flag_path(user):
+    """放在去重库旁边（默认即当前目录）：多副本共用去重库时，接管的副本也能看到"""
     key = hashlib.sha1(user.encode("utf-8")).hexdigest()[:12]
-    return os.path.join(os.getcwd(), f".startup_done_{key}.flag")
+    db_dir = os.path.dirname(os.path.abspath(os.getenv("DEDUP_DB_PATH", ".seen_uids.sqlite3")))
+    return os.path.join(db_dir, f".startup_done_{key}.flag")
 
 # —— 两条消息：第一条元信息，第二条纯验证码
-def send_meta_then_code(token, chat, frm, to, ts, code, proxy=None):
-    meta = f"📬 {ts}{GAP}{frm} → {to}"
-    if not send_tg(token, chat, meta, proxy):
-        print("Telegram 元信息发送失败，仍尝试推送验证码。")
-    send_tg(token, chat, code, proxy)
+# 只入队不等待：限速、429 退避、重试都在发送线程里做，抓信循环不会被 Telegram 卡住
+# msg 不为空时按收件地址路由（routing.py），可能扇出到多个 chat；没有路由命中时发到 chat
+def send_meta_then_code(token, chat, frm, to, ts, code, proxy=None, arrived=None, entry=None, msg=None):
+    meta = f"📬 {ts}{GAP}{frm} → {to}"
+
+    def on_done(ok):
+        if ok:
+            metrics.observe_e2e(arrived, proto="pop3")
+            if entry is not None:
+                code_cache.get_cache().delivered(entry)
+
+    routing.fan_out(get_delivery(token, proxy), routing.targets(msg, chat), [meta, code], on_done)
+
+def _catch_up_start(m0, seen_uids, total, limit=20, known=False):
+    """从最后一封往前找到第一封已处理过的邮件，返回其后一封的编号（最多往前 limit 封）；
+    一封都没处理过（该账号第一次启动）时返回 total+1，仍按 FETCH_STARTUP_LAST_N 补扫。
+    known=True（本进程之前的会话已处理过）却没找到：断线期间到了超过 limit 封新信，补收最近 limit 封"""
+    for num in range(total, max(0, total - limit), -1):
+        uid = m0.get(num)
+        if uid and uid in seen_uids:
+            return num + 1
+    return max(1, total - limit + 1) if known else total + 1
+
+def check_snapshot(sess, view):
+    """因无变化重新登录后调用：新会话看到了旧会话看不到的邮件 → 服务器是登录时快照，此后一直按 STALE_SESSION_SECONDS 刷新；
+    还不知道服务器类型时没有变化 → 多半只是邮箱空闲，检查间隔加倍（最长 STALE_SESSION_MAX）"""
+    if sess.stale_view is None:
+        return
+    if view != sess.stale_view and not sess.snapshot:
+        sess.snapshot = True
+        print(f"[POP3] {sess.user} 服务器只提供登录时的快照：会话内 {STALE_SESSION_SECONDS:.0f}s 无变化就重新登录")
+    if sess.snapshot:
+        sess.stale_after = STALE_SESSION_SECONDS       # 快照式服务器上空闲多久都不退避，否则新验证码要等到 STALE_SESSION_MAX
+    else:
+        sess.stale_after = min(sess.stale_after * 2, max(STALE_SESSION_MAX, STALE_SESSION_SECONDS))
+    sess.stale_view = None
 
 # ====== 主循环 ======
-def run_session(host, user, pwd, token, chat, proxy, seen_uids):
-    srv = connect_pop3(host, user, pwd,
-                       int(os.getenv("POP3_PORT_SSL","995")),
-                       int(os.getenv("POP3_PORT_PLAIN","110")))
+def run_session(sess, sink):
+    srv = sess.open()
+    user = sess.user
+    seen_uids = sink.seen
+    sched = sink.sched
     total, _ = srv.stat()
 
-    m0 = uidl_map(srv)
-    baseline_total = None
+    tracker = UidlTracker()
+    m0 = tracker.resync(srv, total)
+    check_snapshot(sess, (total, m0.get(total)))
+    changed_at = time.time()
 
-    # —— 启动阶段（可补扫最近 N 封）
-    if FETCH_STARTUP_LAST_N > 0 and total > 0:
+    # —— 启动阶段（可补扫最近 N 封；重连、多副本接管时从处理到的位置接着收）
+    catch_up = sink.catch_up or sink.baselined
+    if (FETCH_STARTUP_LAST_N > 0 or catch_up) and total > 0:
         start = max(1, total - FETCH_STARTUP_LAST_N + 1)
+        if catch_up and m0:
+            start = min(start, _catch_up_start(m0, seen_uids, total, known=sink.baselined))
         if m0:
-            for num in range(start, total+1):
-                uid = m0.get(num)
-                if not uid or uid in seen_uids: continue
-                try:
-                    msg = fetch_msg(srv, num)
-                    process_single_message(msg, user, token, chat, proxy)
-                    seen_uids.add(uid)
-                except Exception as e:
-                    print("历史邮件处理失败：", e)
+            todo = [(n, m0.get(n)) for n in range(start, total+1)]
+            todo = [(n, u) for n, u in todo if u and not (sink.busy(u) or u in seen_uids)]
         else:
             flag = startup_flag_path(user)
-            if not os.path.exists(flag):
-                for num in range(start, total+1):
-                    try:
-                        msg = fetch_msg(srv, num)
-                        process_single_message(msg, user, token, chat, proxy)
-                    except Exception as e:
-                        print("历史邮件处理失败：", e)
-                try:
-                    with open(flag, "w") as f: f.write("done")
-                except Exception:
-                    pass
-            baseline_total = total
-
-    if m0:
-        seen_uids.update(m0.values())
-
-    # —— 轮询新邮件
-    t0 = time.time()
+            todo = [] if os.path.exists(flag) else [(n, None) for n in range(start, total+1)]
+        # 支持 PIPELINING 时整批连发；否则逐封收，某封失败不影响其余
+        for batch in ([todo] if getattr(srv, "pipelining", False) else [[t] for t in todo]):
+            try:
+                fetch_batch_and_submit(srv, batch, sink)
+            except Exception as e:
+                print("历史邮件处理失败：", e)
+        if not m0 and todo:
+            try:
+                with open(flag, "w") as f: f.write("done")
+            except Exception:
+                pass
+
+    # 只在该账号第一个会话把服务器上已有的邮件记为已处理（全量重同步时不会再推送）；
+    # 重连后不再整表重写，断线期间到达的新信由上面的接续补收
+    if not sink.baselined and (m0 or total == 0):     # 空邮箱也算：之后的会话照样接续补收
+        seen_uids.update(u for u in m0.values() if not sink.busy(u))
+        sink.baselined = True
+
+    # —— 轮询新邮件（同一连接内持续检测；只有出错/服务器超时才退出重连）
     while True:
-        if time.time() - t0 >= RECONNECT_EVERY:
-            break
+        if not sink.active():
+            sess.close("账号已交给其他副本"); return
+        if RECONNECT_EVERY > 0 and sess.age() >= RECONNECT_EVERY:
+            sess.close("定期刷新"); return
+        if not sess.live and STALE_SESSION_SECONDS > 0 and time.time() - changed_at >= sess.stale_after:
+            sess.stale_view = (tracker.count, tracker.uids.get(tracker.count))
+            sess.close(f"{sess.stale_after:.0f}s 无变化，重新登录刷新邮件列表"); return
         try:
-            m = uidl_map(srv)
-            if m:
-                new_nums = [n for n,u in sorted(m.items()) if u not in seen_uids]
-            else:
-                cur_total, _ = srv.stat()
-                if baseline_total is None: baseline_total = cur_total
-                new_nums = list(range(baseline_total+1, cur_total+1))
-                baseline_total = cur_total
+            with metrics.timer("poll", proto="pop3"):
+                polled = tracker.poll(srv)
+            new_items = [(n, u) for n, u in polled if u is None or not (sink.busy(u) or u in seen_uids)]
+            if polled:
+                changed_at = time.time()
+                if not sess.live:
+                    sess.live = True
+                    print(f"[POP3] {user} 会话内可见新信（实时视图），不再因无变化重新登录")
 
-            for num in new_nums[-20:]:
-                msg = fetch_msg(srv, num)
-                process_single_message(msg, user, token, chat, proxy)
-                uid = (m.get(num) if m else f"no-uidl-{num}")
-                seen_uids.add(uid)
+            fetch_batch_and_submit(srv, new_items[-20:], sink)
+            sink.fetch_pending_retr(srv, tracker)
 
-            time.sleep(POLL_SECONDS)
+            sess.touch()
+            sched.after_poll(bool(new_items))
+            sched.wait()
+            sess.keepalive()
 
-        except poplib.error_proto as e:
-            print("[POP3] 会话异常，切换到重连…", e); break
+        except (poplib.error_proto, EOFError, OSError) as e:
+            # -ERR / 连接被服务器关闭 / 超时：结束本会话，交给外层重连
+            print("[POP3] 会话异常，切换到重连…", e)
+            sess.close(f"异常：{e}", graceful=False); return
+        except pipeline.PipelineClosed:
+            sess.close("退出"); return
         except Exception as e:
-            print("错误：", e); time.sleep(POLL_SECONDS)
+            print("错误：", e); sched.wait()
+
+class _MemorySeen(set):
+    """去重库打不开时的兜底：接口与 SeenSet 一致，只在内存里"""
+    def add(self, uid, message_id=None):
+        super().add(uid)
 
+# ====== 多账号 ======
+def load_accounts(path, defaults):
+    """读取账号列表；每个账号缺省字段回落到 defaults（即环境变量）"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("accounts") or []
+    accounts = []
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        acc = dict(defaults)
+        acc.update({k: v for k, v in item.items() if v not in (None, "")})
+        if not acc.get("user") or not acc.get("pass"):
+            print("跳过缺少 user/pass 的账号配置：", item.get("user") or item)
+            continue
+        accounts.append(acc)
+    return accounts
+
+def account_loop(acc, active=None):
+    """单个账号的重连循环；每个账号独立持有 seen_uids 和会话，互不影响。
+    active：多副本时传入租约检查，租约不在本副本后退出"""
     try:
-        srv.quit()
-    except Exception:
-        pass
+        seen_uids = open_store().view(acc["user"], "INBOX")
+    except Exception as e:
+        print(f"[{acc['user']}] 去重库不可用，改用内存去重：", e)
+        seen_uids = _MemorySeen()
+    sess = Pop3Session(acc["host"], acc["user"], acc["pass"],
+                       int(acc.get("port_ssl") or os.getenv("POP3_PORT_SSL","995")),
+                       int(acc.get("port_plain") or os.getenv("POP3_PORT_PLAIN","110")))
+    sink = MailSink(sess, acc["token"], acc["chat"], acc.get("proxy"), seen_uids, active)
+    try:
+        while not pipeline.stopping() and sink.active():
+            try:
+                run_session(sess, sink)
+            except Exception as e:
+                print(f"[{acc['user']}] 重连失败：", e)
+                sess.close(f"异常：{e}", graceful=False)
+            time.sleep(1)
+    finally:
+        sess.close("退出")
+
+def run_accounts(accounts):
+    """每个账号一个线程：慢账号/故障账号只阻塞自己的线程，不会拖慢其他账号的轮询"""
+    threads = []
+    for acc in accounts:
+        t = threading.Thread(target=account_loop, args=(acc,), name=f"pop3-{acc['user']}", daemon=True)
+        t.start()
+        threads.append(t)
+    print(f"[POP3] 已启动 {len(threads)} 个账号监听")
+    try:
+        while any(t.is_alive() for t in threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pipeline.shutdown()
+        print("\n已退出。")
+
+def run_replicas(accounts):
+    """多副本：只收本副本持有租约的账号；每 TTL/3 秒续约并按存活副本数重新均分"""
+    leases = replica_lease.open_manager(open_store().path)
+    by_user = {a["user"]: a for a in accounts}
+    threads = {}
+    print(f"[副本 {leases.id}] 加入副本组，共 {len(by_user)} 个账号，租约 {leases.ttl:g}s")
+    try:
+        while not pipeline.stopping():
+            try:
+                leases.tick(list(by_user))
+            except Exception as e:
+                print(f"[副本 {leases.id}] 续约失败：", e)
+            for user, t in list(threads.items()):
+                if t.is_alive():
+                    if not leases.holds(user):
+                        poll_scheduler.get_scheduler(user).poke()    # 唤醒轮询，尽快停手
+                    continue
+                del threads[user]
+                if not leases.holds(user):
+                    leases.release(user)
+            for user in leases.held():
+                if user not in threads:
+                    t = threading.Thread(target=account_loop, args=(by_user[user], lambda u=user: leases.holds(u)),
+                                         name=f"pop3-{user}", daemon=True)
+                    t.start()
+                    threads[user] = t
+            time.sleep(leases.ttl / 3)
+    except KeyboardInterrupt:
+        pipeline.shutdown()
+        print("\n已退出。")
+    finally:
+        leases.shutdown()
 
 def main():
     # .env
@@ -366,6 +1002,9 @@ def main():
         from dotenv import load_dotenv; load_dotenv()
     except Exception:
         pass
+    metrics.start()
+    local_http.start()
+    pipeline.install_signal_handlers()
 
     host  = os.getenv("POP3_HOST","pop3.2925.com").strip()
     user  = os.getenv("EMAIL_USER","")
@@ -374,20 +1013,36 @@ def main():
     chat  = os.getenv("TELEGRAM_CHAT_ID","")
     proxy = os.getenv("TG_PROXY") or None
 
+    accounts = None
+    accounts_file = os.getenv("ACCOUNTS_FILE","").strip()
+    if accounts_file:
+        defaults = {"host": host, "token": token, "chat": chat, "proxy": proxy}
+        accounts = load_accounts(accounts_file, defaults)
+        if not accounts:
+            print("❌ ACCOUNTS_FILE 中没有可用账号：", accounts_file)
+            return
+
     try:
-        send_tg(token, chat, "✅ POP3 验证码监听已启动。（开机最多读 2 条历史；按邮箱收到时间显示）", proxy)
+        n = f"{len(accounts)} 个账号；" if accounts else ""
+        send_tg(token, chat, f"✅ POP3 验证码监听已启动。（{n}开机最多读 2 条历史；按邮箱收到时间显示）", proxy)
     except Exception as e:
         print("❌ Telegram 失败：", e)
 
-    seen_uids = set()
-    while True:
-        try:
-            run_session(host, user, pwd, token, chat, proxy, seen_uids)
-        except KeyboardInterrupt:
-            print("\n已退出。"); break
-        except Exception as e:
-            print("重连失败：", e)
-        time.sleep(1)
+    if replica_lease.enabled():
+        run_replicas(accounts or [{"host": host, "user": user, "pass": pwd,
+                                   "token": token, "chat": chat, "proxy": proxy}])
+        return
+
+    if accounts:
+        run_accounts(accounts)
+        return
+
+    try:
+        account_loop({"host": host, "user": user, "pass": pwd,
+                      "token": token, "chat": chat, "proxy": proxy})
+    except KeyboardInterrupt:
+        pipeline.shutdown()
+        print("\n已退出。")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+端到端压测（本地运行，无需外网）：启动假 POP3/IMAP/Telegram 服务器（fake_servers.py），
+以子进程运行转发脚本，按固定速率投递验证码邮件，统计：
+- 送达数、每秒送达数
+- 投递 → Telegram 收到的延迟 p50/p99（按验证码逐封对应，毫秒级）
+- 每个账号的 CPU 时间与内存（RSS，读 /proc，仅 Linux）
+
+用法：
+python bench_forwarders.py                                   # 全部都测：2 个账号、每秒 5 封、持续 20 秒
+python bench_forwarders.py --target pop3-snapshot           # POP3 服务器只提供登录时快照（会话内看不到新信）；
+                                                            # 先投一封预热信、空闲 --idle 秒再开始投递，延迟超过上限即失败
+python bench_forwarders.py --target pop3 --accounts 10 --rate 50 --duration 60 --tg-429 0.05
+python bench_forwarders.py --json > result.json             # 输出 JSON，便于部署前和上次结果对比
+
+子进程继承当前环境变量，可叠加调参（如 TOP_LINES、POLL_SECONDS / POLL_MIN_SECONDS、TG_WORKERS）；
+每个账号推送到各自的 chat。默认放开 Telegram 限速（TG_CHAT_RATE / TG_GLOBAL_RATE=1000）以测转发脚本本身，
+要模拟真实限速时显式设置这两个变量。
+"""
+import os, sys, json, time, socket, shutil, argparse, tempfile, subprocess
+from fake_servers import FakePOP3Server, FakeIMAPServer, FakeTelegram, make_mail
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+POP3_SCRIPT = os.path.join(HERE, "2925_to_telegram_pop3_autorefresh.py")
+IMAP_SCRIPT = os.path.join(HERE, "imap_idle_forwarder.py")
+
+def _closed_port():
+    """找一个没人监听的端口：SSL 连接会被立即拒绝，脚本随即回退到明文端口"""
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def _proc_usage(pid):
+    """(CPU 秒, RSS 字节)；读不到 /proc 时返回 (None, None)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(l.split()[1]) * 1024 for l in f if l.startswith("VmRSS:"))
+        return cpu, rss
+    except Exception:
+        return None, None
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def _wait(cond, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if cond():
+            return True
+        time.sleep(0.1)
+    return False
+
+class Bench:
+    def __init__(self, target, args):
+        self.target, self.args = target, args
+        self.workdir = tempfile.mkdtemp(prefix=f"bench_{target}_")
+        self.tg = FakeTelegram(rate_429=args.tg_429, retry_after=args.retry_after,
+                               latency=args.tg_latency / 1000).start()
+        self.servers, self.procs, self.deliver = [], [], []
+        self.injected = {}           # 验证码 → 投递时间
+
+    def _env(self, **extra):
+        env = dict(os.environ)
+        for k in ("TG_CHAT_RATE", "TG_CHAT_BURST", "TG_GLOBAL_RATE", "TG_GLOBAL_BURST"):
+            env.setdefault(k, "1000")
+        env.update(TG_API_BASE=self.tg.url, FETCH_STARTUP_LAST_N="0", PYTHONUNBUFFERED="1")
+        if not (env.get("POLL_MIN_SECONDS") or env.get("POLL_MAX_SECONDS")):
+            env.setdefault("POLL_SECONDS", str(self.args.poll))      # 默认固定间隔；设置 POLL_MIN/MAX_SECONDS 时测自适应轮询
+        if self.target == "pop3-snapshot":
+            # 刷新间隔调短，空闲后仍按这个间隔刷新（不退避到 STALE_SESSION_MAX）才能通过延迟上限
+            env.setdefault("STALE_SESSION_SECONDS", "1")
+            env.setdefault("STALE_SESSION_MAX", "60")
+        env.update({k: str(v) for k, v in extra.items()})
+        return env
+
+    def latency_limit(self):
+        """快照式服务器：最多等一个刷新间隔 + 一次轮询 + 余量；其他目标不设上限"""
+        if self.target != "pop3-snapshot":
+            return None
+        env = self._env()
+        return 2 * float(env["STALE_SESSION_SECONDS"]) + float(env.get("POLL_SECONDS") or self.args.poll) + 2
+
+    def _spawn(self, script, env, name):
+        log = open(os.path.join(self.workdir, name + ".log"), "w")
+        self.procs.append(subprocess.Popen([sys.executable, script], cwd=self.workdir, env=env,
+                                           stdout=log, stderr=subprocess.STDOUT))
+
+    def start_pop3(self):
+        pop = FakePOP3Server(snapshot=self.target == "pop3-snapshot").start()
+        self.servers.append(pop)
+        closed = _closed_port()
+        accounts = [{"user": f"bench{i}@2925.com", "pass": "x", "host": "127.0.0.1",
+                     "port_ssl": closed, "port_plain": pop.port, "chat": str(1000 + i)}
+                    for i in range(self.args.accounts)]
+        path = os.path.join(self.workdir, "accounts.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(accounts, f)
+        self._spawn(POP3_SCRIPT, self._env(ACCOUNTS_FILE=path, TELEGRAM_BOT_TOKEN="bench", TELEGRAM_CHAT_ID="999",
+                                           DEDUP_DB_PATH=os.path.join(self.workdir, "seen.sqlite3")), "pop3")
+        self.deliver = [lambda raw, u=a["user"]: pop.deliver(u, raw) for a in accounts]
+        # 每个账号登录后都会先 STAT 一次
+        return _wait(lambda: sum(c.startswith("STAT") for c in list(pop.commands)) >= len(accounts), 30)
+
+    def start_imap(self):
+        closed = _closed_port()
+        for i in range(self.args.accounts):
+            srv = FakeIMAPServer().start()
+            self.servers.append(srv)
+            self._spawn(IMAP_SCRIPT, self._env(
+                MAIL_USER=f"bench{i}@2925.com", MAIL_PASS="x", IMAP_HOST="127.0.0.1",
+                IMAP_PORT_SSL=closed, IMAP_PORT_STARTTLS=srv.port, IMAP_PLAIN_FALLBACK="1",
+                TG_BOT_TOKEN="bench", TG_CHAT_ID=str(1000 + i),
+                DEDUP_DB_PATH=os.path.join(self.workdir, f"seen{i}.sqlite3")), f"imap{i}")
+            self.deliver.append(srv.deliver)
+        return _wait(lambda: all(any(c == "IDLE" for c in list(s.commands)) for s in self.servers), 30)
+
+    def delivered(self):
+        """验证码 → Telegram 收到时间（合并发送时验证码在最后一行）"""
+        out = {}
+        with self.tg.lock:
+            messages = list(self.tg.messages)
+        for ts, _, text in messages:
+            code = (text or "").strip().rsplit("\n", 1)[-1].strip()
+            if code in self.injected and code not in out:
+                out[code] = ts
+        return out
+
+    def run(self):
+        a = self.args
+        ok = self.start_imap() if self.target == "imap" else self.start_pop3()
+        if not ok:
+            raise RuntimeError(f"{self.target} 转发脚本未能在 30 秒内登录，日志见 {self.workdir}")
+        if self.target == "pop3-snapshot" and a.idle > 0:
+            # 预热：一封不含验证码的信让脚本认出快照式服务器，然后空闲一段时间再开始计时投递
+            for deliver in self.deliver:
+                deliver(make_mail(None))
+            time.sleep(a.idle)
+        before = [_proc_usage(p.pid) for p in self.procs]
+
+        total = int(a.rate * a.duration)
+        t0 = time.time()
+        for k in range(total):
+            delay = t0 + k / a.rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            code = str(100000 + k % 900000)
+            i = k % a.accounts
+            raw = make_mail(code, to=f"bench{i}@2925.com")
+            self.injected[code] = time.time()
+            self.deliver[i](raw)
+        _wait(lambda: len(self.delivered()) >= total, a.drain)
+
+        after = [_proc_usage(p.pid) for p in self.procs]
+        got = self.delivered()
+        lat = [got[c] - self.injected[c] for c in got]
+        span = (max(got.values()) - t0) if got else 0
+        cpu = sum(e[0] - b[0] for b, e in zip(before, after) if b[0] is not None and e[0] is not None)
+        rss = sum(e[1] for e in after if e[1] is not None)
+        have_proc = all(e[0] is not None for e in after)
+        return {
+            "target": self.target, "accounts": a.accounts, "rate": a.rate, "duration": a.duration,
+            "injected": total, "delivered": len(got),
+            "delivered_per_sec": round(len(got) / span, 2) if span else 0.0,
+            "latency_p50_ms": round(1000 * _percentile(lat, 0.5)) if lat else None,
+            "latency_p99_ms": round(1000 * _percentile(lat, 0.99)) if lat else None,
+            "latency_max_ms": round(1000 * max(lat)) if lat else None,
+            "telegram_429": self.tg.count_429,
+            "cpu_sec_per_account": round(cpu / a.accounts, 3) if have_proc else None,
+            "rss_mb_per_account": round(rss / a.accounts / 2**20, 1) if have_proc else None,
+            "processes": len(self.procs),
+            "latency_limit_ms": round(1000 * self.latency_limit()) if self.latency_limit() else None,
+        }
+
+    def close(self):
+        for p in self.procs:
+            p.terminate()
+        for p in self.procs:
+            try:
+                p.wait(5)
+            except subprocess.TimeoutExpired:
+                p.kill()
+        for s in self.servers + [self.tg]:
+            s.stop()
+        if self.args.keep:
+            print(f"[bench] 日志与数据保留在 {self.workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+def _print(r):
+    print(f"== {r['target'].upper()}：{r['accounts']} 个账号（{r['processes']} 个进程），"
+          f"每秒投递 {r['rate']:g} 封 × {r['duration']:g} 秒")
+    print(f"   送达 {r['delivered']}/{r['injected']}，{r['delivered_per_sec']} 封/秒；429 {r['telegram_429']} 次")
+    print(f"   延迟 p50={r['latency_p50_ms']}ms p99={r['latency_p99_ms']}ms max={r['latency_max_ms']}ms")
+    print(f"   每账号 CPU {r['cpu_sec_per_account']}s，内存 {r['rss_mb_per_account']}MB")
+    if r["latency_limit_ms"]:
+        print(f"   延迟上限 {r['latency_limit_ms']}ms：" + ("通过" if not _too_slow(r) else "超出"))
+
+def _too_slow(r):
+    return bool(r["latency_limit_ms"]) and (r["latency_max_ms"] or 0) > r["latency_limit_ms"]
+
+def main():
+    ap = argparse.ArgumentParser(description="POP3 / IMAP 转发脚本本地端到端压测")
+    ap.add_argument("--target", choices=["pop3", "pop3-snapshot", "imap", "both"], default="both",
+                    help="both=全部（含快照式 POP3 服务器）")
+    ap.add_argument("--accounts", type=int, default=2)
+    ap.add_argument("--rate", type=float, default=5, help="每秒投递邮件数（所有账号合计，轮流分配）")
+    ap.add_argument("--duration", type=float, default=20, help="投递持续秒数")
+    ap.add_argument("--drain", type=float, default=30, help="投递结束后最多再等多少秒收齐")
+    ap.add_argument("--idle", type=float, default=50, help="pop3-snapshot：预热后空闲多少秒再开始投递")
+    ap.add_argument("--poll", type=float, default=0.5, help="POP3 轮询间隔（未设置 POLL_SECONDS 时）")
+    ap.add_argument("--tg-429", type=float, default=0.0, help="Telegram 返回 429 的概率")
+    ap.add_argument("--retry-after", type=int, default=1)
+    ap.add_argument("--tg-latency", type=float, default=0.0, help="假 Telegram 每次请求的附加延迟（毫秒）")
+    ap.add_argument("--json", action="store_true", help="每个目标输出一行 JSON")
+    ap.add_argument("--keep", action="store_true", help="保留临时目录（子进程日志、去重库）")
+    args = ap.parse_args()
+
+    results = []
+    for target in (["pop3", "pop3-snapshot", "imap"] if args.target == "both" else [args.target]):
+        bench = Bench(target, args)
+        try:
+            results.append(bench.run())
+        finally:
+            bench.close()
+        print(json.dumps(results[-1], ensure_ascii=False)) if args.json else _print(results[-1])
+    if any(r["delivered"] < r["injected"] or _too_slow(r) for r in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
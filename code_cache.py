@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+最近验证码缓存 + 本地查询接口（POP3 / IMAP 两个转发脚本共用，取代 latest_code.txt）：
+- 内存里保留最近 CODES_KEEP 条（环形缓冲），每条记录 账号、发件人、验证码、邮件到达时间、识别时间、推送成功时间
+- 识别到验证码时只做一次内存追加并唤醒等待者，热路径上没有文件读写
+- 本地 HTTP 接口（local_http.py，设置 LOCAL_PORT 后监听）：
+    GET /codes?sender=github.com&account=a@2925.com&limit=10      # 最近的验证码（新的在前）
+    GET /codes/wait?sender=github.com&after=1700000000&timeout=60 # 长轮询：等下一条匹配的验证码
+  sender 按发件人地址/名称做不区分大小写的包含匹配；account 精确匹配。
+  wait 的起点：since=<id>（返回 id 更大的）或 after=<Unix 时间>（返回识别时间更晚的），都不给则只等调用之后的新验证码；
+  建议自动化在触发登录前记下时间，用 after 避免验证码先于 wait 请求到达而错过。超时返回 204
+
+可选环境变量：
+CODES_KEEP=200               # 内存里保留的条数
+"""
+import os, time, itertools, threading
+from collections import deque
+import local_http
+
+class CodeCache:
+    def __init__(self, keep=200):
+        self._items = deque(maxlen=max(keep, 1))
+        self._cv = threading.Condition()
+        self._ids = itertools.count(1)
+
+    def add(self, account, sender, code, received=None):
+        """received：邮件到达服务器的 Unix 时间（取不到为 None）；返回记录，推送成功后用 delivered() 补时间"""
+        entry = {"id": 0, "account": account, "sender": sender, "code": code,
+                 "received": received, "extracted": time.time(), "delivered": None}
+        with self._cv:
+            entry["id"] = next(self._ids)
+            self._items.append(entry)
+            self._cv.notify_all()
+        return entry
+
+    def delivered(self, entry):
+        entry["delivered"] = time.time()
+
+    @staticmethod
+    def _match(e, sender, account):
+        return (not sender or sender.lower() in (e["sender"] or "").lower()) and \
+               (not account or account.lower() == (e["account"] or "").lower())
+
+    def recent(self, sender=None, account=None, limit=20):
+        with self._cv:
+            items = list(self._items)
+        out = [dict(e) for e in reversed(items) if self._match(e, sender, account)]
+        return out[:limit]
+
+    def wait(self, sender=None, account=None, since=None, after=None, timeout=30.0):
+        """等第一条匹配且比起点新的验证码；超时返回 None"""
+        deadline = time.monotonic() + timeout
+        with self._cv:
+            if since is None and after is None:
+                since = self._items[-1]["id"] if self._items else 0
+            while True:
+                for e in self._items:
+                    if (since is None or e["id"] > since) and (after is None or e["extracted"] > after) \
+                            and self._match(e, sender, account):
+                        return dict(e)
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return None
+                self._cv.wait(left)
+
+_cache = None
+_lock = threading.Lock()
+
+def get_cache():
+    """进程内共用一个缓存（CODES_KEEP 在首次调用时读取）"""
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = CodeCache(int(os.getenv("CODES_KEEP", "200")))
+        return _cache
+
+def record(account, sender, code, received=None):
+    return get_cache().add(account, sender, code, received)
+
+def _codes(q):
+    return 200, get_cache().recent(q.get("sender"), q.get("account"), int(q.get("limit", 20)))
+
+def _codes_wait(q):
+    e = get_cache().wait(q.get("sender"), q.get("account"),
+                         int(q["since"]) if "since" in q else None,
+                         float(q["after"]) if "after" in q else None,
+                         min(float(q.get("timeout", 30)), 600))
+    return (200, e) if e else (204, None)
+
+local_http.route("GET", "/codes", _codes)
+local_http.route("GET", "/codes/wait", _codes_wait)
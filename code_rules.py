@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按发件人的验证码规则（POP3 / IMAP 两个转发脚本共用）：
+常见发件人的邮件模板固定，用一条专用正则直接取验证码，不必走通用的关键词窗口扫描；
+规则没命中（模板改版等）时调用方照常回退到通用识别。
+
+规则文件（JSON，CODE_RULES_FILE，默认 code_rules.json；文件不存在时不启用）：
+[
+  {"from": "noreply@github.com", "body": "verification code[^\\\\d]*(\\\\d{6})"},
+  {"from": ["openai.com", "tm.openai.com"], "subject": "^(\\\\d{6}) ", "body": "code is (\\\\d{6})"}
+]
+- from：完整地址或域名（子域名会匹配到上级域名的规则），可以是列表
+- subject / body：正则（不区分大小写），有分组取第一个分组，否则取整个匹配；去掉其中的空格和连字符
+  只写 subject 时正文不会被解码
+- 加载时一次编译成 地址/域名 → 规则 的字典，查找按 From 直接取
+- 热加载（hot_reload.py）：每隔 CODE_RULES_CHECK 秒（默认 2）检查一次文件修改时间，变化后重新编译；
+  新文件有错误时打印原因并继续用旧规则
+"""
+import re
+from email.utils import parseaddr
+from hot_reload import HotFile
+
+class Rule:
+    __slots__ = ("key", "subject", "body")
+
+    def __init__(self, key, subject=None, body=None):
+        self.key = key
+        self.subject = re.compile(subject, re.I) if subject else None
+        self.body = re.compile(body, re.I) if body else None
+
+    @staticmethod
+    def _code(m):
+        return re.sub(r"[\s-]", "", m.group(1) if m.re.groups else m.group()) or None
+
+    def extract(self, subject, body):
+        """body：返回正文文本的函数，只在主题没命中且规则带 body 时才调用"""
+        if self.subject is not None:
+            m = self.subject.search(subject or "")
+            if m:
+                return self._code(m)
+        if self.body is not None:
+            m = self.body.search(body() or "")
+            if m:
+                return self._code(m)
+        return None
+
+def compile_rules(items):
+    """规则列表 → {小写地址或域名: Rule}；格式错误抛 ValueError / re.error"""
+    if not isinstance(items, list):
+        raise ValueError("规则文件应为 JSON 数组")
+    table = {}
+    for i, item in enumerate(items):
+        keys = item.get("from") if isinstance(item, dict) else None
+        keys = [keys] if isinstance(keys, str) else keys
+        if not keys or not (item.get("subject") or item.get("body")):
+            raise ValueError(f"第 {i + 1} 条规则缺少 from 或 subject/body")
+        for k in keys:
+            k = k.strip().lower().lstrip("@")
+            table[k] = Rule(k, item.get("subject"), item.get("body"))
+    return table
+
+_rules = HotFile("规则", "CODE_RULES_FILE", "code_rules.json", "CODE_RULES_CHECK", compile_rules, dict,
+                 lambda t: f"{len(t)} 个发件人/域名", "停用按发件人规则")
+
+def lookup(from_str):
+    """按 From 找规则：先完整地址，再域名及其上级域名；没有返回 None"""
+    table = _rules.get()
+    if not table:
+        return None
+    addr = parseaddr(from_str or "")[1].lower()
+    rule = table.get(addr)
+    if rule is not None or "@" not in addr:
+        return rule
+    domain = addr.rsplit("@", 1)[1]
+    while domain:
+        rule = table.get(domain)
+        if rule is not None:
+            return rule
+        domain = domain.partition(".")[2]
+    return None
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+持久化去重库（POP3 / IMAP 两个转发脚本共用）：
+- SQLite WAL：每条记录一次 INSERT，写入开销恒定，不再每批整表重写 JSON
+- 键：账号 + 文件夹 + UIDVALIDITY + UID，同时记录 Message-ID（可按 Message-ID 去重）
+- 有界：每个 账号 + 文件夹 超过 DEDUP_MAX_ENTRIES 条时按写入顺序淘汰该文件夹最旧的记录，
+  一个大邮箱不会挤掉其他账号仍在服务器上的邮件记录
+- 启动不加载全表，查询时按主键索引按需读取
+- 另存每个文件夹的 UIDVALIDITY / 已处理最大 UID / HIGHESTMODSEQ，重连后只需增量查询
+
+可选环境变量：
+DEDUP_DB_PATH=.seen_uids.sqlite3   # 库文件路径（两个脚本可指向同一个文件）
+DEDUP_MAX_ENTRIES=200000           # 每个 账号 + 文件夹 最多保留条数
+"""
+import os, json, time, sqlite3, threading
+
+EVICT_EVERY = 1000     # 同一 账号 + 文件夹 每新增 N 条检查一次淘汰，摊销后仍是 O(1)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen (
+    account     TEXT NOT NULL,
+    folder      TEXT NOT NULL,
+    uidvalidity TEXT NOT NULL,
+    uid         TEXT NOT NULL,
+    message_id  TEXT,
+    ts          REAL NOT NULL,
+    PRIMARY KEY (account, folder, uidvalidity, uid)
+);
+CREATE INDEX IF NOT EXISTS seen_message_id ON seen (account, message_id);
+CREATE TABLE IF NOT EXISTS folder_state (
+    account     TEXT NOT NULL,
+    folder      TEXT NOT NULL,
+    uidvalidity TEXT,
+    last_uid    INTEGER NOT NULL DEFAULT 0,
+    modseq      INTEGER,
+    ts          REAL NOT NULL,
+    PRIMARY KEY (account, folder)
+);
+"""
+
+class DedupStore:
+    """线程安全；多账号线程共用一个实例即可"""
+
+    def __init__(self, path, max_entries=None):
+        self.path = path
+        self.max_entries = max_entries or int(os.getenv("DEDUP_MAX_ENTRIES", "200000"))
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._writes = {}       # (账号, 文件夹) → 上次淘汰后新增的条数
+
+    def contains(self, account, folder, uidvalidity, uid):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM seen WHERE account=? AND folder=? AND uidvalidity=? AND uid=?",
+                (account, folder, str(uidvalidity), str(uid))).fetchone()
+        return row is not None
+
+    def has_message_id(self, account, message_id):
+        if not message_id:
+            return False
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM seen WHERE account=? AND message_id=? LIMIT 1",
+                                   (account, message_id.strip())).fetchone()
+        return row is not None
+
+    def add_many(self, account, folder, uidvalidity, items):
+        """items: [(uid, message_id 或 None)]；一个事务写完"""
+        now = time.time()
+        rows = [(account, folder, str(uidvalidity), str(uid), (mid or "").strip() or None, now)
+                for uid, mid in items]
+        if not rows:
+            return
+        with self._lock:
+            before = self._db.total_changes
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany("INSERT OR IGNORE INTO seen VALUES (?,?,?,?,?,?)", rows)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            # 已有的记录被 IGNORE，不计入
+            key = (account, folder)
+            n = self._writes.get(key, 0) + self._db.total_changes - before
+            if n >= EVICT_EVERY:
+                n = 0
+                self._evict(account, folder)
+            self._writes[key] = n
+
+    def add(self, account, folder, uidvalidity, uid, message_id=None):
+        self.add_many(account, folder, uidvalidity, [(uid, message_id)])
+
+    def _evict(self, account, folder):
+        # rowid 单调递增：该 账号 + 文件夹 只保留最新的 max_entries 条
+        row = self._db.execute("SELECT rowid FROM seen WHERE account=? AND folder=? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                               (account, folder, self.max_entries)).fetchone()
+        if row is not None:
+            self._db.execute("DELETE FROM seen WHERE account=? AND folder=? AND rowid <= ?", (account, folder, row[0]))
+
+    def get_state(self, account, folder):
+        """返回 {"uidvalidity", "last_uid", "modseq"}；没有记录时返回 None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT uidvalidity, last_uid, modseq FROM folder_state WHERE account=? AND folder=?",
+                (account, folder)).fetchone()
+        if row is None:
+            return None
+        return {"uidvalidity": row[0], "last_uid": row[1], "modseq": row[2]}
+
+    def set_state(self, account, folder, uidvalidity, last_uid, modseq=None):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO folder_state VALUES (?,?,?,?,?,?)",
+                             (account, folder, str(uidvalidity), int(last_uid), modseq, time.time()))
+
+    def view(self, account, folder="INBOX", uidvalidity=""):
+        return SeenSet(self, account, folder, uidvalidity)
+
+    def import_json(self, path, view):
+        """迁移旧版 .seen_uids.json（只有 UID 列表）到指定视图；成功后改名为 *.migrated"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                uids = json.load(f)
+        except Exception:
+            return 0
+        view.update(uids)
+        try:
+            os.replace(path, path + ".migrated")
+        except Exception:
+            pass
+        return len(uids)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class SeenSet:
+    """某个 (账号, 文件夹, UIDVALIDITY) 下的去重视图；用法同 set：`uid in seen` / `seen.add(uid)`"""
+
+    def __init__(self, store, account, folder="INBOX", uidvalidity=""):
+        self.store = store
+        self.account, self.folder, self.uidvalidity = account, folder, str(uidvalidity)
+
+    def __contains__(self, uid):
+        return self.store.contains(self.account, self.folder, self.uidvalidity, uid)
+
+    def add(self, uid, message_id=None):
+        self.store.add(self.account, self.folder, self.uidvalidity, uid, message_id)
+
+    def update(self, uids):
+        self.store.add_many(self.account, self.folder, self.uidvalidity, [(u, None) for u in uids])
+
+    def has_message_id(self, message_id):
+        return self.store.has_message_id(self.account, message_id)
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def open_store(path=None):
+    """按路径复用同一个连接（同一进程内多处调用拿到同一个实例）；环境变量在调用时读取，.env 加载后才生效"""
+    path = path or os.getenv("DEDUP_DB_PATH", ".seen_uids.sqlite3")
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = DedupStore(path)
+        return _stores[path]
@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地假服务器（无需外网），用于压测与回归：
+- FakePOP3Server：USER/PASS/STAT/LIST/UIDL/TOP/RETR/NOOP/CAPA（可选 PIPELINING）
+- FakeIMAPServer：LOGIN/SELECT/EXAMINE/UID SEARCH/UID FETCH（BODYSTRUCTURE、INTERNALDATE、HEADER.FIELDS、
+  分段 BODY[n]<o.l>）/IDLE（新信时推送 EXISTS）/STATUS/NOOP/NOTIFY（可选）
+- 投递时在邮件最上面加一条 Received（INTERNALDATE 也取它），与真实服务器一样可算端到端延迟
+- FakeTelegram：/bot<token>/sendMessage，可按比例注入 429 + retry_after
+
+三者都只监听 127.0.0.1 的随机端口，明文无 TLS；转发脚本需配合：
+POP3_PORT_SSL 指向一个不监听的端口（自动回退到明文），IMAP_PLAIN_FALLBACK=1，TG_API_BASE=fake.url
+"""
+import re, json, time, random, fnmatch, threading, socketserver, email, email.policy, email.utils
+from email.utils import format_datetime
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+def make_mail(code=None, subject="Your verification code", frm="noreply@example.com",
+              to="me@2925.com", body=None, html=None, attachment_bytes=0, sent_at=None):
+    """生成一封测试邮件（bytes）；sent_at 写入 X-Sent-At 头，便于统计到达→推送延迟"""
+    sent_at = time.time() if sent_at is None else sent_at
+    if body is None:
+        body = f"Your verification code is {code}. It expires in 10 minutes." if code else "Hello."
+    boundary = "=_fake_%d" % random.randint(0, 1 << 30)
+    head = (f"From: {frm}\r\nTo: {to}\r\nSubject: {subject}\r\n"
+            f"Date: {format_datetime(datetime.fromtimestamp(sent_at, timezone.utc))}\r\n"
+            f"Message-ID: <{random.getrandbits(64):x}.{sent_at:.6f}@fake.local>\r\n"
+            f"X-Sent-At: {sent_at:.6f}\r\nMIME-Version: 1.0\r\n")
+    if not html and not attachment_bytes:
+        return (head + "Content-Type: text/plain; charset=utf-8\r\n\r\n" + body + "\r\n").encode("utf-8")
+    parts = [f"--{boundary}\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n{body}\r\n"]
+    if html:
+        parts.append(f"--{boundary}\r\nContent-Type: text/html; charset=utf-8\r\n\r\n{html}\r\n")
+    if attachment_bytes:
+        blob = "\r\n".join(["QUFB" * 19] * max(1, attachment_bytes // 78))
+        parts.append(f"--{boundary}\r\nContent-Type: application/pdf\r\n"
+                     f"Content-Disposition: attachment; filename=\"a.pdf\"\r\n"
+                     f"Content-Transfer-Encoding: base64\r\n\r\n{blob}\r\n")
+    return (head + f"Content-Type: multipart/mixed; boundary=\"{boundary}\"\r\n\r\n"
+            + "".join(parts) + f"--{boundary}--\r\n").encode("utf-8")
+
+def _stamp(raw):
+    """投递时在最上面加一条 Received（与真实服务器一致），转发脚本据此计算端到端延迟"""
+    now = format_datetime(datetime.now(timezone.utc))
+    return f"Received: from sender.example by fake.local; {now}\r\n".encode() + raw
+
+def _arrival(msg):
+    try:
+        return email.utils.parsedate_to_datetime(msg.get_all("Received")[0].rsplit(";", 1)[1].strip())
+    except Exception:
+        return datetime.now(timezone.utc)
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _Base:
+    def start(self):
+        threading.Thread(target=self._srv.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._srv.shutdown()
+        self._srv.server_close()
+
+    @property
+    def port(self):
+        return self._srv.server_address[1]
+
+# ====== POP3 ======
+class FakePOP3Server(_Base):
+    """snapshot=True 时模拟"登录时快照"的服务器：会话内看不到之后到达的新信"""
+
+    def __init__(self, pipelining=False, snapshot=False):
+        self.lock = threading.Lock()
+        self.mailboxes = {}          # user → [(uid, raw)]
+        self.pipelining = pipelining
+        self.snapshot = snapshot
+        self.commands = []
+        self._uid_seq = 0
+        self._srv = _Server(("127.0.0.1", 0), _POP3Handler)
+        self._srv.fake = self
+
+    def deliver(self, user, raw):
+        with self.lock:
+            self._uid_seq += 1
+            self.mailboxes.setdefault(user, []).append((f"u{self._uid_seq:08d}", _stamp(raw)))
+
+    def delete_first(self, user, n=1):
+        with self.lock:
+            del self.mailboxes.setdefault(user, [])[:n]
+
+class _POP3Handler(socketserver.StreamRequestHandler):
+    def _w(self, s):
+        self.wfile.write(s.encode() + b"\r\n")
+
+    def _multi(self, lines):
+        out = []
+        for l in lines:
+            out.append(b"." + l if l.startswith(b".") else l)
+        self.wfile.write(b"\r\n".join(out) + b"\r\n.\r\n")
+
+    def handle(self):
+        fake = self.server.fake
+        user = None
+        snap = None
+        self._w("+OK fake pop3 ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.decode("utf-8", "ignore").strip().split()
+            if not parts:
+                continue
+            cmd = parts[0].upper()
+            with fake.lock:
+                fake.commands.append(" ".join(parts[:1] + parts[1:2] if cmd != "PASS" else ["PASS"]))
+                msgs = snap if snap is not None else list(fake.mailboxes.get(user, []))
+            if cmd == "USER":
+                user = parts[1] if len(parts) > 1 else ""; self._w("+OK")
+            elif cmd == "PASS":
+                if fake.snapshot:
+                    with fake.lock:
+                        snap = list(fake.mailboxes.get(user, []))
+                self._w("+OK logged in")
+            elif cmd == "NOOP":
+                self._w("+OK")
+            elif cmd == "CAPA":
+                self._w("+OK"); self._multi([b"TOP", b"UIDL", b"USER"] + ([b"PIPELINING"] if fake.pipelining else []))
+            elif cmd == "STLS":
+                self._w("-ERR STLS not supported")
+            elif cmd == "STAT":
+                self._w(f"+OK {len(msgs)} {sum(len(r) for _, r in msgs)}")
+            elif cmd in ("LIST", "UIDL") and len(parts) > 1:
+                n = int(parts[1])
+                if not 1 <= n <= len(msgs):
+                    self._w("-ERR no such message"); continue
+                self._w(f"+OK {n} {msgs[n-1][0] if cmd == 'UIDL' else len(msgs[n-1][1])}")
+            elif cmd in ("LIST", "UIDL"):
+                self._w("+OK")
+                self._multi([f"{i} {u if cmd == 'UIDL' else len(r)}".encode() for i, (u, r) in enumerate(msgs, 1)])
+            elif cmd in ("RETR", "TOP"):
+                n = int(parts[1]) if len(parts) > 1 else 0
+                if not 1 <= n <= len(msgs):
+                    self._w("-ERR no such message"); continue
+                lines = msgs[n-1][1].split(b"\r\n")
+                if lines and lines[-1] == b"":
+                    lines.pop()
+                if cmd == "TOP":
+                    k = int(parts[2]) if len(parts) > 2 else 0
+                    i = lines.index(b"") if b"" in lines else len(lines)
+                    lines = lines[:i + 1 + k]
+                self._w("+OK"); self._multi(lines)
+            elif cmd == "QUIT":
+                self._w("+OK bye"); return
+            else:
+                self._w("-ERR unknown command")
+
+# ====== IMAP ======
+class _Folder:
+    def __init__(self, uidvalidity):
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.modseq = 1
+        self.msgs = []      # [(uid, raw)]
+
+class FakeIMAPServer(_Base):
+    def __init__(self, folders=("INBOX", "Junk"), condstore=True, notify=False):
+        self.lock = threading.Lock()
+        self.folders = {f: _Folder(int(time.time()) % 100000 + i) for i, f in enumerate(folders)}
+        self.capabilities = ["IMAP4rev1", "IDLE", "UIDPLUS", "ENABLE"] + (["CONDSTORE"] if condstore else []) \
+            + (["NOTIFY"] if notify else [])
+        self.sessions = set()
+        self.commands = []
+        self._srv = _Server(("127.0.0.1", 0), _IMAPHandler)
+        self._srv.fake = self
+
+    def deliver(self, raw, folder="INBOX"):
+        with self.lock:
+            f = self.folders[folder]
+            f.msgs.append((f.uidnext, _stamp(raw))); f.uidnext += 1; f.modseq += 1
+            exists = len(f.msgs)
+            sessions = list(self.sessions)
+        for s in sessions:
+            s.notify_exists(folder, exists)
+
+def _seq_set(spec, maxval):
+    out = set()
+    for piece in spec.split(","):
+        a, _, b = piece.partition(":")
+        a = maxval if a == "*" else int(a)
+        b = a if not b else (maxval if b == "*" else int(b))
+        lo, hi = min(a, b), max(a, b)
+        out.update(range(lo, hi + 1))
+    return out
+
+def _tokens(s):
+    """把 FETCH 项列表按空格切开，括号/方括号内的空格不切"""
+    out, depth, cur = [], 0, ""
+    for ch in s:
+        if ch in "([": depth += 1
+        if ch in ")]": depth -= 1
+        if ch == " " and depth == 0:
+            if cur: out.append(cur)
+            cur = ""
+        else:
+            cur += ch
+    if cur: out.append(cur)
+    return out
+
+def _q(s):
+    return "NIL" if s is None else '"%s"' % str(s).replace("\\", "\\\\").replace('"', '\\"')
+
+def _bodystructure(part):
+    if part.is_multipart():
+        subs = "".join(_bodystructure(p) for p in part.get_payload())
+        return "(%s %s)" % (subs, _q(part.get_content_subtype().upper()))
+    maintype, subtype = part.get_content_maintype().upper(), part.get_content_subtype().upper()
+    params = part.get_params() or []
+    plist = " ".join("%s %s" % (_q(k.upper()), _q(v)) for k, v in params[1:]) or ""
+    payload = part.get_payload(decode=False)
+    payload = payload.encode("utf-8", "surrogateescape") if isinstance(payload, str) else (payload or b"")
+    enc = (part.get("Content-Transfer-Encoding") or "7BIT").upper()
+    disp = part.get_content_disposition()
+    disp_s = "(%s NIL)" % _q(disp.upper()) if disp else "NIL"
+    base = "%s %s %s NIL NIL %s %d" % (_q(maintype), _q(subtype), "(%s)" % plist if plist else "NIL", _q(enc), len(payload))
+    if maintype == "TEXT":
+        base += " %d" % payload.count(b"\n")
+    return "(%s NIL %s NIL NIL)" % (base, disp_s)
+
+_CRLF = email.policy.compat32.clone(linesep="\r\n")
+
+def _section(msg, spec):
+    """返回 BODY[spec] 的原始字节（spec 形如 1 / 1.2 / TEXT / HEADER.FIELDS (...)）"""
+    raw = msg.as_bytes(policy=_CRLF)
+    head, _, body = raw.partition(b"\r\n\r\n")
+    if spec == "":
+        return raw
+    if spec == "TEXT":
+        return body
+    if spec == "HEADER":
+        return head + b"\r\n\r\n"
+    if spec.startswith("HEADER.FIELDS"):
+        names = {n.upper() for n in re.findall(r"[\w-]+", spec[len("HEADER.FIELDS"):])}
+        out = [f"{k}: {v}" for k, v in msg.items() if k.upper() in names]
+        return ("\r\n".join(out) + "\r\n\r\n").encode("utf-8", "surrogateescape")
+    part = msg
+    for idx in spec.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(idx) - 1]
+        elif idx != "1":
+            return b""
+    payload = part.get_payload(decode=False)
+    return payload.encode("utf-8", "surrogateescape") if isinstance(payload, str) else b""
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.wlock = threading.Lock()
+        self.folder = None
+        self.idling = None
+        self.notify_all = False
+        self.pending = []
+
+    def _w(self, data):
+        with self.wlock:
+            self.wfile.write(data if isinstance(data, bytes) else data.encode() + b"\r\n")
+
+    def notify_exists(self, folder, exists):
+        # 与真实服务器一样：IDLE 中立即推送；否则暂存，随下一条命令的响应一起发出
+        if self.folder == folder:
+            line = f"* {exists} EXISTS"
+        elif self.notify_all:
+            line = f'* STATUS "{folder}" (MESSAGES {exists} UIDNEXT {self.server.fake.folders[folder].uidnext})'
+        else:
+            return
+        with self.wlock:
+            if self.idling:
+                self.wfile.write(line.encode() + b"\r\n")
+            else:
+                self.pending.append(line)
+
+    def _flush_pending(self):
+        with self.wlock:
+            pending, self.pending = self.pending, []
+            for line in pending:
+                self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        fake = self.server.fake
+        with fake.lock:
+            fake.sessions.add(self)
+        try:
+            self._w("* OK fake imap ready")
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                line = line.decode("utf-8", "ignore").rstrip("\r\n")
+                if self.idling:
+                    if line.upper() == "DONE":
+                        tag, self.idling = self.idling, None
+                        self._w(f"{tag} OK IDLE terminated")
+                    continue
+                tag, _, rest = line.partition(" ")
+                cmd, _, args = rest.partition(" ")
+                cmd = cmd.upper()
+                if cmd != "IDLE":
+                    self._flush_pending()
+                with fake.lock:
+                    fake.commands.append(f"{cmd} {args}".strip() if cmd != "LOGIN" else "LOGIN")
+                if cmd == "UID":
+                    sub, _, args = args.partition(" ")
+                    self._uid(tag, sub.upper(), args)
+                elif cmd == "CAPABILITY":
+                    self._w("* CAPABILITY " + " ".join(fake.capabilities)); self._w(f"{tag} OK done")
+                elif cmd == "LOGIN":
+                    self._w(f"{tag} OK [CAPABILITY {' '.join(fake.capabilities)}] logged in")
+                elif cmd in ("SELECT", "EXAMINE"):
+                    name = args.split(" ")[0].strip('"')
+                    if name not in fake.folders:
+                        self._w(f"{tag} NO no such mailbox"); continue
+                    self.folder = name
+                    with fake.lock:
+                        f = fake.folders[name]
+                        self._w(f"* {len(f.msgs)} EXISTS"); self._w("* 0 RECENT")
+                        self._w("* FLAGS (\\Seen)")
+                        self._w(f"* OK [UIDVALIDITY {f.uidvalidity}] ok")
+                        self._w(f"* OK [UIDNEXT {f.uidnext}] ok")
+                        if "CONDSTORE" in fake.capabilities:
+                            self._w(f"* OK [HIGHESTMODSEQ {f.modseq}] ok")
+                    self._w(f"{tag} OK [{'READ-ONLY' if cmd == 'EXAMINE' else 'READ-WRITE'}] done")
+                elif cmd == "STATUS":
+                    name = args.split(" ")[0].strip('"')
+                    with fake.lock:
+                        f = fake.folders.get(name)
+                    if not f:
+                        self._w(f"{tag} NO no such mailbox"); continue
+                    self._w(f'* STATUS "{name}" (MESSAGES {len(f.msgs)} UIDNEXT {f.uidnext} UIDVALIDITY {f.uidvalidity})')
+                    self._w(f"{tag} OK done")
+                elif cmd == "LIST":
+                    pattern = _tokens(args)[-1].strip('"') if args else "*"
+                    for name in fake.folders:
+                        if fnmatch.fnmatchcase(name, pattern.replace("%", "*")):
+                            flags = "\\Junk" if name in ("Junk", "Spam") else ""
+                            self._w(f'* LIST ({flags}) "/" "{name}"')
+                    self._w(f"{tag} OK done")
+                elif cmd == "IDLE":
+                    with self.wlock:
+                        self.idling = tag
+                        self.wfile.write(b"+ idling\r\n")
+                    self._flush_pending()
+                elif cmd == "NOTIFY" and "NOTIFY" in fake.capabilities:
+                    self.notify_all = "NONE" not in args.upper()
+                    self._w(f"{tag} OK done")
+                elif cmd in ("NOOP", "ENABLE", "CHECK"):
+                    self._w(f"{tag} OK done")
+                elif cmd == "LOGOUT":
+                    self._w("* BYE"); self._w(f"{tag} OK done"); return
+                else:
+                    self._w(f"{tag} BAD unsupported")
+        finally:
+            with fake.lock:
+                fake.sessions.discard(self)
+
+    def _uid(self, tag, sub, args):
+        fake = self.server.fake
+        with fake.lock:
+            msgs = list(fake.folders[self.folder].msgs) if self.folder else []
+        maxuid = msgs[-1][0] if msgs else 0
+        if sub == "SEARCH":
+            crit = args.split()
+            uids = [u for u, _ in msgs]
+            if crit and crit[0].upper() == "UID":
+                want = _seq_set(crit[1], maxuid)
+                uids = [u for u in uids if u in want]
+            elif crit and crit[0][0].isdigit() or crit and crit[0][0] == "*":
+                want = _seq_set(crit[0], len(msgs))
+                uids = [u for i, (u, _) in enumerate(msgs, 1) if i in want]
+            self._w("* SEARCH" + "".join(f" {u}" for u in uids)); self._w(f"{tag} OK done")
+        elif sub == "FETCH":
+            spec, _, items = args.partition(" ")
+            want = _seq_set(spec, maxuid)
+            items = _tokens(items.strip()[1:-1] if items.strip().startswith("(") else items.strip())
+            for seq, (uid, raw) in enumerate(msgs, 1):
+                if uid not in want:
+                    continue
+                msg = email.message_from_bytes(raw)
+                chunks = [f"* {seq} FETCH (UID {uid}".encode()]
+                for it in items:
+                    up = it.upper()
+                    if up == "UID":
+                        continue
+                    if up == "BODYSTRUCTURE":
+                        chunks.append(b" BODYSTRUCTURE " + _bodystructure(msg).encode()); continue
+                    if up == "RFC822.SIZE":
+                        chunks.append(f" RFC822.SIZE {len(raw)}".encode()); continue
+                    if up == "INTERNALDATE":
+                        dt = _arrival(msg)
+                        chunks.append(f' INTERNALDATE "{dt.strftime("%d-%b-%Y %H:%M:%S %z")}"'.encode()); continue
+                    m = re.match(r"(?:BODY(?:\.PEEK)?\[(.*?)\]|RFC822\.(HEADER|TEXT)|RFC822)(?:<(\d+)\.(\d+)>)?$", it, re.I)
+                    if not m:
+                        continue
+                    if m.group(2):
+                        sec = {"HEADER": "HEADER", "TEXT": "TEXT"}[m.group(2).upper()]
+                        name = f"RFC822.{m.group(2).upper()}"
+                    elif m.group(0).upper() == "RFC822":
+                        sec, name = "", "RFC822"
+                    else:
+                        sec = m.group(1)
+                        name = f"BODY[{sec}]"
+                    data = _section(msg, sec.upper() if not sec[:1].isdigit() else sec)
+                    if m.group(3):
+                        off, ln = int(m.group(3)), int(m.group(4))
+                        data = data[off:off + ln]
+                        name += f"<{off}>"
+                    chunks.append(f" {name} {{{len(data)}}}\r\n".encode() + data)
+                chunks.append(b")\r\n")
+                self._w(b"".join(chunks))
+            self._w(f"{tag} OK done")
+        else:
+            self._w(f"{tag} BAD unsupported")
+
+# ====== Telegram ======
+class FakeTelegram(_Base):
+    """记录每条 sendMessage；rate_429 为返回 429 的概率，retry_after 为建议等待秒数"""
+
+    def __init__(self, rate_429=0.0, retry_after=1, latency=0.0):
+        self.lock = threading.Lock()
+        self.messages = []          # [(time, chat_id, text)]
+        self.count_429 = 0
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.latency = latency
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *a):
+                pass
+
+            def do_POST(self):
+                n = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(n).decode("utf-8", "ignore")
+                if "json" in (self.headers.get("Content-Type") or ""):
+                    data = json.loads(raw or "{}")
+                else:
+                    data = {k: v[0] for k, v in parse_qs(raw).items()}
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if not self.path.endswith("/sendMessage"):
+                    return self._reply(200, {"ok": True, "result": []})
+                if fake.rate_429 and random.random() < fake.rate_429:
+                    with fake.lock:
+                        fake.count_429 += 1
+                    return self._reply(429, {"ok": False, "error_code": 429,
+                                             "description": "Too Many Requests",
+                                             "parameters": {"retry_after": fake.retry_after}})
+                with fake.lock:
+                    fake.messages.append((time.time(), str(data.get("chat_id")), data.get("text", "")))
+                self._reply(200, {"ok": True, "result": {"message_id": len(fake.messages)}})
+
+            def _reply(self, status, obj):
+                body = json.dumps(obj).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._srv.daemon_threads = True
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self._srv.server_address[1]
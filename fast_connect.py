@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+建连加速（POP3 / IMAP 两个转发脚本共用）：
+- 记住每个主机上次成功的传输方式（如 995/SSL、110/STLS），重连时先试它，不再每次先等 SSL 端口超时
+- 候选方式并行竞速（happy eyeballs）：首选方式 CONNECT_RACE_DELAY 秒内没连上就同时开始下一种，先连上的胜出，
+  其余连上后立即关闭。只竞速到"传输就绪"（TCP + TLS 握手 / STARTTLS），登录只在胜出的连接上做一次
+- 明文连接（STARTTLS 失败后的降级）只有在加密方式都失败时才会被采用，且不会被记为首选：
+  每次重连都先试加密方式，加密端口恢复后立即改回加密
+- TLS 会话复用：每个主机一个 SSLContext，握手时带上上次登录成功后保存的会话（服务器支持时省掉完整握手）
+
+可选环境变量：
+CONNECT_RACE_DELAY=0.3       # 首选方式多久没连上就并行尝试下一种（秒）
+"""
+import os, ssl, queue, threading
+
+_lock = threading.Lock()
+_preferred = {}      # 主机 → 上次成功的加密方式名
+_contexts = {}       # 主机 → _ResumingContext
+
+class _ResumingContext(ssl.SSLContext):
+    """wrap_socket 时自动带上该主机上次的 TLS 会话（poplib / imaplib 都经由 context.wrap_socket 握手）"""
+    session = None
+
+    def wrap_socket(self, sock, *args, **kwargs):
+        if self.session is not None and kwargs.get("session") is None and not kwargs.get("server_side"):
+            kwargs["session"] = self.session
+        return super().wrap_socket(sock, *args, **kwargs)
+
+def tls_context(host):
+    """该主机共用的 TLS 上下文（与 ssl.create_default_context() 相同的校验设置）"""
+    with _lock:
+        ctx = _contexts.get(host)
+        if ctx is None:
+            ctx = _contexts[host] = _ResumingContext(ssl.PROTOCOL_TLS_CLIENT)
+            ctx.load_default_certs(ssl.Purpose.SERVER_AUTH)
+        return ctx
+
+def remember_session(host, sock):
+    """登录成功后保存 TLS 会话；TLS 1.3 的会话票据在握手之后才到，所以放在登录之后取"""
+    sess = getattr(sock, "session", None)
+    if sess is not None:
+        tls_context(host).session = sess
+
+def forget(host):
+    """胜出的连接登录失败：下次重新按默认顺序竞速，也不再复用旧会话"""
+    with _lock:
+        _preferred.pop(host, None)
+        ctx = _contexts.get(host)
+    if ctx is not None:
+        ctx.session = None
+
+def race(host, candidates, close):
+    """candidates：[(方式名, 函数)]，函数返回 (连接, 是否加密) 或抛异常；close(连接) 用于关闭落败的连接。
+    返回 (方式名, 连接, 是否加密)；全部失败时抛出最后一个异常"""
+    delay = float(os.getenv("CONNECT_RACE_DELAY", "0.3"))
+    with _lock:
+        pref = _preferred.get(host)
+    order = sorted(candidates, key=lambda c: c[0] != pref)     # 上次成功的排最前，其余保持原顺序
+    results = queue.Queue()
+
+    def attempt(name, fn):
+        try:
+            conn, secure = fn()
+        except Exception as e:
+            results.put((name, None, False, e))
+        else:
+            results.put((name, conn, secure, None))
+
+    def start(i):
+        name, fn = order[i]
+        threading.Thread(target=attempt, args=(name, fn), name=f"connect-{name}", daemon=True).start()
+        return i + 1
+
+    started = finished = 0
+    winner = plain = err = None
+    while winner is None and (finished < started or started < len(order)):
+        if finished == started:                                 # 在途的都失败了：马上试下一种
+            started = start(started)
+        try:
+            name, conn, secure, e = results.get(timeout=delay if started < len(order) else None)
+        except queue.Empty:
+            started = start(started)                            # 首选方式迟迟没连上：并行开始下一种
+            continue
+        finished += 1
+        if e is not None:
+            err = e
+        elif secure:
+            winner = (name, conn, secure)
+        elif plain is None:
+            plain = (name, conn, secure)
+        else:
+            _close_quietly(close, conn)
+
+    if winner is None:
+        winner = plain
+    elif plain is not None:
+        _close_quietly(close, plain[1])
+    if finished < started:
+        threading.Thread(target=_reap, args=(results, started - finished, close), daemon=True).start()
+    if winner is None:
+        raise err
+    with _lock:
+        if winner[2]:
+            _preferred[host] = winner[0]
+        else:
+            _preferred.pop(host, None)
+    if winner[0] != pref:
+        print(f"[连接] {host} 使用 {winner[0]}" + ("（明文，仅在可信网络用）" if not winner[2] else ""))
+    return winner
+
+def _close_quietly(close, conn):
+    try:
+        close(conn)
+    except Exception:
+        pass
+
+def _reap(results, n, close):
+    """关闭竞速中落败、但之后才连上的连接"""
+    for _ in range(n):
+        _, conn, _, e = results.get()
+        if e is None:
+            _close_quietly(close, conn)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+混合模式（hybrid_forwarder.py）的先到先推：IMAP 与 POP3 两路同时收同一个邮箱，谁先识别到验证码谁推送，
+另一路之后看到同一封时丢弃，不会重复推送。
+- 键：账号 + Message-ID；没有 Message-ID 时用 发件人 + 主题 + Date 原始头的哈希（两路取到的头相同）
+- 记录各来源胜出次数，以及另一路晚了多久才看到同一封（领先时间），用来比较两路的实际延迟
+- 没有 enable() 时（单独运行两个脚本）claim 恒为 True，行为不变
+
+可选环境变量：
+HYBRID_DEDUP_SECONDS=86400   # 记住已推送邮件的时长
+HYBRID_DEDUP_MAX=20000       # 最多记住的邮件数
+"""
+import os, time, hashlib, threading
+from collections import OrderedDict, deque
+import metrics
+
+_lock = threading.Lock()
+_enabled = False
+_claims = OrderedDict()     # (账号, 键) → [胜出来源, 识别时间, 已看到的来源集合]
+_wins = {}                  # 来源 → 胜出次数
+_leads = {}                 # 胜出来源 → 最近的领先时间（秒）
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def enabled():
+    return _enabled
+
+def message_key(msg):
+    """msg：email.message.Message（可以只有头部）"""
+    mid = (msg.get("Message-ID") or "").strip()
+    if mid:
+        return mid
+    raw = "\n".join(" ".join(str(msg.get(h) or "").split()) for h in ("From", "Subject", "Date"))
+    return "sha1:" + hashlib.sha1(raw.encode("utf-8", "ignore")).hexdigest()
+
+def _expire(now):
+    ttl = float(os.getenv("HYBRID_DEDUP_SECONDS", "86400"))
+    cap = int(os.getenv("HYBRID_DEDUP_MAX", "20000"))
+    while _claims and (len(_claims) > cap or now - next(iter(_claims.values()))[1] > ttl):
+        _claims.popitem(last=False)
+
+def _seen_again(entry, source, now):
+    """另一路也看到了：记录胜出来源领先了多久（每个来源只记一次）"""
+    winner, t0, sources = entry
+    if source in sources:
+        return
+    sources.add(source)
+    lead = now - t0
+    _leads.setdefault(winner, deque(maxlen=1000)).append(lead)
+    metrics.inc("hybrid_dropped_total", source=source)
+    metrics.observe("hybrid_lead_seconds", lead, winner=winner)
+
+def claim(account, key, source):
+    """识别到验证码、推送之前调用：返回 True 表示本路第一个看到、由本路推送；False 表示另一路已推送，丢弃"""
+    if not _enabled:
+        return True
+    now = time.monotonic()
+    k = ((account or "").lower(), key)
+    with _lock:
+        _expire(now)
+        entry = _claims.get(k)
+        if entry is not None:
+            _seen_again(entry, source, now)
+            return False
+        _claims[k] = [source, now, {source}]
+        _wins[source] = _wins.get(source, 0) + 1
+    metrics.inc("hybrid_wins_total", source=source)
+    return True
+
+def saw(account, key, source):
+    """本路因其他原因（如去重库里已有该 Message-ID）不推送时调用：只在另一路推送过时记录领先时间"""
+    if not _enabled:
+        return
+    with _lock:
+        entry = _claims.get(((account or "").lower(), key))
+        if entry is not None:
+            _seen_again(entry, source, time.monotonic())
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def summary():
+    """一行摘要：各来源胜出次数与占比，两路都看到的邮件里胜出来源领先时间的 p50/p95"""
+    with _lock:
+        wins = dict(_wins)
+        leads = {s: list(d) for s, d in _leads.items()}
+    total = sum(wins.values())
+    if not total:
+        return "暂无数据"
+    parts = []
+    for src in sorted(wins):
+        s = f"{src} 胜出 {wins[src]}（{100 * wins[src] / total:.0f}%）"
+        if leads.get(src):
+            v = leads[src]
+            s += f"，领先 p50={_pct(v, 0.5):.1f}s p95={_pct(v, 0.95):.1f}s（n={len(v)}）"
+        parts.append(s)
+    return "；".join(parts)
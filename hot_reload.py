@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+热加载的 JSON 配置文件（code_rules.py、routing.py 共用）：
+- 路径和检查间隔都从环境变量读（每次检查时读，改环境变量的测试/脚本不用重新导入）
+- 每隔 检查间隔 秒看一次文件修改时间，变化后重新解析并编译；读取路径上不加锁，只有到点检查时才加锁
+- 新文件有错误时打印原因并继续用旧的结果；文件被删除时换回空值
+"""
+import os, json, time, threading
+
+class HotFile:
+    def __init__(self, tag, path_env, default_path, check_env, compile_fn, empty, describe, missing_msg):
+        """compile_fn(解析出的 JSON) → 编译结果，格式错误时抛异常；empty() → 没有文件时的值；
+        describe(结果) → 加载成功时打印的摘要；tag / missing_msg 用于日志"""
+        self.tag, self.path_env, self.default_path, self.check_env = tag, path_env, default_path, check_env
+        self.compile_fn, self.empty, self.describe, self.missing_msg = compile_fn, empty, describe, missing_msg
+        self.value = empty()
+        self._lock = threading.Lock()
+        self._loaded = None         # (路径, 修改时间)；None 表示还没加载过
+        self._next_check = 0.0
+
+    def get(self):
+        """到点时检查一次文件，返回当前结果"""
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._maybe_reload(now)
+        return self.value
+
+    def _maybe_reload(self, now):
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + float(os.getenv(self.check_env, "2"))
+            path = os.getenv(self.path_env, self.default_path)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                if self._loaded is not None and self._loaded[1] is not None:
+                    print(f"[{self.tag}] {path} 已不存在，{self.missing_msg}")
+                self.value, self._loaded = self.empty(), (path, None)
+                return
+            if self._loaded == (path, mtime):
+                return
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    value = self.compile_fn(json.load(f))
+            except Exception as e:
+                print(f"[{self.tag}] {path} 加载失败，继续使用旧配置：", e)
+            else:
+                self.value = value
+                print(f"[{self.tag}] 已加载 {path}：{self.describe(value)}")
+            self._loaded = (path, mtime)
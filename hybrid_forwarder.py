@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+混合模式：同一个邮箱同时用 IMAP IDLE（推送快，但偶尔卡住）和 POP3 轮询（稳，但慢）收信，
+谁先识别到验证码谁推送，另一路之后看到同一封时丢弃（first_seen.py），不会重复推送。
+- 只推送识别到的验证码：IMAP 一路不发"未识别到验证码"通知（POP3 可能识别得到，先发会重复推送）
+- 两路在同一进程里运行，共用去重库、解析线程、发送队列、验证码缓存和指标
+- 每 HYBRID_LOG_EVERY 秒输出一行各来源胜出次数/占比与领先时间；开启指标时另有
+  mail2tg_hybrid_wins_total、mail2tg_hybrid_dropped_total、mail2tg_hybrid_lead_seconds
+
+环境变量：两个脚本各自的配置照常生效（IMAP_* / POP3_*、轮询、建连等）。
+账号与 Telegram 以 IMAP 脚本的 MAIL_USER / MAIL_PASS / TG_BOT_TOKEN / TG_CHAT_ID 为准，
+POP3 一路缺省沿用它们（另设 EMAIL_USER / EMAIL_PASS / TELEGRAM_BOT_TOKEN / TELEGRAM_CHAT_ID 时优先）。
+HYBRID_LOG_EVERY=300         # 胜出统计摘要间隔（秒）；0=不输出
+HYBRID_DEDUP_SECONDS=86400   # 记住已推送邮件的时长（见 first_seen.py）
+"""
+import os, time, threading, importlib.util
+
+# ---------- .env ----------
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception:
+    pass
+
+import imap_idle_forwarder as imap
+import metrics
+import pipeline
+import first_seen
+import local_http
+from dedup_store import open_store
+
+def _load_pop3():
+    """POP3 脚本文件名以数字开头，不能直接 import"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "2925_to_telegram_pop3_autorefresh.py")
+    spec = importlib.util.spec_from_file_location("pop3_forwarder", path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+def pop3_account():
+    return {"host": os.getenv("POP3_HOST", "pop3.2925.com").strip(),
+            "user": os.getenv("EMAIL_USER") or imap.MAIL_USER,
+            "pass": os.getenv("EMAIL_PASS") or imap.MAIL_PASS,
+            "token": os.getenv("TELEGRAM_BOT_TOKEN") or imap.TG_BOT_TOKEN,
+            "chat": os.getenv("TELEGRAM_CHAT_ID") or imap.TG_CHAT_ID,
+            "proxy": os.getenv("TG_PROXY") or None}
+
+def main():
+    pop3 = _load_pop3()
+    acc = pop3_account()
+    if acc["user"].lower() != imap.MAIL_USER.lower():
+        print(f"⚠️ IMAP 与 POP3 账号不同（{imap.MAIL_USER} / {acc['user']}），两路不会互相去重")
+    first_seen.enable()
+    metrics.start()
+    local_http.start()
+    pipeline.install_signal_handlers()
+
+    # POP3 先起：IMAP 登录探测失败时会一直重试，不能挡住另一路
+    threading.Thread(target=pop3.account_loop, args=(acc,), name=f"pop3-{acc['user']}", daemon=True).start()
+    threading.Thread(target=imap.start_watchers, args=(open_store(imap.DEDUP_DB_PATH),),
+                     name="imap-plan", daemon=True).start()
+    print(f"[混合] {imap.MAIL_USER}：IMAP IDLE 与 POP3 轮询同时收信，先识别到的一路推送")
+
+    every = float(os.getenv("HYBRID_LOG_EVERY", "300") or 0)
+    last = time.monotonic()
+    try:
+        while not pipeline.stopping():
+            time.sleep(1)
+            if every > 0 and time.monotonic() - last >= every:
+                last = time.monotonic()
+                print("[混合]", first_seen.summary())
+    except KeyboardInterrupt:
+        pipeline.shutdown()
+    print("[混合] 退出；", first_seen.summary())
+
+if __name__ == "__main__":
+    main()
@@ -2,19 +2,37 @@
 # -*- coding: utf-8 -*-
 """
 IMAP IDLE 秒推到 Telegram：
-- 实时：服务器推送新信事件（RFC 2177）
-- 轻量抓取：仅抓头部 + 纯文本，避免大附件
-- 去重持久化：seen_uids.json，重启不重复
+- 实时：服务器推送新信事件（RFC 2177），只在收到 EXISTS 时按 UID last+1:* 增量拉取
+- 多文件夹：IMAP_FOLDERS（如 INBOX,\Junk）；支持 NOTIFY（RFC 5465）时一条连接，否则每个文件夹一条 IDLE 连接（IMAP_MAX_CONNECTIONS）
+- 轻量抓取：先取 BODYSTRUCTURE + 少量头字段，再只取 text/plain（或 text/html）部分的前 N 字节
+- 去重持久化：SQLite（dedup_store.py，按 账号+文件夹+UIDVALIDITY+UID 去重），重启不重复
 - 时区：默认 Asia/Shanghai（修复“差 8 小时”）
-- 两条消息：①时间+谁发给谁 ②纯6位验证码
-- 连接策略：优先 SSL(993)，失败回退到 STARTTLS(143)
+- 两条消息：①时间+谁发给谁 ②纯6位验证码（发送队列异步推送，连接池复用，按 chat/全局限速，见 tg_delivery.py）
+- 连接策略：SSL(993) 与 STARTTLS(143) 竞速，记住上次成功的方式、复用 TLS 会话（CONNECT_RACE_DELAY，见 fast_connect.py）
+- 流水线：IDLE 线程只负责取字节，解码/识别在解析线程，推送在发送队列；队列有界（背压），SIGTERM 时排空再退出（见 pipeline.py）
+- 按收件地址路由：ROUTES_FILE 把不同子地址/别名的邮件并行推送到各自的 chat（见 routing.py）
+- 最近验证码：识别结果进内存缓存，设置 LOCAL_PORT 后可本地查询 / 长轮询等待（见 code_cache.py、local_http.py）
+- 运行指标：设置 LOCAL_PORT / METRICS_LOG_EVERY 后记录分阶段耗时与端到端延迟（INTERNALDATE → 推送成功，见 metrics.py）
 """
-import os, re, json, time, email, requests, ssl, socket
+import os, re, time, email, ssl, socket, base64, quopri, imaplib, threading
 from datetime import datetime, timezone
 from email.header import decode_header, make_header
 from email.utils import parsedate_to_datetime
-from imapclient import IMAPClient
+from email.parser import BytesHeaderParser
+from imapclient import IMAPClient, imap_utf7
+from imapclient.response_parser import parse_response
 from zoneinfo import ZoneInfo
+from dedup_store import open_store
+from tg_delivery import get_delivery
+from mail_text import html_to_text
+import fast_connect
+import code_rules
+import code_cache
+import local_http
+import first_seen
+import routing
+import metrics
+import pipeline
 
 # ---------- .env ----------
 try:
@@ -27,6 +45,11 @@ IMAP_HOST = os.getenv("IMAP_HOST", "imap.2925.com")
 IMAP_PORT_SSL = int(os.getenv("IMAP_PORT_SSL", "993"))
 IMAP_PORT_STARTTLS = int(os.getenv("IMAP_PORT_STARTTLS", "143"))
 IMAP_FOLDER = os.getenv("IMAP_FOLDER", "INBOX")
+# 同时监视的文件夹，逗号分隔；\Junk 表示服务器上的垃圾邮件文件夹（按 SPECIAL-USE 或 Junk/Spam 等常见名字查找）
+IMAP_FOLDERS = [f.strip() for f in os.getenv("IMAP_FOLDERS", "").split(",") if f.strip()] or [IMAP_FOLDER]
+IMAP_NOTIFY = os.getenv("IMAP_NOTIFY", "1") == "1"                  # 服务器支持 NOTIFY 时一条连接监视全部文件夹
+IMAP_MAX_CONNECTIONS = int(os.getenv("IMAP_MAX_CONNECTIONS", "3"))  # 不支持 NOTIFY 时最多几条 IDLE 连接（每条负责一部分文件夹）
+IMAP_PLAIN_FALLBACK = os.getenv("IMAP_PLAIN_FALLBACK", "0") == "1"   # STARTTLS 也失败时明文登录（仅本地测试/可信网络）
 
 MAIL_USER = os.getenv("MAIL_USER", "")
 MAIL_PASS = os.getenv("MAIL_PASS", "")
@@ -38,23 +61,27 @@ TIMEZONE = os.getenv("TIMEZONE", "Asia/Shanghai")
 CODE_REGEX = os.getenv("CODE_REGEX", r"(?<!\d)(\d{6})(?!\d)")
 FETCH_STARTUP_LAST_N = int(os.getenv("FETCH_STARTUP_LAST_N", "2"))
 IDLE_KEEPALIVE_SECONDS = int(os.getenv("IDLE_KEEPALIVE_SECONDS", "25"))
-DEDUP_DB_PATH = os.getenv("DEDUP_DB_PATH", ".seen_uids.json")
+IDLE_RESYNC_EVERY = int(os.getenv("IDLE_RESYNC_EVERY", "10"))   # 每 N 轮 IDLE 无论有无 EXISTS 都增量查一次（兜底）
+MAX_BATCH = 20                                                  # 一次最多处理最新的 N 封
+IMAP_BODY_BYTES = int(os.getenv("IMAP_BODY_BYTES", "16384"))    # 正文部分最多抓取的字节数（BODY.PEEK[n]<0.N>）
+HEADER_FIELDS = b'BODY.PEEK[HEADER.FIELDS (SUBJECT FROM TO CC DELIVERED-TO X-ORIGINAL-TO DATE MESSAGE-ID)]'
+
+DEDUP_DB_PATH = os.getenv("DEDUP_DB_PATH", ".seen_uids.sqlite3")
+LEGACY_SEEN_JSON = ".seen_uids.json"     # 旧版去重文件，首次连接时迁移进 SQLite
+if DEDUP_DB_PATH.endswith(".json"):
+    LEGACY_SEEN_JSON, DEDUP_DB_PATH = DEDUP_DB_PATH, os.path.splitext(DEDUP_DB_PATH)[0] + ".sqlite3"
 
 code_pat = re.compile(CODE_REGEX)
 local_tz = ZoneInfo(TIMEZONE)
 
-def send_tg(text: str):
-    if not TG_BOT_TOKEN or not TG_CHAT_ID:
-        print("⚠️ 未配置 TG_BOT_TOKEN / TG_CHAT_ID：", text)
+def send_tg(*texts: str, on_done=None, hdr=None):
+    """入队后立即返回；多条文本按顺序发送（积压时合并为一条）；on_done(ok) 在全部发完后回调。
+    hdr 不为空时按收件地址路由（routing.py），可能并行发到多个 chat；没有路由命中时发到 TG_CHAT_ID"""
+    dests = routing.targets(hdr, TG_CHAT_ID)
+    if not TG_BOT_TOKEN or not dests:
+        print("⚠️ 未配置 TG_BOT_TOKEN / TG_CHAT_ID：", *texts)
         return
-    url = f"https://api.telegram.org/bot{TG_BOT_TOKEN}/sendMessage"
-    for _ in range(3):
-        try:
-            r = requests.post(url, json={"chat_id": TG_CHAT_ID, "text": text}, timeout=8)
-            if r.ok:
-                return
-        except Exception:
-            time.sleep(0.8)
+    routing.fan_out(get_delivery(TG_BOT_TOKEN), dests, texts, on_done)
 
 def fmt_dt(dt: datetime) -> str:
     if dt.tzinfo is None:
@@ -67,25 +94,10 @@ def decode_str(s: str) -> str:
     except Exception:
         return s or ""
 
-def load_seen() -> set:
-    try:
-        with open(DEDUP_DB_PATH, "r", encoding="utf-8") as f:
-            return set(json.load(f))
-    except Exception:
-        return set()
-
-def save_seen(seen: set):
-    try:
-        with open(DEDUP_DB_PATH, "w", encoding="utf-8") as f:
-            json.dump(sorted(list(seen))[-10000:], f)
-    except Exception:
-        pass
-
 def extract_codes(text: str):
     return code_pat.findall(text or "")
 
-def parse_email(raw_bytes: bytes):
-    msg = email.message_from_bytes(raw_bytes)
+def _header_fields(msg):
     subject = decode_str(msg.get("Subject", ""))
     from_   = decode_str(msg.get("From", ""))
     to_     = decode_str(msg.get("To", ""))
@@ -94,6 +106,11 @@ def parse_email(raw_bytes: bytes):
         dt = parsedate_to_datetime(date_hdr)
     except Exception:
         dt = datetime.now(timezone.utc)
+    return subject, from_, to_, dt
+
+def parse_email(raw_bytes: bytes):
+    msg = email.message_from_bytes(raw_bytes)
+    subject, from_, to_, dt = _header_fields(msg)
 
     body_texts = []
     if msg.is_multipart():
@@ -113,74 +130,466 @@ def parse_email(raw_bytes: bytes):
     body = "\n".join(body_texts)
     return subject, from_, to_, dt, body
 
-def handle_messages(server: IMAPClient, uids, seen_uids: set):
-    uids = sorted(uids)
+def _s(v) -> str:
+    return v.decode("ascii", "ignore") if isinstance(v, bytes) else str(v or "")
+
+def _leaf_parts(bs, section=""):
+    """遍历 BODYSTRUCTURE 的叶子部分，产出 (section 编号, 该部分结构)；单部分邮件的编号是 1"""
+    if bs.is_multipart:
+        for i, sub in enumerate(bs[0], 1):
+            yield from _leaf_parts(sub, f"{section}.{i}" if section else str(i))
+    else:
+        yield section or "1", bs
+
+def pick_text_part(bs):
+    """选 text/plain（没有再选 text/html）且不是附件的部分；返回 (section, 子类型, 传输编码, charset) 或 None"""
+    best = {}
+    for section, part in _leaf_parts(bs):
+        maintype, subtype = _s(part[0]).lower(), _s(part[1]).lower()
+        if maintype != "text" or subtype not in ("plain", "html") or subtype in best:
+            continue
+        disp = part[9] if len(part) > 9 else None
+        if disp and _s(disp[0]).lower() == "attachment":
+            continue
+        params = list(part[2] or ())
+        params = {_s(k).lower(): _s(v) for k, v in zip(params[0::2], params[1::2])}
+        best[subtype] = (section, subtype, _s(part[5]).lower(), params.get("charset") or "utf-8")
+    return best.get("plain") or best.get("html")
+
+def decode_part(data: bytes, encoding: str, charset: str, subtype: str = "plain") -> str:
+    """按该部分声明的传输编码与字符集解码；data 可能被 <0.N> 截断，截断处的残缺编码直接丢弃"""
+    try:
+        if encoding == "base64":
+            clean = re.sub(rb"[^A-Za-z0-9+/]", b"", data)
+            data = base64.b64decode(clean[:len(clean) // 4 * 4])
+        elif encoding == "quoted-printable":
+            data = quopri.decodestring(re.sub(rb"=[0-9A-Fa-f]?$", b"", data))
+    except Exception:
+        pass
+    try:
+        text = data.decode(charset, errors="ignore")
+    except LookupError:
+        text = data.decode("utf-8", errors="ignore")
+    if subtype == "html":
+        text = html_to_text(text)
+    return text
+
+def _fetched_section(data: dict, section: str) -> bytes:
+    """按 section 取 FETCH 结果（响应键形如 BODY[1.2]<0> 或 BODY[HEADER.FIELDS (...)]）"""
+    for k, v in data.items():
+        if isinstance(k, bytes) and k.startswith(b"BODY[") \
+                and k[5:].split(b"]")[0].split(b" ")[0].upper() == section.upper().encode():
+            return v or b""
+    return b""
+
+def fetch_messages(server: IMAPClient, uids):
+    """两阶段抓取：① BODYSTRUCTURE + 少量头字段 ② 按 section 分组，只取正文部分前 IMAP_BODY_BYTES 字节。
+    只取字节不解码（解码在解析线程做）。返回 {uid: (原始头字节, (正文字节, 编码, 字符集, 子类型) 或 None, INTERNALDATE)}"""
+    meta = server.fetch(uids, [b'BODYSTRUCTURE', b'RFC822.SIZE', b'INTERNALDATE', HEADER_FIELDS])
+    headers, plans, groups = {}, {}, {}
+    fetched = full = 0
+    for uid in uids:
+        data = meta.get(uid, {})
+        headers[uid] = _fetched_section(data, "HEADER.FIELDS")
+        fetched += len(headers[uid])
+        full += data.get(b'RFC822.SIZE') or 0
+        bs = data.get(b'BODYSTRUCTURE')
+        plan = pick_text_part(bs) if bs is not None else None
+        plans[uid] = plan
+        if plan:
+            groups.setdefault(plan[0], []).append(uid)
+
+    bodies = {}
+    for section, group in groups.items():
+        resp = server.fetch(group, [f"BODY.PEEK[{section}]<0.{IMAP_BODY_BYTES}>".encode()])
+        for uid in group:
+            raw = _fetched_section(resp.get(uid, {}), section)
+            fetched += len(raw)
+            _, subtype, enc, charset = plans[uid]
+            bodies[uid] = (raw, enc, charset, subtype)
+
+    # 节省的流量 = full_bytes_total - fetched_bytes_total（抓取耗时见 stage_seconds{stage="fetch"}）
+    metrics.inc("messages_total", len(uids), proto="imap")
+    metrics.inc("fetched_bytes_total", fetched, proto="imap")
+    metrics.inc("full_bytes_total", full, proto="imap")
+    return {uid: (headers[uid], bodies.get(uid), meta.get(uid, {}).get(b'INTERNALDATE')) for uid in uids}
+
+def handle_messages(server: IMAPClient, uids, seen_uids, folder=IMAP_FOLDER, state=None):
+    """state（FolderState）不为空时先登记在途 UID，解析线程处理完再放行水位（见 FolderState.save）"""
+    uids = sorted(u for u in uids if u not in seen_uids)
     if not uids:
         return
-    fetch_map = server.fetch(uids, [b'RFC822.HEADER', b'BODY.PEEK[TEXT]', b'ENVELOPE'])
-    for uid in uids:
-        if uid in seen_uids:
-            continue
-        data = fetch_map.get(uid, {})
-        raw_header = data.get(b'RFC822.HEADER') or b""
-        raw_text   = data.get(b'BODY[TEXT]') or b""
-        raw_bytes  = raw_header + b"\r\n" + raw_text
+    with metrics.timer("fetch", proto="imap"):
+        fetched = fetch_messages(server, uids)
+    # 交给解析线程后立即回到 IDLE；队列满时在这里阻塞（背压）
+    pool = pipeline.get_pool()
+    for uid, item in fetched.items():
+        if state is not None:
+            state.begin(uid)
+        pool.submit(MAIL_USER, process_fetched, uid, *item, seen_uids, folder, state)
+
+def find_codes(subject, from_, part):
+    """已知发件人先用专用规则（code_rules.py），没命中再走通用识别（主题里有就不再解码正文）；
+    part 为 (正文字节, 编码, 字符集, 子类型) 或 None。离线回放（replay_mail.py）走同一条路径"""
+    rule = code_rules.lookup(from_)
+    code = rule.extract(subject, lambda: decode_part(*part) if part else "") if rule else None
+    codes = [code] if code else extract_codes(subject)
+    if not codes and part:
+        codes = extract_codes(decode_part(*part))
+    return codes
+
+def process_fetched(uid, raw_header, part, internal, seen_uids, folder=IMAP_FOLDER, state=None):
+    try:
+        _process_fetched(uid, raw_header, part, internal, seen_uids, folder)
+    finally:
+        if state is not None:
+            state.done(uid)
+
+def _process_fetched(uid, raw_header, part, internal, seen_uids, folder):
+    """解析线程：识别验证码（主题里有就不再解码正文）、入发送队列，处理完才记入去重库。
+    同一账号的各文件夹在同一个解析线程里按顺序处理，Message-ID 已推送过（如从垃圾箱移回收件箱）就不再推送"""
+    with metrics.timer("parse", proto="imap"):
+        hdr = BytesHeaderParser().parsebytes(raw_header)
+        subject, from_, to_, dt = _header_fields(hdr)
+    message_id = (hdr.get("Message-ID") or "").strip()
+    if message_id and seen_uids.has_message_id(message_id):
+        first_seen.saw(MAIL_USER, message_id, "imap")
+        seen_uids.add(uid, message_id)
+        return
+    with metrics.timer("extract", proto="imap"):
+        codes = find_codes(subject, from_, part)
+
+    # 两条消息
+    on_done = None
+    if not codes and first_seen.enabled():
+        seen_uids.add(uid, message_id)   # 混合模式：不发"未识别到验证码"，POP3 的识别规则不同，可能识别得到
+        return
+    if codes and not first_seen.claim(MAIL_USER, first_seen.message_key(hdr), "imap"):
+        seen_uids.add(uid, message_id)   # 混合模式：POP3 已先推送这封
+        return
+    if codes:
+        metrics.inc("codes_total", proto="imap")
+        arrived = internal.timestamp() if isinstance(internal, datetime) else None
+        entry = code_cache.record(MAIL_USER, from_, codes[0], arrived)
+
+        def on_done(ok):
+            if ok:
+                metrics.observe_e2e(arrived, proto="imap", folder=folder)
+                code_cache.get_cache().delivered(entry)
+    where = f"  [{folder}]" if folder != IMAP_FOLDER else ""
+    send_tg(f"{fmt_dt(dt)}    {from_}  →  {to_}{where}", codes[0] if codes else "未识别到验证码", on_done=on_done, hdr=hdr)
+
+    seen_uids.add(uid, message_id)
+
+class FolderState:
+    """跟踪一个文件夹的 UIDVALIDITY / 已处理最大 UID / HIGHESTMODSEQ（持久化在去重库里）。
+    新信只查 `UID last+1:*`，不再每次 SEARCH ALL 拉全量 UID 列表。
+    跨重连保留（在途 UID 不会因重连被重复抓取）；last_uid 是已抓取的最大 UID，存盘时不超过在途的最小 UID"""
 
-        subject, from_, to_, dt, body = parse_email(raw_bytes)
-        codes = extract_codes(subject) or extract_codes(body)
+    def __init__(self, store, account, folder):
+        self.store, self.account, self.folder = store, account, folder
+        st = store.get_state(account, folder) or {}
+        self.uidvalidity = st.get("uidvalidity")
+        self.last_uid = st.get("last_uid") or 0
+        self.modseq = st.get("modseq")
+        self.pending = set()                 # 已交给解析线程、还没处理完的 UID
+        self._lock = threading.Lock()
 
-        # 两条消息
-        send_tg(f"{fmt_dt(dt)}    {from_}  →  {to_}")
-        send_tg(codes[0] if codes else "未识别到验证码")
+    def on_select(self, server: IMAPClient, info: dict):
+        """SELECT 之后调用：返回需要补处理的 UID（UIDVALIDITY 变了或首次启动时只补扫最近 N 封）"""
+        uidvalidity = str(info.get(b'UIDVALIDITY', ""))
+        uidnext = info.get(b'UIDNEXT')
+        exists = info.get(b'EXISTS') or 0
+        modseq = info.get(b'HIGHESTMODSEQ')
+        # 只按 UIDVALIDITY 判断首次/重建：空文件夹的 last_uid 本来就是 0，不能当成首次启动，否则第一封新信会被跳过
+        if uidvalidity != self.uidvalidity:
+            self.uidvalidity, self.last_uid, self.modseq = uidvalidity, 0, modseq
+            uids = []
+            if FETCH_STARTUP_LAST_N > 0 and exists:
+                # 按序号取最后 N 封的 UID（UID SEARCH <序号区间>），不必列出整个文件夹
+                uids = server.search([f"{max(1, exists - FETCH_STARTUP_LAST_N + 1)}:{exists}"])
+            self.last_uid = max([(uidnext or 1) - 1] + list(uids))
+            self.save()
+            return sorted(uids)
+        if modseq is not None and modseq == self.modseq:
+            return []                                  # CONDSTORE：文件夹自上次以来没有任何变化
+        if uidnext is not None and uidnext - 1 <= self.last_uid:
+            self.modseq = modseq
+            return []                                  # 没有比 last_uid 更新的邮件
+        new = self.fetch_new(server)
+        self.modseq = modseq
+        return new
 
-        seen_uids.add(uid)
-    save_seen(seen_uids)
+    def fetch_new(self, server: IMAPClient):
+        # "UID n:*" 在没有新信时也会返回当前最大 UID，需再按 last_uid 过滤
+        return sorted(u for u in server.search(['UID', f"{self.last_uid + 1}:*"]) if u > self.last_uid)
+
+    def advance(self, uids, modseq=None):
+        if uids:
+            self.last_uid = max(self.last_uid, max(uids))
+        if modseq is not None:
+            self.modseq = modseq
+        self.save()
+
+    def begin(self, uid):
+        with self._lock:
+            self.pending.add(uid)
+
+    def done(self, uid):
+        """解析线程处理完（已入发送队列、记入去重库）后调用"""
+        with self._lock:
+            self.pending.discard(uid)
+        self.save()
+
+    def save(self):
+        """有在途邮件时只存到在途最小 UID 之前、不存 HIGHESTMODSEQ：进程被杀或排空超时后重启，
+        on_select 的 UIDNEXT / MODSEQ 快捷判断不会跳过它们，会按 `UID last+1:*` 重新抓取（已处理的由去重库拦住）"""
+        with self._lock:
+            last_uid = min([self.last_uid] + [u - 1 for u in self.pending])
+            modseq = None if self.pending else self.modseq
+            self.store.set_state(self.account, self.folder, self.uidvalidity, last_uid, modseq)
+
+class RawIMAP:
+    """imapclient 没有公开的几处底层操作都只在这里访问私有属性（imapclient 3.x–4.x，在 4.1.0 上验证过；
+    requirements.txt 限定 <5）：IMAPClient._imap 是底层的 imaplib.IMAP4，_normalise_folder() 按 folder_encode
+    编码文件夹名并加引号。升级 imapclient 大版本前先核对这个类"""
+    def __init__(self, server: IMAPClient):
+        self.server, self.imap = server, server._imap
+
+    def take_untagged(self, name):
+        """取走 imaplib 暂存的某类未标记响应（命令执行期间服务器顺带发来的）"""
+        return self.imap.untagged_responses.pop(name, None)
+
+    def command(self, name, args):
+        """发一条 imapclient 不支持的命令（NOTIFY），返回 (typ, data)"""
+        return self.imap._simple_command(name, args)
+
+    def folder(self, name) -> bytes:
+        return self.server._normalise_folder(name)
+
+    @property
+    def sock(self):
+        return self.imap.sock
+
+def _has_new_mail(responses) -> bool:
+    """IDLE/NOOP 返回的未标记响应里有 EXISTS/RECENT 即表示有新信"""
+    for r in responses or []:
+        if len(r) >= 2 and isinstance(r[0], int) and r[1] in (b'EXISTS', b'RECENT'):
+            return True
+    return False
+
+def _take_pending_exists(server: IMAPClient) -> bool:
+    """命令（UID SEARCH / FETCH）执行期间服务器顺带发来的 EXISTS 会被 imaplib 暂存在 untagged_responses 里，
+    IDLE 收不到它；进入 IDLE 前取走，有就先查一次，否则这封信要等下一封新信或定期兜底才会被发现"""
+    return bool(RawIMAP(server).take_untagged("EXISTS"))
+
+def enable_condstore(server: IMAPClient):
+    """服务器支持时启用 QRESYNC/CONDSTORE，SELECT 响应才会带 HIGHESTMODSEQ"""
+    for cap in (b'QRESYNC', b'CONDSTORE'):
+        if server.has_capability(cap.decode()):
+            try:
+                server.enable(cap)
+                return cap
+            except Exception:
+                continue
+    return None
 
 def connect_imap() -> IMAPClient:
-    ssl_ctx = ssl.create_default_context()
-    ssl_ctx.check_hostname = True
+    """993/SSL 与 143/STARTTLS 竞速（见 fast_connect.py）：记住上次成功的方式、复用 TLS 会话，登录只做一次"""
+    ssl_ctx = fast_connect.tls_context(IMAP_HOST)
     ssl_ctx.minimum_version = ssl.TLSVersion.TLSv1_2
-    # 优先 993/SSL
+
+    def via_ssl():
+        return IMAPClient(IMAP_HOST, port=IMAP_PORT_SSL, ssl=True, ssl_context=ssl_ctx, timeout=20), True
+
+    def via_starttls():
+        c = IMAPClient(IMAP_HOST, port=IMAP_PORT_STARTTLS, ssl=False, timeout=20)
+        try:
+            c.starttls(ssl_context=ssl_ctx)
+            return c, True
+        except Exception:
+            c.shutdown()
+            if not IMAP_PLAIN_FALLBACK:
+                raise
+            # STARTTLS 失败后连接状态不确定，重新建一个明文连接
+            return IMAPClient(IMAP_HOST, port=IMAP_PORT_STARTTLS, ssl=False, timeout=20), False
+
+    _, c, secure = fast_connect.race(IMAP_HOST, [(f"{IMAP_PORT_SSL}/SSL", via_ssl), (f"{IMAP_PORT_STARTTLS}/STARTTLS", via_starttls)],
+                                     close=lambda c: c.shutdown())
     try:
-        c = IMAPClient(IMAP_HOST, port=IMAP_PORT_SSL, ssl=True, ssl_context=ssl_ctx, timeout=20)
         c.login(MAIL_USER, MAIL_PASS)
-        return c
     except Exception:
-        # 回退 143/STARTTLS
-        c = IMAPClient(IMAP_HOST, port=IMAP_PORT_STARTTLS, ssl=False, timeout=20)
-        c.starttls(ssl_context=ssl_ctx)
-        c.login(MAIL_USER, MAIL_PASS)
-        return c
+        fast_connect.forget(IMAP_HOST)
+        c.shutdown()
+        raise
+    if secure:
+        fast_connect.remember_session(IMAP_HOST, RawIMAP(c).sock)
+    return c
 
-def idle_loop():
-    seen_uids = load_seen()
-    while True:
-        try:
-            with connect_imap() as server:
-                server.select_folder(IMAP_FOLDER, readonly=True)
+def resolve_folders(server: IMAPClient, names):
+    """把 \\Junk 这类特殊用途标记换成服务器上的实际文件夹名（SPECIAL-USE 标记，或 Junk/Spam 等常见名字）"""
+    out = []
+    for name in names:
+        if name.startswith("\\"):
+            found = server.find_special_folder(name.encode())
+            if not found:
+                print(f"[IMAP] 没找到 {name} 文件夹，跳过")
+                continue
+            name = found
+        if name not in out:
+            out.append(name)
+    return out or [IMAP_FOLDER]
+
+def enable_notify(server: IMAPClient, folders) -> bool:
+    """RFC 5465 NOTIFY：同一条连接上接收所有文件夹的新信事件（非当前文件夹以 STATUS 响应推送）"""
+    imaplib.Commands.setdefault("NOTIFY", ("AUTH", "SELECTED"))
+    raw = RawIMAP(server)
+    boxes = b" ".join(raw.folder(f) for f in folders)
+    try:
+        typ, _ = raw.command(
+            "NOTIFY", b"SET (selected (MessageNew MessageExpunge)) (mailboxes (" + boxes + b") (MessageNew MessageExpunge))")
+    except Exception as e:
+        print("[IMAP] NOTIFY 失败，改为轮询其他文件夹：", e)
+        return False
+    return typ == "OK"
 
-                # 启动仅补扫最近 N 封
-                all_uids = server.search(['ALL'])
-                bootstrap = sorted(all_uids)[-FETCH_STARTUP_LAST_N:] if FETCH_STARTUP_LAST_N > 0 else []
-                handle_messages(server, bootstrap, seen_uids)
+def _status_folder(server: IMAPClient, raw) -> str:
+    name = parse_response([raw])[0] if isinstance(raw, bytes) else raw
+    if isinstance(name, bytes):
+        name = imap_utf7.decode(name) if server.folder_encode else name.decode("utf-8", "ignore")
+    return str(name)
 
-                while True:
-                    # 进入 IDLE 等待推送；每 ~25s 发一次 keepalive
-                    server.idle()
-                    server.idle_check(timeout=IDLE_KEEPALIVE_SECONDS)
-                    server.idle_done()
+def _notified_folders(server: IMAPClient, responses):
+    """IDLE 期间收到的 STATUS 推送（NOTIFY），以及命令执行期间被 imaplib 暂存的 STATUS 响应 → 文件夹名"""
+    out = {_status_folder(server, r[1]) for r in responses or [] if len(r) >= 2 and r[0] == b'STATUS'}
+    out.update(_status_folder(server, raw) for raw in RawIMAP(server).take_untagged("STATUS") or [])
+    return out
+
+def _changed_by_status(server: IMAPClient, folders, views):
+    """不支持 NOTIFY 时用 STATUS 查非当前文件夹：UIDNEXT 超过已处理的 UID（或 UIDVALIDITY 变了）才需要切过去"""
+    out = set()
+    for f in folders:
+        st = server.folder_status(f, [b'UIDNEXT', b'UIDVALIDITY'])
+        state = views[f][0]
+        if str(st.get(b'UIDVALIDITY', "")) != state.uidvalidity or (st.get(b'UIDNEXT') or 1) - 1 > state.last_uid:
+            out.add(f)
+    return out
 
-                    latest = sorted(server.search(['ALL']))[-20:]
-                    fresh = [u for u in latest if u not in seen_uids]
+def sync_folder(server: IMAPClient, store, folder, views):
+    """SELECT（只读）该文件夹，处理 last_uid 之后的新信（首次只补扫最近 N 封）；views 记录 文件夹 → (FolderState, SeenSet)"""
+    info = server.select_folder(folder, readonly=True)
+    _take_pending_exists(server)               # SELECT 响应里的 EXISTS 已由 on_select 处理
+    seen_uids = store.view(MAIL_USER, folder, info.get(b'UIDVALIDITY', ""))
+    if folder == IMAP_FOLDER and os.path.exists(LEGACY_SEEN_JSON):
+        n = store.import_json(LEGACY_SEEN_JSON, seen_uids)
+        print(f"已迁移旧去重记录 {n} 条：{LEGACY_SEEN_JSON} → {DEDUP_DB_PATH}")
+    state = views[folder][0] if folder in views else FolderState(store, MAIL_USER, folder)
+    views[folder] = (state, seen_uids)
+    with metrics.timer("poll", proto="imap", folder=folder):
+        new = state.on_select(server, info)
+    handle_messages(server, new[-MAX_BATCH:], seen_uids, folder, state)
+    state.advance(new)
+
+def watch_folders(store, folders, use_notify=False):
+    """一条连接监视若干文件夹：在第一个文件夹上 IDLE；其余文件夹靠 NOTIFY 推送（use_notify），
+    否则每次 IDLE 醒来（最长 IDLE_KEEPALIVE_SECONDS 秒）用 STATUS 查一次，有新信才临时切过去抓取"""
+    primary, others = folders[0], folders[1:]
+    connects = 0
+    views = {}                                   # 跨重连保留 FolderState（在途 UID）
+    while not pipeline.stopping():
+        try:
+            with metrics.timer("connect", proto="imap"):
+                server = connect_imap()
+            if connects:
+                metrics.inc("reconnects_total", proto="imap")
+            connects += 1
+            with server:
+                enable_condstore(server)
+                # 首次启动仅补扫最近 N 封；重连后只补 last_uid 之后的新信；最后停在主文件夹上
+                for f in others + [primary]:
+                    sync_folder(server, store, f, views)
+                notify = bool(others) and use_notify and enable_notify(server, folders)
+                state, seen_uids = views[primary]
+
+                cycles = 0
+                while True:
+                    dirty = {primary} if _take_pending_exists(server) else set()
+                    responses, resync = [], False
+                    if not dirty:
+                        # 进入 IDLE 等待推送；每 ~25s 发一次 keepalive
+                        server.idle()
+                        responses = server.idle_check(timeout=IDLE_KEEPALIVE_SECONDS)
+                        _, more = server.idle_done()
+                        responses = responses + list(more or [])
+                        cycles += 1
+                        resync = cycles % IDLE_RESYNC_EVERY == 0
+                        # 只有收到 EXISTS（或定期兜底）才查询；keepalive 超时不再发任何命令
+                        if _has_new_mail(responses) or resync:
+                            dirty.add(primary)
+                    if others:
+                        dirty |= _notified_folders(server, responses) & set(folders)
+                        if resync and notify:
+                            dirty.update(others)
+                        elif not notify:
+                            dirty |= _changed_by_status(server, others, views)
+                    if not dirty:
+                        continue
+                    away = [f for f in others if f in dirty]
+                    for f in away:
+                        sync_folder(server, store, f, views)
+                    if away:
+                        # 切回主文件夹（顺带处理切走期间到达的新信）
+                        sync_folder(server, store, primary, views)
+                        state, seen_uids = views[primary]
+                        continue
+                    with metrics.timer("poll", proto="imap", folder=primary):
+                        new = state.fetch_new(server)
+                    fresh = [u for u in new[-MAX_BATCH:] if u not in seen_uids]
                     if fresh:
-                        handle_messages(server, fresh, seen_uids)
+                        handle_messages(server, fresh, seen_uids, primary, state)
+                    state.advance(new)
 
         except (socket.timeout, ssl.SSLError, ConnectionError):
             time.sleep(1.5)
-        except KeyboardInterrupt:
-            break
         except Exception:
             time.sleep(2.5)
 
+def plan_watchers():
+    """先登录一次：解析文件夹名、判断是否支持 NOTIFY；返回每条 IDLE 连接负责的文件夹列表，以及是否用 NOTIFY"""
+    while True:
+        try:
+            with connect_imap() as server:
+                folders = resolve_folders(server, IMAP_FOLDERS)
+                notify = IMAP_NOTIFY and len(folders) > 1 and server.has_capability("NOTIFY")
+            break
+        except Exception as e:
+            print("[IMAP] 连接失败，稍后重试：", e)
+            time.sleep(2.5)
+    if notify:
+        groups = [folders]
+    else:
+        n = max(1, min(len(folders), IMAP_MAX_CONNECTIONS))
+        groups = [folders[i::n] for i in range(n)]
+    print(f"[IMAP] 监视 {', '.join(folders)}：" + ("NOTIFY，1 条连接" if notify else f"IDLE，{len(groups)} 条连接"))
+    return groups, notify
+
+def start_watchers(store):
+    """为每组文件夹起一个 IDLE 线程（混合模式 hybrid_forwarder.py 也从这里启动 IMAP 一路）"""
+    groups, notify = plan_watchers()
+    for i, folders in enumerate(groups):
+        threading.Thread(target=watch_folders, args=(store, folders, notify), name=f"imap-{i}", daemon=True).start()
+
+def idle_loop():
+    metrics.start()
+    local_http.start()
+    pipeline.install_signal_handlers()
+    store = open_store(DEDUP_DB_PATH)
+    try:
+        start_watchers(store)
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pipeline.shutdown()
+
 if __name__ == "__main__":
     idle_loop()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地 HTTP 接口（POP3 / IMAP / 混合脚本共用一个服务器）：
+各模块导入时用 route() 登记自己的路径，转发脚本启动时调用一次 start()
+- GET  /metrics                   Prometheus 文本（metrics.py）
+- POST /expect、GET /status       触发"等验证码"、各账号轮询节奏（poll_scheduler.py，只有 POP3 / 混合模式）
+- GET  /codes、GET /codes/wait    最近验证码、长轮询等待（code_cache.py）
+
+可选环境变量：
+LOCAL_PORT=9108              # 监听端口，上面所有接口都在这一个端口上；不设则不监听
+LOCAL_BIND=127.0.0.1
+旧配置 METRICS_PORT / EXPECT_PORT / CODES_PORT（及对应的 *_BIND）仍然有效：设置了的端口也会监听，
+每个端口上都能访问全部接口，同一个端口只监听一次
+"""
+import os, json, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+PORT_VARS = (("LOCAL_PORT", "LOCAL_BIND"), ("METRICS_PORT", "METRICS_BIND"),
+             ("EXPECT_PORT", "EXPECT_BIND"), ("CODES_PORT", "CODES_BIND"))
+TEXT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_routes = {}        # (方法, 路径) → fn(查询参数) → (状态码, 内容)
+_lock = threading.Lock()
+_started = False
+
+def route(method, path, fn):
+    """登记一个接口：fn 收到 {参数名: 第一个值}，返回 (状态码, 内容)；
+    内容为 None 时没有正文，str 按纯文本返回，其他按 JSON 返回；fn 抛 ValueError 时返回 400"""
+    _routes[(method, path)] = fn
+
+def configured():
+    """[(地址, 端口)]：设置了的端口（去重）"""
+    out = []
+    for port_var, bind_var in PORT_VARS:
+        port = int(os.getenv(port_var, "0") or 0)
+        addr = (os.getenv(bind_var) or os.getenv("LOCAL_BIND") or "127.0.0.1", port)
+        if port and addr not in out:
+            out.append(addr)
+    return out
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *a):
+        pass
+
+    def _reply(self, code, obj=None):
+        if obj is None:
+            body, ctype = b"", "application/json; charset=utf-8"
+        elif isinstance(obj, str):
+            body, ctype = obj.encode("utf-8"), TEXT_TYPE
+        else:
+            body, ctype = json.dumps(obj, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8"
+        self.send_response(code)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        fn = _routes.get((method, url.path))
+        if fn is None:
+            self.send_error(404)
+            return
+        try:
+            code, obj = fn({k: v[0] for k, v in parse_qs(url.query).items()})
+        except ValueError:
+            code, obj = 400, {"error": "参数格式不对"}
+        self._reply(code, obj)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+def start():
+    """按环境变量监听（在 .env 加载之后调用）；重复调用无副作用"""
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    for bind, port in configured():
+        try:
+            srv = ThreadingHTTPServer((bind, port), _Handler)
+        except OSError as e:
+            print(f"[本地接口] 端口 {port} 不可用（多个进程要各用各的端口）：", e)
+            continue
+        srv.daemon_threads = True
+        threading.Thread(target=srv.serve_forever, name=f"local-http-{port}", daemon=True).start()
+        paths = " ".join(f"{m} {p}" for m, p in sorted(_routes, key=lambda r: r[1]))
+        print(f"[本地接口] http://{srv.server_address[0]}:{srv.server_address[1]}  {paths}")
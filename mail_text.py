@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+正文按需解码（POP3 / IMAP 两个转发脚本共用）：
+- iter_body_text：按块产出正文文本，选段规则与原 body_text 相同（第一个非附件 text/plain，没有再取 text/html）；
+  字符集增量解码，调用方拿到验证码后不再继续迭代，剩余部分不会被解码
+- HtmlToText：流式版 re.sub(r"\\s+", " ", re.sub(r"<[^>]+>", " ", unescape(h)))，逐块喂入，
+  拼起来与整篇一次处理的结果一致（被块边界切断的实体、未闭合的标签会留到下一块再处理）
+"""
+import re, codecs
+from html import unescape
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_WS_RE = re.compile(r"\s+")
+_ENTITY_TAIL_RE = re.compile(r"&[^\t\n\f <&]*\Z")    # 末尾可能还没写完的字符引用
+_ENTITY_TAIL_MAX = 64                                  # 超过这个长度的"实体"不再等待后续内容
+CHUNK_BYTES = 16384
+
+class HtmlToText:
+    def __init__(self):
+        self.raw = ""       # 尚未 unescape 的尾巴
+        self.text = ""      # 已 unescape、含未闭合 '<' 的尾巴
+        self.space = False  # 上一段输出是否以空格结尾（跨块合并连续空白）
+
+    def feed(self, s, final=False):
+        s = self.raw + s
+        self.raw = ""
+        if not final:
+            m = _ENTITY_TAIL_RE.search(s)
+            if m and len(s) - m.start() <= _ENTITY_TAIL_MAX:
+                s, self.raw = s[:m.start()], s[m.start():]
+        t = self.text + unescape(s)
+        self.text = ""
+        if not final:
+            # 最后一个 '>' 之后的第一个 '<' 起算未闭合：后面若出现 '>'，整段都会被当作标签
+            i = t.find("<", t.rfind(">") + 1)
+            if i != -1:
+                t, self.text = t[:i], t[i:]
+        t = _WS_RE.sub(" ", _TAG_RE.sub(" ", t))
+        if self.space and t.startswith(" "):
+            t = t[1:]
+        if t:
+            self.space = t.endswith(" ")
+        return t
+
+def html_to_text(h):
+    return HtmlToText().feed(h, final=True)
+
+def _decoder(part):
+    """(字节, 增量解码器)；取不到载荷或字符集未知时返回 None，与原实现一样跳过该部分"""
+    try:
+        data = part.get_payload(decode=True)
+        dec = codecs.getincrementaldecoder(part.get_content_charset() or "utf-8")("ignore")
+        if not isinstance(data, bytes):
+            return None
+        return data, dec
+    except Exception:
+        return None
+
+def _chunks(data, dec, budget):
+    """增量解码；budget 为 None 时不限字符数"""
+    for i in range(0, len(data), CHUNK_BYTES):
+        s = dec.decode(data[i:i + CHUNK_BYTES], final=i + CHUNK_BYTES >= len(data))
+        if budget is not None:
+            s = s[:budget]
+            budget -= len(s)
+        if s:
+            yield s
+        if budget is not None and budget <= 0:
+            return
+
+def iter_body_text(msg, max_chars=0):
+    """按块产出正文；max_chars>0 时最多解码这么多字符（超大营销邮件只看开头）"""
+    budget = max_chars if max_chars > 0 else None
+    if not msg.is_multipart():
+        got = _decoder(msg)
+        if got:
+            yield from _chunks(*got, budget)
+        return
+    for p in msg.walk():
+        if p.get_content_type() == "text/plain" and "attachment" not in str(p.get("Content-Disposition") or ""):
+            got = _decoder(p)
+            if got:
+                yield from _chunks(*got, budget)
+                return
+    for p in msg.walk():
+        if p.get_content_type() == "text/html":
+            got = _decoder(p)
+            if got:
+                conv = HtmlToText()
+                for s in _chunks(*got, budget):
+                    s = conv.feed(s)
+                    if s:
+                        yield s
+                s = conv.feed("", final=True)
+                if s:
+                    yield s
+                return
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行指标（POP3 / IMAP 两个转发脚本共用）：
+- 分阶段耗时直方图：connect / poll（UIDL、UID SEARCH）/ fetch（TOP、RETR、FETCH）/ parse / extract / send
+- 端到端延迟：邮件到达服务器（POP3 取顶层 Received，IMAP 取 INTERNALDATE）→ Telegram 发送成功
+- 计数：重连、429、推送成功/失败、处理邮件数、识别到验证码数、下载字节数、轮询次数
+- 当前值：各账号的轮询间隔（poll_scheduler.py）
+- 混合模式：各来源胜出次数、领先时间（first_seen.py）
+- 按收件地址路由：各路由的发送耗时、成功/失败次数（routing.py）
+- 输出：本地 HTTP 接口上的 Prometheus 文本（GET /metrics，见 local_http.py），以及定期一行日志摘要
+
+可选环境变量（都不设置时指标关闭，埋点只剩一次布尔判断）：
+LOCAL_PORT=9108              # 本地 HTTP 端口（见 local_http.py）；不设则不监听
+METRICS_LOG_EVERY=300        # 日志摘要间隔（秒）；0=不输出
+"""
+import os, time, threading
+from bisect import bisect_left
+import local_http
+
+PREFIX = "mail2tg_"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+E2E_BUCKETS = (1, 2, 3, 5, 10, 15, 30, 60, 120, 300, 600, 1800)
+_BUCKETS_BY_NAME = {"e2e_latency_seconds": E2E_BUCKETS}
+HELP = {
+    "stage_seconds": "各处理阶段耗时",
+    "e2e_latency_seconds": "邮件到达服务器到 Telegram 发送成功的延迟",
+    "reconnects_total": "重连次数",
+    "messages_total": "处理的邮件数",
+    "codes_total": "识别到验证码的邮件数",
+    "fetched_bytes_total": "从邮件服务器下载的字节数",
+    "full_bytes_total": "按整封下载时需要的字节数（IMAP 取 RFC822.SIZE），与 fetched_bytes_total 之差即节省的流量",
+    "telegram_sent_total": "Telegram 发送成功条数",
+    "telegram_failed_total": "Telegram 放弃重试的条数",
+    "telegram_429_total": "Telegram 返回 429 的次数",
+    "backpressure_total": "队列已满、提交方被阻塞的次数",
+    "polls_total": "轮询次数（POP3 UIDL/STAT）",
+    "poll_interval_seconds": "当前轮询间隔",
+    "hybrid_wins_total": "混合模式下各来源先识别到并负责推送的邮件数",
+    "hybrid_dropped_total": "混合模式下另一路已推送、本路丢弃的邮件数",
+    "hybrid_lead_seconds": "混合模式下胜出来源比另一路早看到同一封邮件的时间",
+    "route_delivery_seconds": "按路由统计的入队到 Telegram 发送结束的耗时",
+    "route_sent_total": "按路由统计的发送成功次数",
+    "route_failed_total": "按路由统计的放弃重试次数",
+}
+
+ENABLED = False
+_lock = threading.Lock()
+_hists = {}        # (名称, 标签元组) → Histogram
+_counters = {}     # (名称, 标签元组) → 数值
+_gauges = {}       # (名称, 标签元组) → 当前值
+_started = False
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # 最后一格是 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, v):
+        self.counts[bisect_left(self.buckets, v)] += 1
+        self.sum += v
+        self.count += 1
+        if v > self.max:
+            self.max = v
+
+    def quantile(self, q):
+        """按桶上界估算分位数（落在 +Inf 桶时返回最大值）"""
+        if not self.count:
+            return 0.0
+        rank, acc = q * self.count, 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= rank:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def observe(name, value, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        h = _hists.get(key)
+        if h is None:
+            h = _hists[key] = Histogram(_BUCKETS_BY_NAME.get(name, BUCKETS))
+        h.observe(max(0.0, value))
+
+def inc(name, n=1, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+def gauge(name, value, **labels):
+    if not ENABLED:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+class _Timer:
+    __slots__ = ("stage", "labels", "t0")
+
+    def __init__(self, stage, labels):
+        self.stage, self.labels = stage, labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe("stage_seconds", time.perf_counter() - self.t0, stage=self.stage, **self.labels)
+        return False
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_TIMER = _NoTimer()
+
+def timer(stage, **labels):
+    """with metrics.timer("fetch", proto="pop3"): ...；指标关闭时返回共享的空计时器"""
+    return _Timer(stage, labels) if ENABLED else _NO_TIMER
+
+def observe_e2e(arrived_ts, **labels):
+    """arrived_ts：邮件到达服务器的 Unix 时间戳（None 时不记录）"""
+    if ENABLED and arrived_ts:
+        observe("e2e_latency_seconds", time.time() - arrived_ts, **labels)
+
+def _fmt_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in items) + "}"
+
+def render():
+    """Prometheus 文本格式（0.0.4）"""
+    with _lock:
+        hists = {k: (list(h.counts), h.sum, h.count, h.buckets) for k, h in _hists.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+    out, typed = [], set()
+    for (name, labels), (counts, total, count, buckets) in sorted(hists.items()):
+        full = PREFIX + name
+        if full not in typed:
+            typed.add(full)
+            out.append(f"# HELP {full} {HELP.get(name, name)}")
+            out.append(f"# TYPE {full} histogram")
+        acc = 0
+        for le, c in zip(list(buckets) + ["+Inf"], counts):
+            acc += c
+            out.append(f"{full}_bucket{_fmt_labels(labels, [('le', le)])} {acc}")
+        out.append(f"{full}_sum{_fmt_labels(labels)} {total:.6f}")
+        out.append(f"{full}_count{_fmt_labels(labels)} {count}")
+    for (name, labels), v in sorted(counters.items()):
+        full = PREFIX + name
+        if full not in typed:
+            typed.add(full)
+            out.append(f"# HELP {full} {HELP.get(name, name)}")
+            out.append(f"# TYPE {full} counter")
+        out.append(f"{full}{_fmt_labels(labels)} {v}")
+    for (name, labels), v in sorted(gauges.items()):
+        full = PREFIX + name
+        if full not in typed:
+            typed.add(full)
+            out.append(f"# HELP {full} {HELP.get(name, name)}")
+            out.append(f"# TYPE {full} gauge")
+        out.append(f"{full}{_fmt_labels(labels)} {v:g}")
+    return "\n".join(out) + "\n"
+
+def summary():
+    """一行日志摘要：各阶段 p50/p95，端到端 p50/p95/最大，以及各计数"""
+    parts = []
+    with _lock:
+        for (name, labels), h in sorted(_hists.items()):
+            tag = "/".join(str(v) for _, v in labels) or name
+            if name == "e2e_latency_seconds":
+                parts.append(f"端到端[{tag}] p50={h.quantile(0.5):.1f}s p95={h.quantile(0.95):.1f}s max={h.max:.1f}s n={h.count}")
+            else:
+                parts.append(f"{tag} p50={1000*h.quantile(0.5):.0f}ms p95={1000*h.quantile(0.95):.0f}ms n={h.count}")
+        for (name, labels), v in sorted(_counters.items()):
+            tag = "/".join(str(v) for _, v in labels)
+            parts.append(f"{name}{'[' + tag + ']' if tag else ''}={v:g}")
+        for (name, labels), v in sorted(_gauges.items()):
+            tag = "/".join(str(v) for _, v in labels)
+            parts.append(f"{name}{'[' + tag + ']' if tag else ''}={v:g}")
+    return "；".join(parts) or "暂无数据"
+
+local_http.route("GET", "/metrics", lambda q: (200, render()))
+
+def _log_loop(every):
+    while True:
+        time.sleep(every)
+        print("[指标]", summary())
+
+def start():
+    """按环境变量启用指标（在 .env 加载之后调用）；重复调用无副作用。返回是否启用"""
+    global ENABLED, _started
+    with _lock:
+        if _started:
+            return ENABLED
+        _started = True
+    every = float(os.getenv("METRICS_LOG_EVERY", "0") or 0)
+    if not local_http.configured() and every <= 0:
+        return False
+    ENABLED = True
+    if every > 0:
+        threading.Thread(target=_log_loop, args=(every,), name="metrics-log", daemon=True).start()
+    return True
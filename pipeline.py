@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分段流水线（POP3 / IMAP 两个转发脚本共用）：
+源线程（POP3 轮询 / IMAP IDLE）只负责从服务器取字节 → 有界队列 → 解析工作线程（MIME 解析、验证码识别）
+→ 发送队列（tg_delivery.py）→ Telegram
+
+- 背压：解析队列满时 submit 阻塞，源线程随之暂停收信；发送队列满（TG_QUEUE_MAX）时解析线程同样阻塞，
+  积压不会无限占用内存
+- 保序：按 key（账号）固定分配到同一个工作线程，同一账号的邮件按到达顺序处理，不同账号并行
+- 有序退出：SIGTERM / Ctrl-C 时不再接收新任务，先把解析队列处理完，再等发送队列发完（合计最多 DRAIN_TIMEOUT 秒）
+
+可选环境变量：
+PARSE_WORKERS=2              # 解析工作线程数
+PIPELINE_QUEUE_MAX=100       # 每个工作线程的队列长度上限
+DRAIN_TIMEOUT=10             # 退出时最多等待秒数
+"""
+import os, time, queue, atexit, signal, threading, zlib
+import metrics
+import tg_delivery
+
+class PipelineClosed(RuntimeError):
+    pass
+
+class WorkerPool:
+    def __init__(self, workers=2, maxsize=100, name="parse"):
+        self.name = name
+        self.queues = [queue.Queue(maxsize) for _ in range(max(workers, 1))]
+        self.closing = False
+        for i, q in enumerate(self.queues):
+            threading.Thread(target=self._worker, args=(q,), name=f"{name}-{i}", daemon=True).start()
+
+    def submit(self, key, fn, *args):
+        """按 key 分配到固定线程；队列满时阻塞（背压）。关闭后抛 PipelineClosed，调用方不应把该邮件记为已处理"""
+        if self.closing:
+            raise PipelineClosed("流水线正在退出")
+        q = self.queues[zlib.crc32(str(key).encode()) % len(self.queues)]
+        if q.full():
+            metrics.inc("backpressure_total", stage=self.name)
+        q.put((fn, args))
+
+    def depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def _worker(self, q):
+        while True:
+            fn, args = q.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"[{self.name}] 处理失败：", e)
+            finally:
+                q.task_done()
+
+    def drain(self, timeout=None):
+        """停止接收新任务并等待已入队的处理完；返回是否在超时前处理完"""
+        self.closing = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for q in self.queues:
+            with q.all_tasks_done:
+                while q.unfinished_tasks:
+                    left = None if deadline is None else deadline - time.monotonic()
+                    if left is not None and left <= 0:
+                        return False
+                    q.all_tasks_done.wait(left)
+        return True
+
+_pool = None
+_pool_lock = threading.Lock()
+_shutdown_done = False
+
+def get_pool():
+    """进程内共用一个解析线程池（环境变量在首次调用时读取，.env 加载后才生效）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool(int(os.getenv("PARSE_WORKERS", "2")), int(os.getenv("PIPELINE_QUEUE_MAX", "100")))
+            atexit.register(shutdown)
+        return _pool
+
+def shutdown(timeout=None):
+    """有序退出：先排空解析队列，再等发送队列发完；可重复调用"""
+    global _shutdown_done
+    with _pool_lock:
+        if _shutdown_done:
+            return
+        _shutdown_done = True
+        pool = _pool
+    timeout = float(os.getenv("DRAIN_TIMEOUT", "10")) if timeout is None else timeout
+    t0 = time.monotonic()
+    left_parse = pool.depth() if pool else 0
+    parsed = pool.drain(timeout) if pool else True
+    sent = tg_delivery.flush_all(max(0.0, timeout - (time.monotonic() - t0)))
+    if left_parse or not (parsed and sent):
+        print(f"[退出] 解析队列{'已排空' if parsed else '未排空'}，发送队列{'已发完' if sent else '未发完'}"
+              f"（用时 {time.monotonic() - t0:.1f}s）")
+
+def stopping():
+    """已开始退出：收信线程应停止收新信"""
+    return _shutdown_done
+
+def install_signal_handlers():
+    """SIGTERM（docker stop / Railway 重新部署）按 Ctrl-C 处理，走同一条有序退出路径；只能在主线程调用"""
+    def _raise(signum, frame):
+        raise KeyboardInterrupt
+    try:
+        signal.signal(signal.SIGTERM, _raise)
+    except (ValueError, AttributeError):
+        pass
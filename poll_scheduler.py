@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+自适应轮询节奏（POP3 脚本用）：
+- 刚收到新信、或外部触发"等验证码"后的一段时间内按最短间隔轮询
+- 邮箱空闲时间隔按倍数退避，直到最长间隔
+- 每次等待加 ±20% 抖动，首次等待随机错开，多个账号不会在同一时刻一起轮询
+- 外部触发：本地 HTTP 接口（local_http.py，设置 LOCAL_PORT 后监听）
+    curl -X POST 'http://127.0.0.1:9108/expect?user=a@2925.com&seconds=120'   # 不带 user 表示所有账号
+    curl http://127.0.0.1:9108/status                                        # 各账号当前间隔与实际轮询频率
+  登录流程开始前调用一次，验证码邮件到达后几乎立即被发现
+
+可选环境变量：
+POLL_MIN_SECONDS=1           # 最短间隔（新信之后 / 触发之后）
+POLL_MAX_SECONDS=30          # 空闲退避的最长间隔
+POLL_BACKOFF=2               # 每次空轮询后间隔乘以该倍数
+POLL_FAST_SECONDS=60         # 收到新信后保持最短间隔的时长
+EXPECT_SECONDS=120           # 一次触发保持最短间隔的时长（请求里可用 seconds 覆盖）
+只设置了 POLL_SECONDS（旧配置）时按固定间隔轮询，与之前行为一致
+"""
+import os, time, random, threading
+import local_http
+import metrics
+
+class PollScheduler:
+    def __init__(self, key, min_s=1.0, max_s=30.0, backoff=2.0, fast_s=60.0):
+        self.key = key
+        self.min, self.max = min_s, max(max_s, min_s)
+        self.backoff, self.fast = max(backoff, 1.0), fast_s
+        self.interval = self.min
+        self.fast_until = 0.0
+        self.first = True
+        self._wake = threading.Event()
+        self.polls = 0
+        self.started = time.monotonic()
+        self._recent = []          # 最近 60 秒的轮询时间，用于计算实际频率
+
+    def expect(self, seconds):
+        """外部触发：接下来 seconds 秒按最短间隔轮询，并立即唤醒正在等待的轮询"""
+        self.fast_until = max(self.fast_until, time.monotonic() + seconds)
+        self.interval = self.min
+        self._wake.set()
+
+    def poke(self):
+        """只唤醒一次（如解析线程要求补 RETR），不改变节奏"""
+        self._wake.set()
+
+    def after_poll(self, got_new):
+        now = time.monotonic()
+        self.polls += 1
+        self._recent = [t for t in self._recent if now - t < 60] + [now]
+        if got_new:
+            self.fast_until = max(self.fast_until, now + self.fast)
+        self.interval = self.min if now < self.fast_until else min(self.max, self.interval * self.backoff)
+        metrics.inc("polls_total", proto="pop3")
+        metrics.gauge("poll_interval_seconds", self.interval, account=self.key)
+
+    def wait(self):
+        """睡到下一次轮询；被 expect()/poke() 唤醒时提前返回"""
+        delay = self.interval * random.uniform(0.8, 1.2)
+        if self.first:
+            self.first = False
+            delay = random.uniform(0, delay)
+        self._wake.wait(delay)
+        self._wake.clear()
+
+    def status(self):
+        now = time.monotonic()
+        return {"interval": round(self.interval, 2), "fast_for": round(max(0.0, self.fast_until - now), 1),
+                "polls_last_minute": sum(1 for t in self._recent if now - t < 60),
+                "polls_per_minute_avg": round(60 * self.polls / max(now - self.started, 1e-9), 2)}
+
+_lock = threading.Lock()
+_schedulers = {}
+
+def _env_float(name, default):
+    v = os.getenv(name, "").strip()
+    return float(v) if v else default
+
+def get_scheduler(key):
+    """每个账号一个；环境变量在首次调用时读取（.env 加载之后）"""
+    with _lock:
+        s = _schedulers.get(key)
+        if s is None:
+            legacy = os.getenv("POLL_SECONDS", "").strip()
+            fixed = float(legacy) if legacy and not (os.getenv("POLL_MIN_SECONDS") or os.getenv("POLL_MAX_SECONDS")) else None
+            s = _schedulers[key] = PollScheduler(
+                key,
+                fixed if fixed is not None else _env_float("POLL_MIN_SECONDS", 1.0),
+                fixed if fixed is not None else _env_float("POLL_MAX_SECONDS", 30.0),
+                _env_float("POLL_BACKOFF", 2.0),
+                _env_float("POLL_FAST_SECONDS", 60.0))
+        return s
+
+def expect(key=None, seconds=None):
+    """触发"等验证码"：key 为 None 时所有账号；返回被触发的账号列表"""
+    seconds = _env_float("EXPECT_SECONDS", 120.0) if seconds is None else seconds
+    with _lock:
+        targets = [s for k, s in _schedulers.items() if key is None or k.lower() == key.lower()]
+    for s in targets:
+        s.expect(seconds)
+    return [s.key for s in targets]
+
+def status():
+    with _lock:
+        return {k: s.status() for k, s in _schedulers.items()}
+
+def _expect(q):
+    try:
+        seconds = float(q["seconds"]) if "seconds" in q else None
+    except ValueError:
+        return 400, {"error": "seconds 不是数字"}
+    hit = expect(q.get("user"), seconds)
+    return (200 if hit else 404), {"triggered": hit}
+
+local_http.route("POST", "/expect", _expect)
+local_http.route("GET", "/status", lambda q: (200, status()))
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线回放：把历史邮件（mbox 文件、Maildir、或一个目录下的 .eml 文件）按线上同样的识别路径跑一遍，
+用于调 NEAR_KEYS / OTP_MIN / CODE_REGEX 等参数时的吞吐基准与准确率回归。
+- pop3：email 解析 → find_code（按发件人规则 → 主题 → 正文按需解码），与 POP3 脚本一致
+- imap：头部字段 → 正文部分前 IMAP_BODY_BYTES 字节（与 IMAP 脚本 BODY.PEEK[n]<0.N> 取到的相同）→ find_codes
+- 多进程：默认每个 CPU 核一个工作进程；主进程边读边投递，在途邮件数有上限，几十万封也不会全部读进内存
+- 报告：每秒处理封数、各阶段 CPU 时间、识别到验证码的封数；给出标注文件时按 正确 / 识别错 / 误报 / 漏报 统计
+
+用法：
+python replay_mail.py ~/mail/archive.mbox
+python replay_mail.py ~/Maildir --engine both --labels labels.tsv --show 20
+OTP_MIN=4 NEAR_KEYS_EXTRA=代码 python replay_mail.py ./eml/ --json > run.json   # 识别参数照常用环境变量调
+python replay_mail.py ./eml/ --dump found.tsv                                    # 导出识别结果，人工校对后即可作为标注文件
+
+标注文件：每行 `键<Tab 或逗号>验证码`（验证码留空表示这封不应识别出验证码），或 JSON 对象 {键: 验证码或 null}；
+键用 Message-ID（含尖括号），没有 Message-ID 的邮件用 .eml 文件名、Maildir 键或 mbox 里的序号（mbox:N）。
+"""
+import os, json, time, email, mailbox, argparse, threading, importlib.util
+from multiprocessing import Pool
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ENGINES = ("pop3", "imap")
+
+# ====== 读取 ======
+def detect_format(path):
+    if os.path.isdir(path):
+        return "maildir" if all(os.path.isdir(os.path.join(path, d)) for d in ("cur", "new")) else "eml"
+    return "mbox"
+
+def iter_source(path, fmt):
+    """产出 (来源键, 原始字节)"""
+    if fmt == "mbox":
+        box = mailbox.mbox(path, create=False)
+        for i, key in enumerate(box.iterkeys()):
+            yield f"mbox:{i}", box.get_bytes(key)
+    elif fmt == "maildir":
+        box = mailbox.Maildir(path, factory=None, create=False)
+        for key in sorted(box.iterkeys()):
+            yield key, box.get_bytes(key)
+    else:
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(".eml"):
+                    with open(os.path.join(root, name), "rb") as f:
+                        yield os.path.relpath(os.path.join(root, name), path), f.read()
+
+# ====== 工作进程 ======
+_pop3 = _imap = None
+
+def _init_worker(engines):
+    global _pop3, _imap
+    if "pop3" in engines:
+        spec = importlib.util.spec_from_file_location(
+            "pop3_forwarder", os.path.join(HERE, "2925_to_telegram_pop3_autorefresh.py"))
+        _pop3 = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(_pop3)
+    if "imap" in engines:
+        import imap_idle_forwarder
+        _imap = imap_idle_forwarder
+
+def _imap_part(msg, limit):
+    """模拟 IMAP 脚本的抓取：第一个非附件 text/plain（没有再取 text/html）的原始传输编码字节，截到前 limit 字节"""
+    best = {}
+    for p in msg.walk():
+        if p.get_content_maintype() != "text" or p.get_content_subtype() not in ("plain", "html"):
+            continue
+        if p.get_content_subtype() in best or str(p.get("Content-Disposition") or "").lower().startswith("attachment"):
+            continue
+        # get_payload() 会把 8bit 正文里的非 ASCII 字节换成 U+FFFD；_payload 保留着解析时 surrogateescape 的原始字节
+        payload = p._payload
+        if not isinstance(payload, str):
+            continue
+        data = payload.encode("ascii", "surrogateescape")
+        best[p.get_content_subtype()] = (data[:limit], str(p.get("Content-Transfer-Encoding") or "").strip().lower(),
+                                         p.get_content_charset() or "utf-8", p.get_content_subtype())
+    return best.get("plain") or best.get("html")
+
+def _work(item):
+    """返回 (来源键, Message-ID, {引擎: 验证码或 None}, {阶段: CPU 秒})"""
+    key, raw = item
+    cpu = {}
+    t = time.process_time()
+    msg = email.message_from_bytes(raw)
+    mid = (msg.get("Message-ID") or "").strip()
+    now = time.process_time(); cpu["parse"] = now - t; t = now
+    found, errors = {}, {}
+    if _pop3 is not None:
+        try:
+            found["pop3"] = _pop3.find_code(msg, _pop3.dec(msg.get("Subject")), _pop3.dec(msg.get("From") or ""))
+        except Exception as e:
+            errors["pop3"] = f"{type(e).__name__}: {e}"
+        now = time.process_time(); cpu["pop3"] = now - t; t = now
+    if _imap is not None:
+        try:
+            subject, from_, _, _ = _imap._header_fields(msg)
+            codes = _imap.find_codes(subject, from_, _imap_part(msg, _imap.IMAP_BODY_BYTES))
+            found["imap"] = codes[0] if codes else None
+        except Exception as e:
+            errors["imap"] = f"{type(e).__name__}: {e}"
+        now = time.process_time(); cpu["imap"] = now - t
+    if errors:
+        found["error"] = errors        # 引擎 → 异常；各引擎互不影响，出错的引擎按未识别计
+    return key, mid, found, cpu
+
+# ====== 标注与统计 ======
+def load_labels(path):
+    if path.lower().endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return {k: (v or None) for k, v in json.load(f).items()}
+    labels = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if not line or line.startswith("#"):
+                continue
+            sep = "\t" if "\t" in line else ","
+            k, _, v = line.partition(sep)
+            labels[k.strip()] = v.split(sep)[0].strip() or None
+    return labels
+
+class Report:
+    def __init__(self, engines, labels=None, show=0):
+        self.engines, self.labels, self.show = engines, labels, show
+        self.n = self.labeled = self.errors = 0
+        self.cpu = {}
+        self.found = {e: 0 for e in engines}
+        self.acc = {e: {"ok": 0, "wrong": 0, "false_pos": 0, "missed": 0, "ok_none": 0} for e in engines}
+        self.examples = []
+        self.disagree = 0
+
+    def add(self, key, mid, found, cpu):
+        self.n += 1
+        for stage, v in cpu.items():
+            self.cpu[stage] = self.cpu.get(stage, 0.0) + v
+        errors = found.get("error") or {}
+        self.errors += bool(errors)
+        for e, err in errors.items():
+            self._example(mid or key, e, f"出错：{err}", None)
+        for e in self.engines:
+            if found.get(e):
+                self.found[e] += 1
+        if len(self.engines) > 1 and len({found.get(e) for e in self.engines}) > 1:
+            self.disagree += 1
+        if self.labels is None:
+            return
+        label_key = mid if mid in self.labels else key
+        if label_key not in self.labels:
+            return
+        self.labeled += 1
+        want = self.labels[label_key]
+        for e in self.engines:
+            got = found.get(e)
+            kind = ("ok" if got == want else "wrong") if want and got else \
+                   "missed" if want else "false_pos" if got else "ok_none"
+            self.acc[e][kind] += 1
+            if kind not in ("ok", "ok_none"):
+                self._example(label_key, e, got, want)
+
+    def _example(self, key, engine, got, want):
+        if len(self.examples) < self.show:
+            self.examples.append({"key": key, "engine": engine, "got": got, "want": want})
+
+    def result(self, wall, workers):
+        out = {"messages": self.n, "seconds": round(wall, 3), "workers": workers,
+               "messages_per_second": round(self.n / wall, 1) if wall else None,
+               "cpu_seconds": {k: round(v, 3) for k, v in self.cpu.items()},
+               "cpu_us_per_message": {k: round(1e6 * v / self.n) for k, v in self.cpu.items()} if self.n else {},
+               "codes_found": dict(self.found), "errors": self.errors}
+        if len(self.engines) > 1:
+            out["engines_disagree"] = self.disagree
+        if self.labels is not None:
+            out["labeled"] = self.labeled
+            out["accuracy"] = {}
+            for e, a in self.acc.items():
+                pos = a["ok"] + a["wrong"] + a["missed"]
+                out["accuracy"][e] = dict(a, recall=round(a["ok"] / pos, 4) if pos else None,
+                                          precision=round(a["ok"] / (a["ok"] + a["wrong"] + a["false_pos"]), 4)
+                                          if a["ok"] + a["wrong"] + a["false_pos"] else None)
+        if self.examples:
+            out["examples"] = self.examples
+        return out
+
+def print_report(r):
+    print(f"== 回放 {r['messages']} 封，{r['seconds']}s，{r['workers']} 个进程，{r['messages_per_second']} 封/秒")
+    print("   CPU：" + "，".join(f"{k} {v}s（{r['cpu_us_per_message'].get(k)}µs/封）" for k, v in r["cpu_seconds"].items()))
+    print("   识别到验证码：" + "，".join(f"{e} {n} 封" for e, n in r["codes_found"].items())
+          + (f"；两者不一致 {r['engines_disagree']} 封" if "engines_disagree" in r else "")
+          + (f"；出错 {r['errors']} 封" if r["errors"] else ""))
+    for e, a in (r.get("accuracy") or {}).items():
+        print(f"   [{e}] 已标注 {r['labeled']} 封：正确 {a['ok']}，无码且未识别 {a['ok_none']}，识别错 {a['wrong']}，"
+              f"误报 {a['false_pos']}，漏报 {a['missed']}；precision={a['precision']} recall={a['recall']}")
+    for x in r.get("examples", []):
+        print(f"   - {x['key']} [{x['engine']}] 识别 {x['got']!r}，应为 {x['want']!r}")
+
+# ====== 主程序 ======
+def _bounded(items, sem):
+    """主进程读取速度远快于识别时，Pool 会把整个来源读进队列；这里限制在途数量"""
+    for item in items:
+        sem.acquire()
+        yield item
+
+def main():
+    ap = argparse.ArgumentParser(description="离线回放历史邮件，测吞吐与识别准确率")
+    ap.add_argument("path", help="mbox 文件、Maildir 目录或 .eml 所在目录")
+    ap.add_argument("--format", choices=["auto", "mbox", "maildir", "eml"], default="auto")
+    ap.add_argument("--engine", choices=["pop3", "imap", "both"], default="pop3", help="按哪个脚本的识别路径")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="工作进程数（默认 CPU 核数）")
+    ap.add_argument("--chunk", type=int, default=32, help="每次交给工作进程的邮件数")
+    ap.add_argument("--limit", type=int, default=0, help="最多回放多少封；0=全部")
+    ap.add_argument("--labels", help="标注文件（见文件头说明）")
+    ap.add_argument("--show", type=int, default=10, help="列出多少条识别错误/漏报/误报的样例")
+    ap.add_argument("--dump", help="把识别结果写成 TSV（键、各引擎验证码），可作为标注文件的起点")
+    ap.add_argument("--json", action="store_true", help="报告输出为一行 JSON")
+    args = ap.parse_args()
+
+    fmt = detect_format(args.path) if args.format == "auto" else args.format
+    engines = ENGINES if args.engine == "both" else (args.engine,)
+    report = Report(engines, load_labels(args.labels) if args.labels else None, args.show)
+    items = iter_source(args.path, fmt)
+    if args.limit > 0:
+        items = (x for i, x in zip(range(args.limit), items))
+    sem = threading.BoundedSemaphore(max(1, args.workers) * args.chunk * 4)
+    dump = open(args.dump, "w", encoding="utf-8") if args.dump else None
+    t0 = time.perf_counter()
+    try:
+        with Pool(max(1, args.workers), initializer=_init_worker, initargs=(engines,)) as pool:
+            for key, mid, found, cpu in pool.imap_unordered(_work, _bounded(items, sem), chunksize=args.chunk):
+                sem.release()
+                report.add(key, mid, found, cpu)
+                if dump:
+                    dump.write("\t".join([mid or key] + [found.get(e) or "" for e in engines]) + "\n")
+    finally:
+        if dump:
+            dump.close()
+    r = report.result(time.perf_counter() - t0, max(1, args.workers))
+    if args.json:
+        print(json.dumps(r, ensure_ascii=False))
+    else:
+        print_report(r)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多副本分片（POP3 脚本的多账号模式用）：同一台机器上跑几个副本时，每个账号同一时刻只由一个副本收信，
+某个副本退出/卡死后其余副本在几秒内接管它的账号。
+- 租约和副本心跳存放在去重库所在的 SQLite 文件里（同一个 DEDUP_DB_PATH）：
+  能拿到某个账号租约的副本一定也看得到这个账号的去重记录，接管后不会重复推送
+- 每个副本每 TTL/3 秒续约一次，并按存活副本数均分账号（每个副本最多 ceil(账号数 / 存活副本数) 个）；
+  新副本加入后，持有过多的副本先停掉多出的账号再释放租约，由新副本接手
+- 本地有效期比租约短（TTL × 0.8）：续约失败的副本会先于别人接管之前自行停手；推送前还会再检查一次租约
+- 正常退出时立即释放全部租约，其余副本下一次续约就接管
+
+可选环境变量：
+REPLICA_LEASES=1             # 开启；所有副本指向同一个 DEDUP_DB_PATH、同一份 ACCOUNTS_FILE
+REPLICA_ID=                  # 副本名，默认 主机名-进程号
+REPLICA_LEASE_SECONDS=5      # 租约时长；副本失联后最多这么久被接管
+"""
+import os, math, time, socket, sqlite3, threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS replica (
+    id      TEXT PRIMARY KEY,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lease (
+    account TEXT PRIMARY KEY,
+    owner   TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+class LeaseManager:
+    """租约只由调用 tick() 的线程（副本主循环）续约；holds() 可在任意线程调用"""
+
+    def __init__(self, path, replica_id, ttl=5.0):
+        self.path, self.id, self.ttl = path, replica_id, ttl
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._valid = {}          # 账号 → 本地有效期截止（monotonic）
+        self._releasing = set()   # 为均衡要让出的账号：先停收信，线程退出后再 release()
+
+    def holds(self, account):
+        with self._lock:
+            return account not in self._releasing and time.monotonic() < self._valid.get(account, 0)
+
+    def held(self):
+        with self._lock:
+            now = time.monotonic()
+            return [a for a, t in self._valid.items() if t > now and a not in self._releasing]
+
+    def tick(self, accounts):
+        """心跳 + 续约 + 按均分上限抢占空闲/过期的账号、标记多出的账号待让出；返回本次新拿到的账号"""
+        t_local, now = time.monotonic(), time.time()
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("INSERT OR REPLACE INTO replica VALUES (?, ?)", (self.id, now + self.ttl))
+            db.execute("DELETE FROM replica WHERE expires < ?", (now - 60,))
+            live = db.execute("SELECT COUNT(*) FROM replica WHERE expires >= ?", (now,)).fetchone()[0]
+            db.execute("UPDATE lease SET expires=? WHERE owner=? AND expires>=?", (now + self.ttl, self.id, now))
+            rows = db.execute("SELECT account, owner, expires FROM lease").fetchall()
+            taken = {a for a, o, e in rows if e >= now}
+            owned = [a for a, o, e in rows if o == self.id and e >= now and a in accounts]
+            limit = math.ceil(len(accounts) / max(live, 1))
+            got = []
+            for a in accounts:
+                if len(owned) + len(got) >= limit:
+                    break
+                if a not in taken:
+                    db.execute("INSERT OR REPLACE INTO lease VALUES (?, ?, ?)", (a, self.id, now + self.ttl))
+                    got.append(a)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        with self._lock:
+            lost = [a for a in self._valid if a not in owned]
+            self._releasing &= set(owned)
+            self._valid = {a: t_local + self.ttl * 0.8 for a in owned + got}
+            keep = [a for a in owned if a not in self._releasing]
+            extra = len(owned) - limit - (len(owned) - len(keep))   # 已在让出的不重复计
+            if extra > 0:
+                self._releasing.update(keep[-extra:])
+        for a in lost:
+            print(f"[副本 {self.id}] 失去 {a} 的租约（续约不及时被接管）")
+        for a in got:
+            print(f"[副本 {self.id}] 接管 {a}")
+        return got
+
+    def release(self, account):
+        """收信线程已停止后调用：删掉自己的租约，其他副本下一次续约即可接手"""
+        with self._lock:
+            self._valid.pop(account, None)
+            self._releasing.discard(account)
+        self._db.execute("DELETE FROM lease WHERE account=? AND owner=?", (account, self.id))
+
+    def shutdown(self):
+        """正常退出：释放全部租约并删除心跳"""
+        with self._lock:
+            self._valid.clear()
+            self._releasing.clear()
+        try:
+            self._db.execute("DELETE FROM lease WHERE owner=?", (self.id,))
+            self._db.execute("DELETE FROM replica WHERE id=?", (self.id,))
+        except Exception as e:
+            print(f"[副本 {self.id}] 释放租约失败（其余副本会在租约过期后接管）：", e)
+
+def enabled():
+    return os.getenv("REPLICA_LEASES", "0") == "1"
+
+def open_manager(path):
+    """path：去重库文件（租约与去重记录放在同一个 SQLite 文件里）"""
+    rid = os.getenv("REPLICA_ID", "").strip() or f"{socket.gethostname()}-{os.getpid()}"
+    return LeaseManager(path, rid, float(os.getenv("REPLICA_LEASE_SECONDS", "5")))
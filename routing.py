@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按收件地址路由（POP3 / IMAP 两个转发脚本共用）：同一个邮箱的不同子地址/别名推送到不同团队的 chat，
+一个邮箱只收一遍，不必每个团队各跑一个转发脚本。
+
+路由文件（JSON，ROUTES_FILE，默认 routes.json；文件不存在时全部发到默认 chat，与之前相同）：
+[
+  {"name": "team-a", "to": ["teama@2925.com", "teama-*@2925.com"], "chats": ["-1001111", "-1002222"]},
+  {"name": "ops",    "to": "*ops*@2925.com", "chats": "-1003333"}
+]
+- to：完整地址，或含 * ? 的通配模式（不区分大小写），可以是列表；按 To / Cc / Delivered-To / X-Original-To 匹配
+- 一封邮件命中多条路由时发到所有命中的 chat（去重）；一条也没命中时发到默认 chat（TELEGRAM_CHAT_ID / TG_CHAT_ID / 账号的 chat）
+- 加载时一次编译：完整地址进字典直接查，通配模式编译成正则；热加载见 hot_reload.py（ROUTES_CHECK 秒检查一次修改时间）
+- 多个 chat 各自入发送队列并行发送（发送线程数自动不少于扇出数），加一个目的地不会拖慢其他目的地；
+  开启指标时按路由记录 mail2tg_route_delivery_seconds / mail2tg_route_sent_total / mail2tg_route_failed_total
+"""
+import re, time, fnmatch, threading
+from email.utils import getaddresses
+from hot_reload import HotFile
+import metrics
+
+RECIPIENT_HEADERS = ("To", "Cc", "Delivered-To", "X-Original-To")
+MAX_FAN_OUT_WORKERS = 32
+
+class RouteTable:
+    def __init__(self, exact=None, patterns=None):
+        self.exact = exact or {}            # 小写地址 → [(路由名, chat)]
+        self.patterns = patterns or []      # [(正则, [(路由名, chat)])]
+
+    def lookup(self, addrs):
+        out = []
+        for a in addrs:
+            out += self.exact.get(a, ())
+            for rx, targets in self.patterns:
+                if rx.match(a):
+                    out += targets
+        seen, uniq = set(), []
+        for name, chat in out:
+            if chat not in seen:
+                seen.add(chat)
+                uniq.append((name, chat))
+        return uniq
+
+def compile_routes(items):
+    """路由列表 → RouteTable；格式错误抛 ValueError"""
+    if not isinstance(items, list):
+        raise ValueError("路由文件应为 JSON 数组")
+    exact, patterns = {}, {}
+    for i, item in enumerate(items):
+        to = item.get("to") if isinstance(item, dict) else None
+        chats = item.get("chats") if isinstance(item, dict) else None
+        to = [to] if isinstance(to, str) else to
+        chats = [chats] if isinstance(chats, (str, int)) else chats
+        if not to or not chats:
+            raise ValueError(f"第 {i + 1} 条路由缺少 to 或 chats")
+        name = str(item.get("name") or to[0])
+        targets = [(name, str(c)) for c in chats]
+        for t in to:
+            t = t.strip().lower()
+            if any(ch in t for ch in "*?["):
+                patterns.setdefault(t, []).extend(targets)
+            else:
+                exact.setdefault(t, []).extend(targets)
+    return RouteTable(exact, [(re.compile(fnmatch.translate(p)), ts) for p, ts in patterns.items()])
+
+_routes = HotFile("路由", "ROUTES_FILE", "routes.json", "ROUTES_CHECK", compile_routes, RouteTable,
+                   lambda t: f"{len(t.exact)} 个地址、{len(t.patterns)} 个通配模式", "全部发到默认 chat")
+
+def recipients(msg):
+    """邮件头里的全部收件地址（小写）"""
+    vals = []
+    for h in RECIPIENT_HEADERS:
+        vals += [str(v) for v in (msg.get_all(h) or ())]
+    return [a.lower() for _, a in getaddresses(vals) if a]
+
+def targets(msg, default_chat):
+    """返回 [(路由名, chat)]；没有路由命中时为 [("default", 默认 chat)]（默认 chat 为空时返回空列表）"""
+    table = _routes.get()
+    hit = table.lookup(recipients(msg)) if msg is not None and (table.exact or table.patterns) else []
+    if hit:
+        return hit
+    return [("default", str(default_chat))] if default_chat else []
+
+def fan_out(delivery, dests, texts, on_done=None):
+    """各 chat 各自入队并行发送；on_done(ok) 只回调一次：第一个目的地发送成功时，或全部失败之后"""
+    if len(dests) > 1:
+        delivery.ensure_workers(min(len(dests), MAX_FAN_OUT_WORKERS))
+    t0 = time.monotonic()
+    state = {"left": len(dests), "done": False}
+    lock = threading.Lock()
+
+    def finished(name, ok):
+        metrics.observe("route_delivery_seconds", time.monotonic() - t0, route=name)
+        metrics.inc("route_sent_total" if ok else "route_failed_total", route=name)
+        with lock:
+            state["left"] -= 1
+            fire = not state["done"] and (ok or state["left"] == 0)
+            if fire:
+                state["done"] = True
+        if fire and on_done:
+            on_done(ok)
+
+    for name, chat in dests:
+        delivery.submit(chat, *texts, on_done=lambda ok, name=name: finished(name, ok))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+验证码识别的回归测试（python -m pytest test_extract_code.py 或 python test_extract_code.py）：
+- 一次扫描的 _scan_code 与原来逐候选开窗口扫描的 extract_code 在随机文本上结果完全一致
+- TOP 只取到前几行时 find_code(complete=False) 要么给出与整封相同的验证码，要么返回 None 交给 RETR
+"""
+import os, re, random, unittest, importlib.util
+from email.message import EmailMessage
+
+os.environ["CODE_RULES_FILE"] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "no_such_rules.json")
+_spec = importlib.util.spec_from_file_location(
+    "pop3_forwarder", os.path.join(os.path.dirname(os.path.abspath(__file__)), "2925_to_telegram_pop3_autorefresh.py"))
+pop3 = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(pop3)
+
+def window_extract_code(body, subject=""):
+    """原来的实现：每个候选在前后各 200 字符里找 URL/邮箱，在 WINDOW_NEAR 窗口里找关键词"""
+    hay = (subject or "") + "\n" + (body or "")
+    for m in pop3.CODE_RE.finditer(hay):
+        s, e = m.span()
+        if not pop3.ALLOW_CODE_IN_URL:
+            win, base, _ = pop3._slice(hay, s, e, extra=200)
+            if any(pop3._overlaps(s, e, base + u.start(), base + u.end()) for u in pop3._URL_RE.finditer(win)):
+                continue
+            if pop3._in_email(hay, s, e):
+                continue
+        wlow = pop3._slice(hay, s, e, extra=pop3.WINDOW_NEAR)[0].lower()
+        if not any(k in wlow for k in pop3.NEAR_KEYS) or any(k in wlow for k in pop3.NEG_KEYS):
+            continue
+        return re.sub(r"[\s-]", "", m.group())
+    return None
+
+PIECES = ["验证码", "Verification code", "OTP", "账单", "invoice", "$", "İstanbul", "ΣΑΣ", "https://x.com/a?c=",
+          "http://", "user@mail.example.com", "a.b@c", "<", ">", '"', "\n", " ", "-", "：", "is", "您的", "order"]
+
+def random_text(rnd):
+    out = []
+    for _ in range(rnd.randint(1, 30)):
+        r = rnd.random()
+        if r < 0.3:
+            digits = "".join(rnd.choice("0123456789") for _ in range(rnd.randint(3, 10)))
+            if rnd.random() < 0.3:
+                digits = rnd.choice([" ", "-"]).join(digits[i:i + 3] for i in range(0, len(digits), 3))
+            out.append(digits)
+        elif r < 0.7:
+            out.append(rnd.choice(PIECES))
+        else:
+            out.append("x" * rnd.randint(1, 250))
+    return rnd.choice(["", " "]).join(out)
+
+def make_msg(subject, body):
+    m = EmailMessage()
+    m["Subject"], m["From"], m["To"] = subject, "noreply@example.com", "me@2925.com"
+    m.set_content(body, cte=random.Random(body).choice(["8bit", "quoted-printable", "base64"]))
+    return m.as_bytes().replace(b"\r\n", b"\n").replace(b"\n", b"\r\n")
+
+def top(raw, n):
+    """模拟 TOP n：全部邮件头 + 正文前 n 行"""
+    head, _, body = raw.partition(b"\r\n\r\n")
+    return head + b"\r\n\r\n" + b"\r\n".join(body.split(b"\r\n")[:n])
+
+class ExtractCodeTest(unittest.TestCase):
+    def test_scan_matches_window_scan(self):
+        rnd = random.Random(20240501)
+        for _ in range(3000):
+            subject, body = random_text(rnd) if rnd.random() < 0.3 else "", random_text(rnd)
+            self.assertEqual(pop3.extract_code(body, subject), window_extract_code(body, subject), (subject, body))
+
+    def test_top_partial_agrees_with_full(self):
+        rnd = random.Random(20240502)
+        for _ in range(200):
+            subject = random_text(rnd).replace("\n", " ") if rnd.random() < 0.3 else "hello"
+            body = "\n".join(random_text(rnd) for _ in range(rnd.randint(1, 40)))
+            raw = make_msg(subject, body)
+            full = pop3.find_code(pop3.email.message_from_bytes(raw), subject, "noreply@example.com")
+            for n in (0, 1, 3, 10, 1000):
+                msg = pop3.email.message_from_bytes(top(raw, n))
+                got = pop3.find_code(msg, subject, "noreply@example.com", complete=False)
+                self.assertIn(got, (None, full), (n, subject, body))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Telegram 推送子系统（POP3 / IMAP 两个转发脚本共用）：
+- requests.Session 连接池 + keep-alive：不再每条消息新建一次 TLS 连接
+- 出站队列 + 工作线程：抓信循环只负责入队，永远不会因为 Telegram 变慢或 429 而阻塞
+- 令牌桶限速：每个 chat 一个桶 + 全局一个桶；429 时按 retry_after 只暂停对应 chat
+- 队列积压时把"元信息 + 验证码"两条合并成一条发送
+
+可选环境变量：
+TG_API_BASE=https://api.telegram.org
+TG_WORKERS=4                 # 发送线程数（不同 chat 可并行）
+TG_CHAT_RATE=1               # 每个 chat 每秒条数（Telegram 建议单聊 ≈1 条/秒）
+TG_CHAT_BURST=3              # 每个 chat 允许的突发条数
+TG_GLOBAL_RATE=30            # 全局每秒条数（Telegram 上限约 30 条/秒）
+TG_MERGE_BACKLOG=5           # 待发任务 ≥ N 时合并两条消息；0=从不合并
+TG_MAX_ATTEMPTS=5            # 单条消息最多尝试次数（429 也计入）
+TG_QUEUE_MAX=1000            # 待发任务上限；满了 submit 阻塞（背压传回解析线程）
+"""
+import os, time, heapq, atexit, itertools, threading
+from collections import deque
+import requests
+import metrics
+from requests.adapters import HTTPAdapter
+
+class TokenBucket:
+    """非线程安全，由 TgDelivery 的锁保护"""
+
+    def __init__(self, rate, burst):
+        self.rate = max(float(rate), 1e-6)
+        self.burst = max(float(burst), 1.0)
+        self.tokens = self.burst
+        self.ts = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+
+    def wait_time(self, now):
+        """还要等多久才有一个令牌（0=现在就有）"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+class _Job:
+    __slots__ = ("chat", "texts", "attempt", "on_done", "ok")
+
+    def __init__(self, chat, texts, on_done=None):
+        self.chat = str(chat)
+        self.texts = list(texts)
+        self.attempt = 0
+        self.on_done = on_done
+        self.ok = True
+
+class TgDelivery:
+    def __init__(self, token, proxy=None, workers=None):
+        self.token = token
+        self.url = f"{os.getenv('TG_API_BASE', 'https://api.telegram.org').rstrip('/')}/bot{token}/sendMessage"
+        workers = workers or int(os.getenv("TG_WORKERS", "4"))
+        self.chat_rate = float(os.getenv("TG_CHAT_RATE", "1"))
+        self.chat_burst = float(os.getenv("TG_CHAT_BURST", "3"))
+        self.merge_backlog = int(os.getenv("TG_MERGE_BACKLOG", "5"))
+        self.max_attempts = int(os.getenv("TG_MAX_ATTEMPTS", "5"))
+        self.max_pending = int(os.getenv("TG_QUEUE_MAX", "1000"))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 1))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if proxy:
+            self.session.proxies.update({"http": proxy, "https": proxy})
+
+        self._cv = threading.Condition()
+        self._queues = {}                    # chat → deque[任务]；同一 chat 严格按入队顺序发送
+        self._ready = []                     # (可发送时间, 序号, chat)：有待发任务且没在发送中的 chat
+        self._seq = itertools.count()
+        self._pending = 0
+        self._closing = False
+        self._global = TokenBucket(float(os.getenv("TG_GLOBAL_RATE", "30")), float(os.getenv("TG_GLOBAL_BURST", "30")))
+        self._chats = {}                     # chat → TokenBucket
+        self._blocked = {}                   # chat → 429 解除时间
+        self.stats = {"sent": 0, "failed": 0, "merged": 0, "rate_limited": 0}
+        self._threads = [threading.Thread(target=self._worker, name=f"tg-send-{i}", daemon=True)
+                         for i in range(max(workers, 1))]
+        for t in self._threads:
+            t.start()
+        atexit.register(self.close, 5)
+
+    # —— 入队（调用方线程，立即返回）
+    def submit(self, chat, *texts, on_done=None):
+        """按顺序发送若干条消息（同一 chat 保序）；on_done(ok) 在全部发送结束后回调"""
+        job = _Job(chat, [t for t in texts if t], on_done)
+        if not job.texts:
+            return
+        with self._cv:
+            if self.max_pending > 0 and self._pending >= self.max_pending:
+                metrics.inc("backpressure_total", stage="send")
+                while self._pending >= self.max_pending and not self._closing:
+                    self._cv.wait()
+            q = self._queues.get(job.chat)
+            if q is None:
+                q = self._queues[job.chat] = deque()
+            q.append(job)
+            self._pending += 1
+            if len(q) == 1:                  # 之前空闲：排进就绪堆；否则由发送线程接力
+                heapq.heappush(self._ready, (time.monotonic(), next(self._seq), job.chat))
+                self._cv.notify()
+
+    def ensure_workers(self, n):
+        """扇出到 n 个 chat（routing.py）时至少 n 个发送线程，各 chat 才能同时在途"""
+        with self._cv:
+            if len(self._threads) >= n or self._closing:
+                return
+            # 连接池随线程数放大（换上新的 adapter；旧 adapter 上在途的请求照常完成）
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=n)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+            while len(self._threads) < n:
+                t = threading.Thread(target=self._worker, name=f"tg-send-{len(self._threads)}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def backlog(self):
+        with self._cv:
+            return self._pending
+
+    def flush(self, timeout=None):
+        """等待队列发完；返回是否在超时前清空"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cv:
+            while self._pending:
+                left = None if deadline is None else deadline - time.monotonic()
+                if left is not None and left <= 0:
+                    return False
+                self._cv.wait(left)
+        return True
+
+    def close(self, timeout=5):
+        self.flush(timeout)
+        with self._cv:
+            self._closing = True
+            self._cv.notify_all()
+
+    # —— 同步发送一条（启动通知等非热路径使用），返回 (状态码, retry_after, 错误文本)
+    def post(self, chat, text):
+        try:
+            with metrics.timer("send"):
+                resp = self.session.post(self.url, json={"chat_id": chat, "text": text}, timeout=10)
+        except requests.RequestException as e:
+            return None, None, str(e)
+        retry_after = None
+        if resp.status_code == 429:
+            try:
+                retry_after = resp.json().get("parameters", {}).get("retry_after")
+            except Exception:
+                retry_after = None
+        return resp.status_code, retry_after, "" if resp.ok else resp.text
+
+    def _bucket(self, chat):
+        b = self._chats.get(chat)
+        if b is None:
+            b = self._chats[chat] = TokenBucket(self.chat_rate, self.chat_burst)
+        return b
+
+    def _next_job(self):
+        """取下一个"已到期且令牌允许"的 chat 的队首任务；没有就等待。返回 (任务, 是否合并) 或 None（已关闭）"""
+        with self._cv:
+            while True:
+                if not self._ready:
+                    if self._closing:
+                        return None
+                    self._cv.wait()
+                    continue
+                due, seq, chat = self._ready[0]
+                now = time.monotonic()
+                if due > now:
+                    self._cv.wait(due - now)
+                    continue
+                wait = max(self._global.wait_time(now), self._bucket(chat).wait_time(now),
+                           self._blocked.get(chat, 0) - now)
+                if wait > 0:
+                    # 该 chat 被限速：推迟它，让其他 chat 先走
+                    heapq.heapreplace(self._ready, (now + wait, seq, chat))
+                    continue
+                heapq.heappop(self._ready)   # 发送期间该 chat 不在就绪堆里：同一 chat 同时只有一条在途
+                self._global.take(now)
+                self._bucket(chat).take(now)
+                q = self._queues[chat]
+                job = q[0]
+                merge = len(job.texts) > 1 and self.merge_backlog > 0 and len(q) >= self.merge_backlog
+                return job, merge
+
+    def _worker(self):
+        while True:
+            got = self._next_job()
+            if got is None:
+                return
+            job, merge = got
+            text = "\n".join(job.texts) if merge else job.texts[0]
+            status, retry_after, err = self.post(job.chat, text)
+            delay = 0
+            with self._cv:
+                now = time.monotonic()
+                if status is not None and 200 <= status < 300:
+                    self.stats["sent"] += 1
+                    metrics.inc("telegram_sent_total")
+                    if merge:
+                        self.stats["merged"] += 1
+                    del job.texts[:len(job.texts) if merge else 1]
+                    job.attempt = 0
+                else:
+                    job.attempt += 1
+                    if status == 429:
+                        self.stats["rate_limited"] += 1
+                        metrics.inc("telegram_429_total")
+                        wait = retry_after if isinstance(retry_after, (int, float)) else 1
+                        self._blocked[job.chat] = now + max(1, wait)
+                        delay = max(1, wait)
+                    else:
+                        delay = min(2 ** job.attempt, 30)
+                    if job.attempt >= self.max_attempts:
+                        # 放弃这一条，继续发同一任务的下一条（元信息失败也照发验证码）
+                        self.stats["failed"] += 1
+                        metrics.inc("telegram_failed_total")
+                        job.ok = False
+                        print(f"Telegram 推送失败（chat {job.chat}）：{status or ''} {err}".strip())
+                        del job.texts[:len(job.texts) if merge else 1]
+                        job.attempt = 0
+                        delay = 0
+                    else:
+                        print(f"Telegram 推送失败（第 {job.attempt} 次）：{status or ''} {err}，{delay} 秒后重试…")
+                q = self._queues[job.chat]
+                done = not job.texts
+                if done:
+                    q.popleft()
+                    self._pending -= 1
+                if q:
+                    heapq.heappush(self._ready, (now + delay, next(self._seq), job.chat))
+                else:
+                    del self._queues[job.chat]
+                self._cv.notify_all()
+            if done and job.on_done:
+                try:
+                    job.on_done(job.ok)
+                except Exception as e:
+                    print("推送回调异常：", e)
+
+_deliveries = {}
+_deliveries_lock = threading.Lock()
+
+def get_delivery(token, proxy=None):
+    """同一 (token, proxy) 在进程内共用一个连接池、队列和全局限速"""
+    key = (token, proxy or None)
+    with _deliveries_lock:
+        d = _deliveries.get(key)
+        if d is None:
+            d = _deliveries[key] = TgDelivery(token, proxy)
+        return d
+
+def flush_all(timeout=None):
+    """等所有发送队列发完（退出时用）；返回是否全部在超时前发完"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with _deliveries_lock:
+        deliveries = list(_deliveries.values())
+    ok = True
+    for d in deliveries:
+        left = None if deadline is None else max(0.0, deadline - time.monotonic())
+        ok = d.flush(left) and ok
+    return ok